@@ -1,26 +1,43 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional, Union, Literal
 from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
 from langchain.llms.base import BaseLLM
 import sys
 import os
-from langchain.chat_models import init_chat_model
 # 添加项目根目录到 Python 路径
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
 # 使用绝对导入替代相对导入
 from backend.database.loader import DocumentLoader
 from backend.agents.tools import WebTools, GetFullText
+from backend.agents.query_router import QueryRouter, NEED_SEARCH, NEED_FULL_TEXT
+from backend.agents.citations import format_numbered_sources, apply_citations
+from backend.agents.model_registry import get_routed_model
+from backend.agents.tracing import trace_run, span, traced, with_context
+from backend.agents.usage import UsageBudget, UsageMeter, BUDGET_DEGRADE, current_meter, metering
+from backend.agents.context_packer import pack_context
+from backend.agents.cancellation import CancellationToken
 
 class ChatSearchAgent:
     """聊天搜索代理，可以根据问题生成响应，判断是否需要搜索，处理搜索结果"""
     
-    def __init__(self, llm: BaseLLM, persist_directory: str = "./chroma_db"):
+    def __init__(self, llm: BaseLLM, persist_directory: str = "./chroma_db", router: Optional[QueryRouter] = None,
+                 budget: Optional[UsageBudget] = None, context_tokens: Optional[int] = None):
         self.llm = llm
+        # 每轮问答的用量预算，默认从环境变量CHAT_TOKEN_BUDGET、CHAT_COST_BUDGET、CHAT_BUDGET_MODE读取
+        self.budget = budget or UsageBudget.from_env("CHAT")
+        # 回答提示词中全文的token数上限，默认从环境变量CHAT_CONTEXT_TOKENS读取
+        self.context_tokens = context_tokens or int(os.getenv("CHAT_CONTEXT_TOKENS", "3000"))
+        # 本地路由：高置信度时直接判断是否需要搜索/获取全文，省去LLM往返
+        self.router = router or QueryRouter()
         self.document_loader = DocumentLoader(persist_directory=persist_directory)
         self.web_tools = WebTools()  # 初始化WebTools
         self.search_tool = self.web_tools.get_search_tool()  # 获取搜索工具
         self.full_text_tool = GetFullText()  # 初始化获取全文工具
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="chat-search")  # aprocess_query的阻塞调用
         
         # 初始化判断是否需要搜索的Chain
         self.need_search_prompt = PromptTemplate(
@@ -55,57 +72,25 @@ class ChatSearchAgent:
         )
         self.need_full_text_chain = LLMChain(llm=llm, prompt=self.need_full_text_prompt)
         
-        # 初始化生成最终回答的Chain
+        # 初始化生成最终回答的Chain，信息来源预先编号，引用标记在本地校验和整理
         self.final_answer_prompt = PromptTemplate(
-            input_variables=["query", "search_results", "knowledge_base_results", "full_text"],
+            input_variables=["query", "sources"],
             template="""
             用户问题: {query}
             
-            搜索结果:
-            {search_results}
-            
-            知识库检索结果:
-            {knowledge_base_results}
-            
-            全文内容(如果有):
-            {full_text}
+            信息来源（来自网络搜索和知识库，已编号）:
+            {sources}
             
             请根据以上信息，生成一个全面、准确的回答。回答应该:
             1. 直接回应用户问题，不要添加任何解释性文字
             2. 综合搜索结果和知识库信息
-            3. 在回答中适当位置添加引用标记，如[1]、[2]等，表明信息来源。引用标记要和后面参考来源一一对应。
+            3. 在回答中适当位置添加引用标记，如[1]、[2]等，编号必须使用上面信息来源的编号
             4. 保持客观、准确，避免臆测
             5. 确保在回答中的每个关键信息点都有对应的引用标记
-            6. 确保所有引用的来源在参考来源中都有对应条目
+            6. 不要在回答末尾列出参考来源，来源列表会自动生成
             """
         )
         self.final_answer_chain = LLMChain(llm=llm, prompt=self.final_answer_prompt)
-        
-        # 初始化生成引用索引的Chain
-        self.citation_prompt = PromptTemplate(
-            input_variables=["answer", "sources"],
-            template="""
-            回答内容: {answer}
-            
-            信息来源:
-            {sources}
-            
-            请为上述回答生成适当的引用索引，并确保回答中已经包含了对应的引用标记。
-            
-            要求：
-            1. 检查回答中是否已经包含了引用标记（如[1]、[2]等）
-            2. 如果回答中缺少引用标记，请在适当位置添加，确保每个关键信息点都有引用
-            3. 生成完整的参考来源列表，格式如下：
-               [1] 来源标题, URL或文档名称
-               [2] 来源标题, URL或文档名称
-            4. 确保回答中的引用标记与参考来源列表一一对应
-            5. 如果多处引用同一篇文章，使用相同的引用标号
-            6. 所有引用必须来源于提供的知识库或网络搜索结果，不得编造引用
-            
-            请返回修改后的完整回答（包含引用标记）和参考来源列表。
-            """
-        )
-        self.citation_chain = LLMChain(llm=llm, prompt=self.citation_prompt)
     
     def process_query(self, query: str, search_mode: Union[Literal["auto"], Literal["web"], Literal["knowledge_base"]] = "auto") -> Dict[str, Any]:
         """处理用户查询，返回完整的回答和相关信息
@@ -117,13 +102,22 @@ class ChatSearchAgent:
                 - "web": 强制使用网络搜索
                 - "knowledge_base": 只使用知识库搜索
         """
+        # 每次问答是一次追踪运行，各阶段耗时写入追踪文件；模型调用计入本轮的用量
+        meter = UsageMeter(self.budget)
+        with trace_run("chat", search_mode=search_mode), metering(meter):
+            result = self._process_query(query, search_mode)
+        result["usage"] = meter.summary()
+        return result
+
+    def _process_query(self, query: str, search_mode: str) -> Dict[str, Any]:
+        """process_query的主体，在追踪运行中执行"""
         need_search = False
         
         # 根据搜索模式决定是否进行网络搜索
         if search_mode == "auto":
             # 自动判断是否需要搜索
-            need_search_response = self.need_search_chain.run(query=query).strip().lower()
-            need_search = need_search_response == "是"
+            with span("chat.decide_search"):
+                need_search = self._decide_need_search(query)
         elif search_mode == "web":
             # 强制使用网络搜索
             need_search = True
@@ -136,18 +130,15 @@ class ChatSearchAgent:
         # 如果需要搜索，执行搜索
         if need_search:
             # 使用search_tool进行搜索
-            search_results_text = self.search_tool.run(query)
+            with span("tool.web_search"):
+                search_results_text = self.search_tool.run(query)
             
             # 解析搜索结果文本为结构化数据
             search_results = self._parse_search_results(search_results_text)
             
             # 判断是否需要获取全文
-            need_full_text_response = self.need_full_text_chain.run(
-                query=query, 
-                search_results=search_results_text
-            ).strip().lower()
-            
-            need_full_text = need_full_text_response == "是"
+            with span("chat.decide_full_text"):
+                need_full_text = self._decide_need_full_text(query, search_results_text)
             
             # 如果需要获取全文，获取全文
             if need_full_text and search_results:
@@ -157,47 +148,133 @@ class ChatSearchAgent:
                     full_text = self.full_text_tool.run(first_url)
         
         # 从知识库检索相关内容
-        knowledge_base_results = self.document_loader.search_documents(query, n_results=3)
-        knowledge_base_text = self._format_knowledge_base_results(knowledge_base_results)
+        with span("chroma.query", n_results=3):
+            knowledge_base_results = self.document_loader.search_documents(query, n_results=3)
+        
+        # 准备带编号的信息来源
+        full_text = self._full_text_within_budget(query, full_text)
+        sources = self._collect_sources(search_results, knowledge_base_results, full_text)
         
         # 生成最终回答
-        final_answer = self.final_answer_chain.run(
-            query=query,
-            search_results=self._format_search_results(search_results),
-            knowledge_base_results=knowledge_base_text,
-            full_text=full_text
+        with span("chat.answer", sources=len(sources)):
+            final_answer = self._budget_stopped_answer() or self.final_answer_chain.run(
+                query=query,
+                sources=format_numbered_sources(sources)
+            )
+        
+        # 在本地校验、重新编号引用标记并生成参考来源列表
+        final_answer, citation = apply_citations(final_answer, sources)
+        
+        # 返回结果
+        return self._build_result(query, final_answer, citation, search_results, knowledge_base_results,
+                                  full_text, need_search, need_full_text)
+
+    async def aprocess_query(self, query: str, search_mode: Union[Literal["auto"], Literal["web"], Literal["knowledge_base"]] = "auto") -> Dict[str, Any]:
+        """process_query的异步版本，互不依赖的检索阶段并发执行
+        
+        知识库检索一开始就启动；自动模式下本地路由无法确定时，LLM判断与网络搜索同时进行；
+        拿到搜索结果后立即推测性地获取第一条结果的全文，与是否需要全文的判断并行。
+        端到端延迟因此取决于关键路径，而不是各阶段耗时之和。
+        
+        Args:
+            query: 用户查询
+            search_mode: 搜索模式，同process_query
+        """
+        meter = UsageMeter(self.budget)
+        with trace_run("chat", search_mode=search_mode, concurrent=True), metering(meter):
+            result = await self._aprocess_query(query, search_mode)
+        result["usage"] = meter.summary()
+        return result
+
+    async def _aprocess_query(self, query: str, search_mode: str) -> Dict[str, Any]:
+        """aprocess_query的主体，在追踪运行中执行；并发的阶段在追踪中是互相重叠的兄弟span"""
+        # 知识库检索不依赖其他阶段，最先启动
+        knowledge_base_task = asyncio.ensure_future(
+            self._run_blocking(traced("chroma.query")(self.document_loader.search_documents), query, 3)
         )
+        search_task = None
         
-        # 准备信息来源
-        sources = []
-        if search_results:
-            sources.extend([{"title": result.get("title", "未知"), "url": result.get("url", "未知")} 
-                           for result in search_results])
-        if knowledge_base_results:
-            sources.extend([{"title": result.get("metadata", {}).get("title", "未知"), 
-                            "url": result.get("metadata", {}).get("source", "未知"),
-                            "content": result.get("content", "未知")}
-                           for result in knowledge_base_results])
+        # 根据搜索模式决定是否进行网络搜索
+        need_search = False
+        if search_mode == "auto":
+            need_search, _ = self.router.predict_need_search(query)
+            if need_search is None:
+                # 本地路由无法确定：推测性地先开始搜索，同时等待LLM判断
+                search_task = asyncio.ensure_future(self._run_blocking(traced("tool.web_search")(self.search_tool.run), query))
+                need_search = await self._adecide_need_search(query)
+        elif search_mode == "web":
+            need_search = True
         
-        # 去除重复的信息来源
-        unique_sources = self._deduplicate_sources(sources)
+        search_results = []
+        full_text = ""
+        need_full_text = False
         
-        # 生成带有引用的回答和引用列表
-        if unique_sources:
-            formatted_sources = self._format_sources_for_citation(unique_sources)
-            citation_result = self.citation_chain.run(
-                answer=final_answer,
-                sources=formatted_sources
-            )
+        if need_search:
+            if search_task is None:
+                search_task = asyncio.ensure_future(self._run_blocking(traced("tool.web_search")(self.search_tool.run), query))
+            search_results_text = await search_task
+            search_results = self._parse_search_results(search_results_text)
             
-            # 解析结果，提取更新后的回答和引用
-            updated_answer, citation = self._parse_citation_result(citation_result)
-            if updated_answer:
-                final_answer = updated_answer
-        else:
-            citation = ""
+            # 推测性地获取第一个结果的全文，同时判断是否真的需要；不需要时通过取消令牌中断下载
+            full_text_task = None
+            fetch_token = CancellationToken()
+            first_url = search_results[0].get("url", "") if search_results else ""
+            if first_url:
+                full_text_task = asyncio.ensure_future(self._run_blocking(self.full_text_tool.fetch, first_url, fetch_token))
+            
+            need_full_text = await self._adecide_need_full_text(query, search_results_text)
+            if full_text_task is not None:
+                if need_full_text:
+                    full_text = await full_text_task
+                else:
+                    fetch_token.cancel()
+                    full_text_task.cancel()
+        elif search_task is not None:
+            # 推测的搜索结果用不上
+            search_task.cancel()
         
-        # 返回结果
+        knowledge_base_results = await knowledge_base_task
+        full_text = self._full_text_within_budget(query, full_text)
+        sources = self._collect_sources(search_results, knowledge_base_results, full_text)
+        
+        # 生成最终回答
+        final_answer = self._budget_stopped_answer() or await self._run_blocking(
+            traced("chat.answer")(self.final_answer_chain.run),
+            query=query,
+            sources=format_numbered_sources(sources)
+        )
+        final_answer, citation = apply_citations(final_answer, sources)
+        
+        return self._build_result(query, final_answer, citation, search_results, knowledge_base_results,
+                                  full_text, need_search, need_full_text)
+
+    def _full_text_within_budget(self, query: str, full_text: str) -> str:
+        """全文超出context_tokens时只保留与问题最相关的段落；本轮已超出用量预算且为降级模式时不把全文放进回答提示词"""
+        meter = current_meter()
+        if full_text and meter is not None and meter.exceeded and meter.budget.mode == BUDGET_DEGRADE:
+            return ""
+        return pack_context(full_text, query, self.context_tokens)
+
+    def _budget_stopped_answer(self) -> Optional[str]:
+        """本轮已超出用量预算且为停止模式时返回代替回答的提示，否则返回None"""
+        meter = current_meter()
+        if meter is not None and meter.exceeded and meter.budget.mode != BUDGET_DEGRADE:
+            return f"本轮问答{meter.exceeded_reason}，已停止生成回答。"
+        return None
+
+    def _run_blocking(self, func, *args, **kwargs) -> asyncio.Future:
+        """在专用线程池中执行阻塞调用
+        
+        不使用默认线程池：被取消的推测性任务仍在运行时，asyncio.run退出不必等待它们。
+        模型调用也在这里以同步方式执行，从而复用注册表中共享的连接池；
+        每次asyncio.run都会新建事件循环，异步连接无法跨循环复用。
+        run_in_executor不传递上下文，这里显式绑定，使线程中打开的span挂在当前span下。
+        """
+        return asyncio.get_running_loop().run_in_executor(self._executor, with_context(functools.partial(func, *args, **kwargs)))
+
+    def _build_result(self, query: str, final_answer: str, citation: str, search_results: List[Dict],
+                      knowledge_base_results: List[Dict], full_text: str, need_search: bool, need_full_text: bool) -> Dict[str, Any]:
+        """组装process_query/aprocess_query的返回结果"""
         return {
             "query": query,
             "answer": final_answer,
@@ -208,37 +285,75 @@ class ChatSearchAgent:
             "needed_search": need_search,
             "needed_full_text": need_full_text if need_search else False
         }
-    
-    def _format_search_results(self, results: List[Dict]) -> str:
-        """格式化搜索结果为文本"""
-        if not results:
-            return "没有找到相关搜索结果。"
+
+    def _collect_sources(self, search_results: List[Dict], knowledge_base_results: List[Dict], full_text: str = "") -> List[Dict]:
+        """汇总网络搜索和知识库的信息来源并去重，列表顺序即提示词中的来源编号
         
-        formatted_text = ""
-        for i, result in enumerate(results):
-            formatted_text += f"结果 {i+1}:\n"
-            formatted_text += f"标题: {result.get('title', '未知')}\n"
-            formatted_text += f"摘要: {result.get('snippet', '无摘要')}\n"
-            formatted_text += f"内容: {result.get('content', '无内容')}\n"
-            formatted_text += f"URL: {result.get('url', '未知')}\n\n"
-       
+        获取到的全文附在第一个网络搜索结果上。
+        """
+        sources = []
+        if search_results:
+            sources.extend([{"title": result.get("title", "未知"), 
+                             "url": result.get("url", "未知"),
+                             "content": result.get("snippet", "")}
+                           for result in search_results])
+            if full_text:
+                sources[0]["full_text"] = full_text
+        if knowledge_base_results:
+            sources.extend([{"title": result.get("metadata", {}).get("title", "未知"), 
+                            "url": result.get("metadata", {}).get("source", "未知"),
+                            "content": result.get("content", "未知")}
+                           for result in knowledge_base_results])
         
-        return formatted_text
+        # 去除重复的信息来源
+        return self._deduplicate_sources(sources)
     
-    def _format_knowledge_base_results(self, results: List[Dict]) -> str:
-        """格式化知识库检索结果为文本"""
-        if not results:
-            return "知识库中没有找到相关信息。"
-        
-        formatted_text = ""
-        for i, result in enumerate(results):
-            formatted_text += f"知识库结果 {i+1}:\n"
-            formatted_text += f"标题: {result.get('metadata', {}).get('title', '未知')}\n"
-            formatted_text += f"内容: {result.get('content', '无内容')[:200]}...\n"
-            formatted_text += f"来源: {result.get('metadata', {}).get('source', '未知')}\n"
-            formatted_text += f"摘要: {result.get('summary', '无摘要')}\n\n"
-        
-        return formatted_text
+    def _decide_need_search(self, query: str) -> bool:
+        """判断是否需要网络搜索，本地路由置信度不足时才调用LLM"""
+        decision, _ = self.router.predict_need_search(query)
+        if decision is not None:
+            return decision
+        need_search_response = self.need_search_chain.run(query=query).strip().lower()
+        decision = need_search_response == "是"
+        self.router.log_decision(NEED_SEARCH, query, decision)
+        return decision
+
+    async def _adecide_need_search(self, query: str) -> bool:
+        """_decide_need_search的异步版本"""
+        decision, _ = self.router.predict_need_search(query)
+        if decision is not None:
+            return decision
+        need_search_response = (await self._run_blocking(traced("chat.decide_search")(self.need_search_chain.run), query=query)).strip().lower()
+        decision = need_search_response == "是"
+        self.router.log_decision(NEED_SEARCH, query, decision)
+        return decision
+
+    def _decide_need_full_text(self, query: str, search_results_text: str) -> bool:
+        """判断是否需要获取全文，本地路由置信度不足时才调用LLM"""
+        decision, _ = self.router.predict_need_full_text(query, search_results_text)
+        if decision is not None:
+            return decision
+        need_full_text_response = self.need_full_text_chain.run(
+            query=query, 
+            search_results=search_results_text
+        ).strip().lower()
+        decision = need_full_text_response == "是"
+        self.router.log_decision(NEED_FULL_TEXT, query, decision, search_results_text)
+        return decision
+
+    async def _adecide_need_full_text(self, query: str, search_results_text: str) -> bool:
+        """_decide_need_full_text的异步版本"""
+        decision, _ = self.router.predict_need_full_text(query, search_results_text)
+        if decision is not None:
+            return decision
+        need_full_text_response = (await self._run_blocking(
+            traced("chat.decide_full_text")(self.need_full_text_chain.run),
+            query=query, 
+            search_results=search_results_text
+        )).strip().lower()
+        decision = need_full_text_response == "是"
+        self.router.log_decision(NEED_FULL_TEXT, query, decision, search_results_text)
+        return decision
 
     def _parse_search_results(self, search_results_text: str) -> List[Dict]:
         """将搜索工具返回的文本解析为结构化数据"""
@@ -282,40 +397,6 @@ class ChatSearchAgent:
         
         return unique_sources
 
-    def _format_sources_for_citation(self, sources: List[Dict]) -> str:
-        """格式化信息来源为引用生成所需的格式"""
-        formatted_text = ""
-        for i, source in enumerate(sources):
-            formatted_text += f"来源 {i+1}:\n"
-            formatted_text += f"标题: {source.get('title', '未知')}\n"
-            formatted_text += f"URL: {source.get('url', '未知')}\n"
-            if 'content' in source and source['content']:
-                content_preview = source['content'][:100] + "..." if len(source['content']) > 100 else source['content']
-                formatted_text += f"内容片段: {content_preview}\n"
-            formatted_text += "\n"
-        return formatted_text
-
-    def _parse_citation_result(self, citation_result: str) -> tuple:
-        """解析引用生成结果，提取更新后的回答和引用列表"""
-        # 尝试分离回答和参考来源
-        parts = citation_result.split("\n参考来源:", 1)
-        
-        if len(parts) == 2:
-            # 成功分离
-            updated_answer = parts[0].strip()
-            citation = "\n参考来源:" + parts[1]
-            return updated_answer, citation
-        
-        # 如果无法按预期分离，尝试其他可能的分隔符
-        parts = citation_result.split("\n\n参考来源:", 1)
-        if len(parts) == 2:
-            updated_answer = parts[0].strip()
-            citation = "\n参考来源:" + parts[1]
-            return updated_answer, citation
-            
-        # 如果仍然无法分离，返回原始结果和空引用
-        return citation_result, ""
-
 if __name__ == "__main__":
     # 测试聊天搜索代理
     import os
@@ -327,7 +408,7 @@ if __name__ == "__main__":
     #     temperature=0.7,
     #     api_key=os.getenv("OPENAI_API_KEY")
     # )
-    llm= init_chat_model("deepseek-chat", model_provider="deepseek", temperature=0)
+    llm= get_routed_model("default")
     
     # 初始化聊天搜索代理
     agent = ChatSearchAgent(llm=llm)
@@ -1,13 +1,20 @@
 import asyncio
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Generator, Tuple, Optional, Union
 import logging
 import re
-from langchain.chat_models import init_chat_model
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 from backend.agents.tools import WebTools, GetFullText
-from backend.agents.prompts import graph_template, fewshot_graph_template, initial_refine_template, refine_template
+from backend.agents.prompts import graph_template, fewshot_graph_template, initial_refine_template, refine_template, delta_refine_template, followup_question_template
+from backend.agents.model_registry import get_routed_model
+from backend.agents.json_stream import IncrementalJsonArrayParser
+from backend.agents.section_document import SectionDocument, apply_change
+from backend.agents.evidence_store import EvidenceStore
+from backend.agents.cancellation import CancellationToken, OperationCancelled, model_kwargs, raise_if_cancelled
+from backend.agents.tracing import span
+from backend.agents.rate_limit import SEARCH, get_rate_limiter
+from backend.agents.context_packer import pack_context
 
 from backend.database.loader import DocumentLoader
 import time
@@ -17,36 +24,45 @@ class GraphAgent:
     """
     图检索代理：根据报告主题和部分内容生成检索问题，构建检索图
     """
-    def __init__(self, search_agent: Search_Agent, persist_directory: str = "./chroma_db"):
+    def __init__(self, search_agent: Optional[Search_Agent] = None, persist_directory: str = "./chroma_db",
+                 context_tokens: Optional[int] = None):
         """
         初始化图检索代理
         
         Args:
-            search_client: 搜索客户端，用于执行DuckDuckGo搜索
+            search_agent: 可选的搜索代理，不传时不创建，避免每次初始化都构建ReAct代理
+            persist_directory: 知识库目录
+            context_tokens: 每次提炼调用放进提示词的文档token数上限，默认读取环境变量REFINE_CONTEXT_TOKENS（3000）
         """
         # self.search_client = search_client
         self.document_loader = DocumentLoader(persist_directory=persist_directory)
         self.logger = logging.getLogger(__name__)
-        self.model = init_chat_model("deepseek-chat", model_provider="deepseek", temperature=0)
+        self.model = get_routed_model("default")
+        # 生成检索问题是简单步骤，走"fast"档位
+        self.fast_model = get_routed_model("fast")
         self.web_tools = WebTools() 
         self.search_agent = search_agent
+        self.context_tokens = context_tokens or int(os.getenv("REFINE_CONTEXT_TOKENS", "3000"))
     
-    def generate_initial_questions(self, topic: str, section: str) -> List[str]:
+    def generate_initial_questions(self, topic: str, section: str, cancel_token: Optional[CancellationToken] = None) -> Tuple[List[str], List[str]]:
         """
         根据报告主题和部分内容生成初始检索问题
         
         Args:
             topic: 报告主题
             section: 报告部分
+            cancel_token: 可选的取消令牌，取消时抛出OperationCancelled
             
         Returns:
-            初始检索问题列表
+            (初始检索问题列表, 思考过程列表)
         """
         # 使用LLM生成问题
         prompt = graph_template.format(topic=topic, section=section) + fewshot_graph_template
         
         try:
-            response = self.model.invoke(prompt).content
+            with span("graph.generate_questions", section=section):
+                response = self.fast_model.invoke(prompt, **model_kwargs(self.fast_model, cancel_token)).content
+            raise_if_cancelled(cancel_token)
             
             
             # 解析思考过程
@@ -75,43 +91,130 @@ class GraphAgent:
             # 记录思考过程
             if think_processes:
                 self.logger.info(f"LLM思考过程: {think_processes}")
-            print(questions[:5])
+            self.logger.debug(f"生成的检索问题: {questions[:5]}")
             return questions[:5] , think_processes  # 限制最多返回5个问题
             
+        except OperationCancelled:
+            raise
         except Exception as e:
             self.logger.error(f"使用LLM生成问题时出错: {str(e)}")
-            # 出错时返回默认问题
+            # 出错时返回默认问题，与正常返回一样是(问题列表, 思考过程)
             return [
                 f"{topic} {section} 概述",
                 f"{topic} {section} 关键点",
                 f"{topic} {section} 最新研究",
                 f"{topic} {section} 数据统计"
-            ]
+            ], []
         
+    def generate_followup_questions(self, topic: str, section: str, question: str, search_results: List[Dict],
+                                    known_questions: List[str], max_questions: int = 2, evidence_tokens: int = 1200,
+                                    cancel_token: Optional[CancellationToken] = None) -> List[str]:
+        """
+        根据一个问题的检索结果中的缺口生成追问，用于多跳检索问题图
+
+        Args:
+            topic: 报告主题
+            section: 报告部分
+            question: 已检索的问题
+            search_results: 该问题的检索结果
+            known_questions: 本章节已经检索过的问题，追问不与其重复
+            max_questions: 最多生成的追问数
+            evidence_tokens: 放进提示词的证据token数上限
+            cancel_token: 可选的取消令牌，取消时抛出OperationCancelled
+
+        Returns:
+            追问列表，证据已经足够或出错时为空列表
+        """
+        evidence = "\n".join(
+            f"[{i+1}] {result.get('title', '')}\n{result.get('full_text') or result.get('snippet', '')}"
+            for i, result in enumerate(search_results)
+        )
+        prompt = followup_question_template.format(
+            topic=topic,
+            section=section,
+            question=question,
+            evidence=pack_context(evidence, question, evidence_tokens),
+            known_questions="\n".join(f"- {known}" for known in known_questions),
+            max_questions=max_questions,
+        )
+        try:
+            with span("graph.followup_questions", section=section):
+                response = self.fast_model.invoke(prompt, **model_kwargs(self.fast_model, cancel_token)).content
+            raise_if_cancelled(cancel_token)
+        except OperationCancelled:
+            raise
+        except Exception as e:
+            self.logger.error(f"生成追问时出错: {str(e)}")
+            return []
+        known = {"".join(known.split()) for known in known_questions}
+        followups = []
+        for match in re.findall(r'<\|question_start\|>(.*?)<\|question_end\|>', response, re.DOTALL):
+            followup = match.strip()
+            if followup and "".join(followup.split()) not in known:
+                known.add("".join(followup.split()))
+                followups.append(followup)
+        self.logger.debug(f"问题 '{question}' 的追问: {followups[:max_questions]}")
+        return followups[:max_questions]
+
     # TODO：以下要整合Search_Agent Search_Agent可以有chat mode 和 search mode 
-    def search_web(self, question: str) -> List[str]:
+    def search_web(self, question: str, evidence_store: Optional[EvidenceStore] = None, cancel_token: Optional[CancellationToken] = None) -> List[str]:
         """
         根据问题搜索网络和知识库
         
         Args:
             question: 搜索问题  
+            evidence_store: 可选的报告级证据库，先在其中查找，证据足够时不再检索，
+                            否则检索后把结果登记进证据库，并补充证据库中已有的相关证据
+            cancel_token: 可选的取消令牌，取消时立即抛出OperationCancelled
         
         Returns:
             搜索结果列表
         """
-        # 使用DuckDuckGo搜索
-        search_results_text = self.web_tools.get_search_tool().run(question,max_results=4)
-        time.sleep(1)
-        # 解析搜索结果文本为结构化数据
-        web_results = self._parse_search_results(search_results_text)
-        
-        # 从知识库中搜索
-        kb_results = self._search_knowledge_base(question)
-        
-        # 合并结果
-        combined_results = web_results + kb_results
+        with span("graph.search_web") as search_span:
+            cached_results = []
+            if evidence_store is not None:
+                with span("evidence.lookup") as lookup_span:
+                    cached_results, enough = evidence_store.lookup(question)
+                    if lookup_span is not None:
+                        lookup_span.set(hit=enough, results=len(cached_results))
+                if enough:
+                    return cached_results
+
+            # 设置了全局搜索速率限制（SEARCH_RATE_LIMIT）时在搜索前取令牌，否则每次搜索后固定等待1秒
+            search_limiter = get_rate_limiter(SEARCH)
+            if search_limiter is not None:
+                with span("tool.web_search.throttle"):
+                    search_limiter.acquire(cancel_token=cancel_token)
+
+            # 使用DuckDuckGo搜索
+            with span("tool.web_search") as web_span:
+                search_results_text = self.web_tools.search(question, max_results=4, cancel_token=cancel_token)
+                # 解析搜索结果文本为结构化数据
+                web_results = self._parse_search_results(search_results_text)
+                if web_span is not None:
+                    web_span.set(results=len(web_results), chars=len(search_results_text or ""))
+            # 搜索限速等待单独计时，不算在搜索耗时里
+            if search_limiter is None:
+                with span("tool.web_search.throttle"):
+                    if cancel_token is not None:
+                        cancel_token.wait(1)
+                    else:
+                        time.sleep(1)
             
-        return combined_results
+            # 从知识库中搜索
+            raise_if_cancelled(cancel_token)
+            kb_results = self._search_knowledge_base(question)
+            
+            # 合并结果
+            combined_results = web_results + kb_results
+            if evidence_store is not None:
+                evidence_store.add_results(combined_results)
+                urls = {result.get("url") for result in combined_results}
+                combined_results += [result for result in cached_results if result["url"] not in urls]
+            if search_span is not None:
+                search_span.set(results=len(combined_results))
+                
+            return combined_results
     
     def _parse_search_results(self, search_results_text: str) -> List[Dict]:
         """将搜索工具返回的文本解析为结构化数据"""
@@ -154,7 +257,10 @@ class GraphAgent:
         """
        
             # 初始化知识库加载器
-        kb_results = self.document_loader.search_documents(question, n_results=n_results)
+        with span("chroma.query", n_results=n_results) as query_span:
+            kb_results = self.document_loader.search_documents(question, n_results=n_results)
+            if query_span is not None:
+                query_span.set(results=len(kb_results))
             # 转换为与网络搜索结果相同的格式
         formatted_results = []
         for result in kb_results:
@@ -166,13 +272,14 @@ class GraphAgent:
                     "source": "knowledge_base",
                     "distance": result.get('distance', 0)
                 })
-        print(formatted_results)
+        self.logger.debug(f"知识库检索结果: {formatted_results}")
         return formatted_results
             
 
     
     # TODO：refine链要解耦
-    def refine_documents(self, search_results: List[Dict], topic: str, section: str,refine_document=None) -> str:
+    def refine_documents(self, search_results: List[Dict], topic: str, section: str,refine_document=None, mode: str = "rewrite",
+                         question: Optional[str] = None) -> str:
         """
         根据搜索结果优化文档，构建一个文档链，每个文档依次进入链条进行提炼
         
@@ -180,6 +287,8 @@ class GraphAgent:
             search_results: 搜索结果列表
             topic: 报告主题
             section: 报告部分
+            mode: 提炼方式，见refine_documents_stream
+            question: 检索问题，见refine_documents_stream
             
         Returns:
             提炼后的文档内容
@@ -188,60 +297,133 @@ class GraphAgent:
             self.logger.warning("没有搜索结果可供提炼")
             return f"未找到关于{topic}的{section}相关信息。"
             
-        # 初始文档
-        refined_doc = ""
+        refined_doc = refine_document or ""
+        current_revision = None
+        for revision, delta in self.refine_documents_stream(search_results, topic, section, refine_document, mode, question=question):
+            if isinstance(delta, dict):
+                refined_doc = apply_change(refined_doc, delta)
+                continue
+            if revision != current_revision:
+                current_revision = revision
+                refined_doc = ""
+            refined_doc += delta
+        return refined_doc
+
+    def refine_documents_stream(self, search_results: List[Dict], topic: str, section: str, refine_document=None, mode: str = "rewrite",
+                                raise_errors: bool = False, cancel_token: Optional[CancellationToken] = None,
+                                question: Optional[str] = None) -> Generator[Tuple[int, Union[str, Dict]], None, None]:
+        """
+        refine_documents的流式版本，直接转发模型原生流式输出的增量
         
-        # 提炼提示词模板
-        initial_prompt_template = initial_refine_template
+        以(revision, delta)的形式输出：delta为字符串时，revision变化表示开始了新一版章节内容，调用方应丢弃旧内容重新拼接；
+        delta为字典时是对当前内容的段落级修改，调用方用section_document.apply_change应用到当前内容上。
+        "rewrite"模式下每一次模型调用都会重写整个章节；
+        "delta"模式下已有内容按段落编号，模型只返回段落级修改，每应用一条修改输出这一条修改，不再输出完整的章节内容。
+        每篇文档超出context_tokens时只保留与问题最相关的段落。
         
-        refine_prompt_template = refine_template
+        Args:
+            search_results: 搜索结果列表
+            topic: 报告主题
+            section: 报告部分
+            refine_document: 已有的章节内容，None表示从头撰写
+            mode: 提炼方式，"rewrite"或"delta"
+            raise_errors: 出错时直接抛出异常，默认输出一版错误提示作为章节内容
+            cancel_token: 可选的取消令牌，取消时抛出OperationCancelled，不会输出错误提示
+            question: 检索问题，用于挑选文档中的相关段落，None时按主题和章节挑选
+            
+        Yields:
+            (revision, delta) 元组
+        """
+        # 只有带全文的结果才进入提炼链，过长的全文按与问题的相关度压缩
+        query = question or f"{topic} {section}"
+        documents = [
+            pack_context(result["full_text"], query, self.context_tokens) + "\n" + "url:" + result["url"]
+            for result in search_results
+            if "full_text" in result
+        ]
+        if not documents:
+            return
+
+        refined_doc = refine_document or ""
+        revision = 0
         try:
-            if refine_document:
-                refined_doc = refine_document
-                for i in range(0, len(search_results)):
-                    print(i)
-                    if "full_text" in search_results[i]:
-                        doc = search_results[i]["full_text"]+"\n"+"url:"+search_results[i]["url"]
-                        refine_prompt = refine_prompt_template.format(
-                        topic=topic,
-                        section=section,
-                        existing_content=refined_doc,
-                        document=doc
-                    )
-                        refined_doc = self.model.invoke(refine_prompt).content
-                    
-                return refined_doc
-                
+            for doc in documents:
+                refine_mode = "delta" if refined_doc and mode == "delta" else "rewrite"
+                with span("graph.refine", mode=refine_mode, doc_chars=len(doc)) as refine_span:
+                    if refine_mode == "delta":
+                        revision, refined_doc = yield from self._apply_delta_refine(doc, topic, section, refined_doc, revision, cancel_token)
+                    else:
+                        if refined_doc:
+                            prompt = refine_template.format(
+                                topic=topic,
+                                section=section,
+                                existing_content=refined_doc,
+                                document=doc
+                            )
+                        else:
+                            prompt = initial_refine_template.format(
+                                topic=topic,
+                                section=section,
+                                document=doc
+                            )
+                        revision += 1
+                        refined_doc = ""
+                        for chunk in self.model.stream(prompt, **model_kwargs(self.model, cancel_token)):
+                            raise_if_cancelled(cancel_token)
+                            if chunk.content:
+                                refined_doc += chunk.content
+                                yield revision, chunk.content
+                    if refine_span is not None:
+                        refine_span.set(output_chars=len(refined_doc))
 
-            # 处理第一个文档
-            if search_results and "full_text" in search_results[0]:
-                first_doc = search_results[0]["full_text"]+"\n"+"url:"+search_results[0]["url"]
-                initial_prompt = initial_prompt_template.format(
-                    topic=topic,
-                    section=section,
-                    document=first_doc
-                )
-                refined_doc = self.model.invoke(initial_prompt).content
-                
-            # 依次处理剩余文档
-            for i in range(1, len(search_results)):
-                print(i)
-                if "full_text" in search_results[i]:
-                    doc = search_results[i]["full_text"]+"\n"+"url:"+search_results[i]["url"]
-                    refine_prompt = refine_prompt_template.format(
-                        topic=topic,
-                        section=section,
-                        existing_content=refined_doc,
-                        document=doc
-                    )
-                    refined_doc = self.model.invoke(refine_prompt).content
-                    
-            return refined_doc
-            
+        except OperationCancelled:
+            raise
         except Exception as e:
             self.logger.error(f"提炼文档时出错: {str(e)}")
-            return f"处理{topic}的{section}信息时遇到错误。"
-    
+            if raise_errors:
+                raise
+            yield revision + 1, f"处理{topic}的{section}信息时遇到错误。"
+
+    def _apply_delta_refine(self, doc: str, topic: str, section: str, refined_doc: str, revision: int,
+                            cancel_token: Optional[CancellationToken] = None) -> Generator[Tuple[int, Union[str, Dict]], None, Tuple[int, str]]:
+        """
+        用一篇新文档对已有内容做增量提炼，修改在模型流式输出的过程中逐条应用
+
+        Yields:
+            (revision, 按段落位置表示的修改) 元组；模型重写了整个章节时输出(revision + 1, 完整的章节内容)
+
+        Returns:
+            (revision, 修改后的完整章节内容) 元组
+        """
+        document = SectionDocument.from_text(refined_doc)
+        prompt = delta_refine_template.format(
+            topic=topic,
+            section=section,
+            existing_content=document.render_with_ids(),
+            document=doc
+        )
+        parser = IncrementalJsonArrayParser()
+        edit_count = 0
+        for chunk in self.model.stream(prompt, **model_kwargs(self.model, cancel_token)):
+            raise_if_cancelled(cancel_token)
+            if not chunk.content:
+                continue
+            for edit in parser.feed(chunk.content):
+                edit_count += 1
+                change = document.apply_edit(edit)
+                if change is not None:
+                    yield revision, change
+
+        edits = parser.result()
+        is_edit_list = isinstance(edits, list) and all(isinstance(edit, dict) for edit in edits)
+        if not edit_count and not is_edit_list and parser.buffer.strip():
+            # 模型没有按格式返回修改而是重写了整个章节，直接采用重写的内容；正文中的"[1]"、"[2024]"等不是修改列表
+            self.logger.warning(f"{section}的增量提炼结果不是JSON数组，按整章重写处理")
+            revision += 1
+            yield revision, parser.buffer.strip()
+            return revision, parser.buffer.strip()
+        return revision, document.render()
+
     # TODO：以下均需要修改
 if __name__ == "__main__":
     graph_agent = GraphAgent(Search_Agent())
@@ -1,4 +1,3 @@
-from langchain.chat_models import init_chat_model
 from langchain.chains import LLMChain
 from langchain.agents import AgentExecutor, create_react_agent
 from langchain.prompts import PromptTemplate
@@ -8,11 +7,12 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 from backend.agents.tools import WebTools, GetFullText
+from backend.agents.model_registry import get_routed_model
 
 class Search_Agent:
     def __init__(self, user_input_template: str = "{question}", user_context_template: str = "{context}"):
         # 初始化模型
-        self.model = init_chat_model("deepseek-chat", model_provider="deepseek", temperature=0)
+        self.model = get_routed_model("default")
         self.user_input_template = user_input_template
         self.user_context_template = user_context_template
         
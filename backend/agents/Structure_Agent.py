@@ -1,5 +1,4 @@
-from langchain.chat_models import init_chat_model
-from typing import Dict, List
+from typing import Dict, List, Generator, Optional
 import requests
 from bs4 import BeautifulSoup
 from langchain.tools import BaseTool
@@ -10,14 +9,24 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 from backend.agents.prompts import fewshot_structure_template,structure_template_cn
+from backend.agents.model_registry import get_routed_model
+from backend.agents.json_stream import IncrementalJsonArrayParser
+from backend.agents.cancellation import CancellationToken, model_kwargs, raise_if_cancelled
+from backend.agents.tracing import span
+from backend.agents.outline_cache import OutlineCache
 from langchain_core.output_parsers import JsonOutputParser  # 输出解析器
 
 class Structure_Agent:
-    def __init__(self, user_input_topic: str = "{topic}", user_context_template: str = "{context}"):
+    def __init__(self, user_input_topic: str = "{topic}", user_context_template: str = "{context}",
+                 outline_cache: Optional[OutlineCache] = None):
         #TODO 适配更多模型
-        self.model = init_chat_model("deepseek-chat", model_provider="deepseek", temperature=0)
+        self.model = get_routed_model("default")
         self.user_input_topic = user_input_topic
         self.user_context_template = user_context_template
+        # 可选的大纲缓存，相近主题直接复用已有大纲
+        self.outline_cache = outline_cache
+        # 最近一次生成的大纲复用自哪个主题，{"topic": ..., "score": ...}，新生成时为None
+        self.reused_from: Optional[Dict] = None
         # 添加搜索工具
         self.search_tool = DuckDuckGoSearchResults()
         '''
@@ -41,13 +50,66 @@ class Structure_Agent:
         self.parser = JsonOutputParser()  # 初始化JSON解析器
 
     def forward(self):
+        # 消费流式输出，返回完整大纲
+        structure_stream = self.stream_structure()
+        while True:
+            try:
+                next(structure_stream)
+            except StopIteration as e:
+                return e.value
+
+    def stream_structure(self, cancel_token: Optional[CancellationToken] = None, reuse_cached: bool = True) -> Generator[Dict, None, Dict]:
+        """
+        流式生成报告大纲，structure中的每个章节一旦语法完整就立即输出；
+        设置了大纲缓存时先查找相近主题的大纲，命中时直接输出，不调用模型
+        
+        Args:
+            cancel_token: 可选的取消令牌，取消时抛出OperationCancelled
+            reuse_cached: 是否复用缓存中的大纲，False时重新生成并覆盖缓存
+        
+        Yields:
+            章节字典，如{"subtitle": ..., "content": [...]}
+            
+        Returns:
+            完整的报告大纲
+        """
+        self.reused_from = None
+        if self.outline_cache is not None and reuse_cached:
+            with span("structure.cache_lookup") as lookup_span:
+                cached = self.outline_cache.lookup(self.user_input_topic)
+                if lookup_span is not None:
+                    lookup_span.set(hit=cached is not None)
+            if cached is not None:
+                self.reused_from = {"topic": cached["topic"], "score": cached["score"]}
+                for section in cached["structure"].get("structure", []):
+                    yield section
+                return cached["structure"]
+
         # 重构提示词结构
         structured_prompt = structure_template_cn.format(
             topic=self.user_input_topic,
         )# + "\n请使用以下格式响应：\nThought: 思考过程\nAction: 工具名称\nAction Input: 输入参数"
         
-        raw_response = self.model.invoke(structured_prompt+fewshot_structure_template)
-        return self.parser.parse(raw_response.content)  # 使用解析器直接处理原始内容
+        section_parser = IncrementalJsonArrayParser("structure")
+        raw_response = ""
+        sections = []
+        with span("structure.generate") as structure_span:
+            for chunk in self.model.stream(structured_prompt+fewshot_structure_template, **model_kwargs(self.model, cancel_token)):
+                raise_if_cancelled(cancel_token)
+                raw_response += chunk.content
+                for section in section_parser.feed(chunk.content):
+                    sections.append(section)
+                    yield section
+            
+            structure = self.parser.parse(raw_response)  # 使用解析器直接处理原始内容
+            # 增量解析没有识别出的章节（例如输出格式不规范）在最后补上
+            for section in structure.get("structure", [])[len(sections):]:
+                yield section
+            if structure_span is not None:
+                structure_span.set(sections=len(structure.get("structure", [])), output_chars=len(raw_response))
+        if self.outline_cache is not None:
+            self.outline_cache.store(self.user_input_topic, structure)
+        return structure
 
 if __name__ == "__main__":
     agent = Structure_Agent()
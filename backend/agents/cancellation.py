@@ -0,0 +1,126 @@
+import threading
+from typing import Any, Callable, List, Optional
+'''
+协作式取消：取消令牌在报告生成器、代理和工具之间传递，取消后正在等待的模型请求、
+网络请求立即返回，后台请求在下一段输出到达时关闭连接
+'''
+
+
+class OperationCancelled(Exception):
+    """操作已被取消"""
+
+
+class CancellationToken:
+    """
+    取消令牌
+
+    cancel()之后cancelled为True，已注册的回调依次执行一次（之后注册的回调立即执行），
+    阻塞等待的调用方通过回调被唤醒。
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], Any]] = []
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "操作已取消"):
+        """取消，重复调用无效果"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def raise_if_cancelled(self):
+        """
+        Raises:
+            OperationCancelled: 已取消
+        """
+        if self._event.is_set():
+            raise OperationCancelled(self.reason)
+
+    def add_callback(self, callback: Callable[[], Any]) -> Callable[[], None]:
+        """
+        注册取消时执行的回调，已取消时立即执行
+
+        Returns:
+            注销回调的函数
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+
+                def remove():
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+                return remove
+        callback()
+        return lambda: None
+
+    def wait(self, timeout: float):
+        """
+        可被取消打断的等待
+
+        Raises:
+            OperationCancelled: 等待期间被取消
+        """
+        if self._event.wait(timeout):
+            raise OperationCancelled(self.reason)
+
+    def call(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        在后台线程中执行无法中断的阻塞调用（例如DuckDuckGo搜索），取消时立即返回，调用结果被丢弃
+
+        Raises:
+            OperationCancelled: 调用完成前被取消
+        """
+        self.raise_if_cancelled()
+        done = threading.Event()
+        outcome = {}
+
+        def target():
+            try:
+                outcome["result"] = func(*args, **kwargs)
+            except BaseException as e:
+                outcome["error"] = e
+            finally:
+                done.set()
+
+        threading.Thread(target=target, name="cancellable-call", daemon=True).start()
+        remove = self.add_callback(done.set)
+        try:
+            done.wait()
+        finally:
+            remove()
+        if "result" not in outcome and "error" not in outcome:
+            raise OperationCancelled(self.reason)
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome["result"]
+
+
+def raise_if_cancelled(cancel_token: Optional[CancellationToken]):
+    """cancel_token可以为None的raise_if_cancelled"""
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+
+def model_kwargs(model: Any, cancel_token: Optional[CancellationToken]) -> dict:
+    """
+    调用模型时附加的参数：只有支持取消的模型（RoutedChatModel）才接收cancel_token，
+    其他模型的参数会原样发给模型接口
+    """
+    if cancel_token is not None and getattr(model, "supports_cancellation", False):
+        return {"cancel_token": cancel_token}
+    return {}
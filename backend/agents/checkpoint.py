@@ -0,0 +1,216 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+'''
+报告生成检查点：大纲、各章节的检索问题、检索结果和每一版整合后的草稿在完成时立即落盘，
+生成中断后可以从检查点继续，跳过已经完成的步骤
+'''
+
+DEFAULT_CHECKPOINT_DIR = os.getenv("REPORT_CHECKPOINT_DIR", "./report_checkpoints")
+
+
+class ReportCheckpoint:
+    """
+    单份报告的检查点：大纲、检索问题和草稿保存为checkpoint目录下的{report_id}.json，
+    检索结果逐条追加到{report_id}.searches.jsonl
+
+    JSON文件每次记录都先写入临时文件再原子替换，进程在写入过程中退出也不会留下损坏的检查点；
+    检索结果体积大，只追加不重写，写入到一半的最后一行在读取时忽略。
+    各章节并发生成时共享同一个实例，记录操作是线程安全的。
+    """
+    def __init__(self, data: Dict, directory: str = DEFAULT_CHECKPOINT_DIR,
+                 searches: Optional[Dict[Tuple[str, str], List[Dict]]] = None):
+        self.data = data
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._search_lock = threading.Lock()
+        # (章节, 问题) -> 检索结果
+        self._searches: Dict[Tuple[str, str], List[Dict]] = searches or {}
+
+    @property
+    def report_id(self) -> str:
+        return self.data["report_id"]
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"{self.report_id}.json")
+
+    @property
+    def searches_path(self) -> str:
+        return os.path.join(self.directory, f"{self.report_id}.searches.jsonl")
+
+    @classmethod
+    def create(cls, topic: str, settings: Dict[str, Any], directory: str = DEFAULT_CHECKPOINT_DIR) -> "ReportCheckpoint":
+        """
+        为一份新报告创建检查点
+
+        Args:
+            topic: 报告主题
+            settings: 生成参数，恢复时按原参数继续生成
+            directory: 检查点目录
+
+        Returns:
+            已落盘的检查点
+        """
+        report_id = time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        checkpoint = cls({
+            "report_id": report_id,
+            "topic": topic,
+            "settings": settings,
+            "status": "running",
+            "outline": None,
+            "sections": {},
+            "updated_at": time.time(),
+        }, directory)
+        with checkpoint._lock:
+            checkpoint._save(sync=True)
+        return checkpoint
+
+    @classmethod
+    def load(cls, report_id: str, directory: str = DEFAULT_CHECKPOINT_DIR) -> "ReportCheckpoint":
+        """
+        读取已有的检查点
+
+        Raises:
+            FileNotFoundError: 检查点不存在
+        """
+        with open(os.path.join(directory, f"{report_id}.json"), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        searches = {}
+        try:
+            with open(os.path.join(directory, f"{report_id}.searches.jsonl"), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 进程退出时写到一半的行
+                        continue
+                    searches[(entry["section"], entry["question"])] = entry["results"]
+        except FileNotFoundError:
+            pass
+        return cls(data, directory, searches)
+
+    @staticmethod
+    def list_reports(directory: str = DEFAULT_CHECKPOINT_DIR) -> List[Dict]:
+        """按更新时间倒序列出检查点目录中的报告，只包含编号、主题和状态"""
+        if not os.path.isdir(directory):
+            return []
+        reports = []
+        for name in os.listdir(directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+            reports.append({key: data.get(key) for key in ("report_id", "topic", "status", "updated_at")})
+        reports.sort(key=lambda report: report.get("updated_at") or 0, reverse=True)
+        return reports
+
+    def _save(self, sync: bool = False):
+        """
+        重写JSON文件，调用方需持有self._lock
+
+        Args:
+            sync: 是否等待写入磁盘；中间记录只需防止写坏文件，只有创建和完成时才同步
+        """
+        self.data["updated_at"] = time.time()
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{self.report_id}.", suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, ensure_ascii=False)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _section(self, section: str) -> Dict:
+        # 调用方需持有self._lock
+        return self.data["sections"].setdefault(section, {
+            "questions": None,
+            "think_processes": [],
+            "processed": 0,
+            "draft": None,
+            "done": False,
+        })
+
+    @property
+    def outline(self) -> Optional[Dict]:
+        return self.data.get("outline")
+
+    def set_outline(self, structure: Dict):
+        with self._lock:
+            self.data["outline"] = structure
+            self._save()
+
+    def get_section(self, section: str) -> Optional[Dict]:
+        """返回章节的检查点记录，没有记录时返回None"""
+        with self._lock:
+            record = self.data["sections"].get(section)
+            return json.loads(json.dumps(record)) if record is not None else None
+
+    def set_questions(self, section: str, questions: List[str], think_processes: List[str]):
+        with self._lock:
+            record = self._section(section)
+            record["questions"] = list(questions)
+            record["think_processes"] = think_processes
+            self._save()
+
+    def add_followups(self, section: str, questions: List[str], depths: List[int]):
+        """追加检索问题图生成的追问及其层数，已有问题的层数记为0"""
+        with self._lock:
+            record = self._section(section)
+            record["question_depths"] = record.get("question_depths") or [0] * len(record["questions"] or [])
+            record["questions"] = (record["questions"] or []) + questions
+            record["question_depths"] += depths
+            self._save()
+
+    def get_search(self, section: str, question: str) -> Optional[List[Dict]]:
+        with self._search_lock:
+            results = self._searches.get((section, question))
+        if results is not None:
+            return results
+        # 旧版本的检查点把检索结果保存在章节记录中
+        with self._lock:
+            return self.data["sections"].get(section, {}).get("searches", {}).get(question)
+
+    def record_search(self, section: str, question: str, results: List[Dict]):
+        """把检索结果追加到检索结果文件，不重写整个检查点，也不占用章节记录的锁"""
+        line = json.dumps({"section": section, "question": question, "results": results}, ensure_ascii=False) + "\n"
+        with self._search_lock:
+            self._searches[(section, question)] = results
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.searches_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def record_draft(self, section: str, processed: int, draft: Optional[str]):
+        """
+        记录章节处理完前processed个问题后的草稿
+        """
+        with self._lock:
+            record = self._section(section)
+            record["processed"] = processed
+            record["draft"] = draft
+            self._save()
+
+    def finish_section(self, section: str, content: str):
+        with self._lock:
+            record = self._section(section)
+            record["draft"] = content
+            record["done"] = True
+            self._save()
+
+    def finish(self):
+        with self._lock:
+            self.data["status"] = "completed"
+            self._save(sync=True)
@@ -0,0 +1,88 @@
+import re
+from typing import Dict, List, Tuple
+'''
+本地引用处理：回答生成时使用预先编号的信息来源，生成后在本地校验、重新编号引用标记并生成参考来源列表
+'''
+
+# 匹配[1]、[1, 2]、[1，3、4]以及[[1]]形式的引用标记
+CITATION_PATTERN = re.compile(r"\[\[?(\d+(?:\s*[,，、]\s*\d+)*)\]?\]")
+# 模型有时仍会自己写参考来源列表：位于回答末尾、标题之后每行都以[n]开头时截掉，标题之后还有正文时保留
+SOURCE_LIST_PATTERN = re.compile(
+    r"\n\s*(?:#+\s*|\*\*)?(?:参考来源|参考资料|引用来源|信息来源)[ \t]*(?:\*\*)?[ \t]*[:：]?[ \t]*(?:\*\*)?[ \t]*"
+    r"(?:\n[ \t]*(?:[-*][ \t]*)?\[\[?\d+\]?\][^\n]*|\n[ \t]*)+\Z"
+)
+
+
+def format_numbered_sources(sources: List[Dict], content_limit: int = 300) -> str:
+    """
+    将信息来源格式化为带编号的文本，供回答提示词使用，编号从1开始
+
+    Args:
+        sources: 信息来源列表，每项包含title、url，可选content、full_text
+        content_limit: 每个来源内容片段的最大字符数
+    """
+    if not sources:
+        return "没有可用的信息来源。"
+
+    formatted_text = ""
+    for i, source in enumerate(sources):
+        formatted_text += f"[{i+1}] 标题: {source.get('title', '未知')}\n"
+        formatted_text += f"来源: {source.get('url', '未知')}\n"
+        content = source.get("content") or ""
+        if content:
+            if len(content) > content_limit:
+                content = content[:content_limit] + "..."
+            formatted_text += f"内容: {content}\n"
+        if source.get("full_text"):
+            formatted_text += f"全文: {source['full_text']}\n"
+        formatted_text += "\n"
+    return formatted_text
+
+
+def render_source_list(sources: List[Dict]) -> str:
+    """生成参考来源列表文本"""
+    if not sources:
+        return ""
+    lines = [f"[{i+1}] {source.get('title', '未知')}, {source.get('url', '未知')}" for i, source in enumerate(sources)]
+    return "\n参考来源:\n" + "\n".join(lines)
+
+
+def apply_citations(answer: str, sources: List[Dict]) -> Tuple[str, str]:
+    """
+    校验回答中的引用标记，按首次出现的顺序重新编号，并生成对应的参考来源列表
+
+    超出来源编号范围的编号会被去掉，整个标记都超出范围时原样保留（例如正文中的"[2024]"）；同一来源多次引用使用同一编号；
+    回答中没有任何有效引用时，参考来源列表按原编号列出全部来源。
+
+    Args:
+        answer: 使用预编号来源生成的回答
+        sources: 生成回答时使用的信息来源列表，顺序与提示词中的编号一致
+
+    Returns:
+        (重新编号后的回答, 参考来源列表文本)
+    """
+    answer = SOURCE_LIST_PATTERN.sub("", answer).rstrip()
+    renumbered = {}
+
+    def replace(match):
+        indexes = [int(part.strip()) for part in re.split(r"[,，、]", match.group(1))]
+        if not any(1 <= index <= len(sources) for index in indexes):
+            return match.group(0)
+        numbers = []
+        for index in indexes:
+            if not 1 <= index <= len(sources):
+                continue
+            if index not in renumbered:
+                renumbered[index] = len(renumbered) + 1
+            if renumbered[index] not in numbers:
+                numbers.append(renumbered[index])
+        return "".join(f"[{number}]" for number in sorted(numbers))
+
+    answer = CITATION_PATTERN.sub(replace, answer)
+    if not renumbered:
+        return answer, render_source_list(sources)
+
+    cited_sources = [None] * len(renumbered)
+    for index, number in renumbered.items():
+        cited_sources[number - 1] = sources[index - 1]
+    return answer, render_source_list(cited_sources)
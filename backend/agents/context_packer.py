@@ -0,0 +1,120 @@
+import re
+from typing import Dict, List, Set
+from backend.agents.usage import estimate_tokens
+from backend.agents.similarity import text_shingles
+'''
+上下文打包：按本地估算的token数控制放进提示词的文档长度，超出预算时把文档切分为段落，
+按与问题的相关度挑选段落填满预算，过长的段落在句子边界截断
+'''
+
+# 句子结束位置：中英文句末标点之后、英文句点后跟空白处以及换行处
+_SENTENCE_END = re.compile(r"(?<=[。！？!?；;])|(?<=\.)(?=\s)|\n")
+
+
+def split_sentences(text: str) -> List[str]:
+    """按句子切分文本，保留句末标点，去掉空句子"""
+    return [sentence for sentence in (piece.strip() for piece in _SENTENCE_END.split(text)) if sentence]
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    把文本截断到max_tokens以内，在句子边界截断；第一句就超出时按字符截断
+
+    Args:
+        text: 文本
+        max_tokens: token数上限
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 在原文中找到最后一个不超出预算的句子边界，保留原有的空白和换行
+    cut = 0
+    used = 0
+    for match in _SENTENCE_END.finditer(text):
+        if match.end() <= cut:
+            continue
+        used += estimate_tokens(text[cut:match.end()])
+        if used > max_tokens:
+            break
+        cut = match.end()
+    if not cut:
+        # 按中文一字一个token截断，英文截断得偏短
+        return text[:max(0, max_tokens)]
+    return text[:cut].rstrip()
+
+
+def split_passages(text: str, passage_tokens: int = 200) -> List[str]:
+    """
+    把文本切分为不超过passage_tokens的段落：相邻的短段落合并，过长的段落按句子切分
+
+    Args:
+        text: 文本
+        passage_tokens: 每个段落的token数上限
+    """
+    units = []
+    for paragraph in (line.strip() for line in text.split("\n")):
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= passage_tokens:
+            units.append(paragraph)
+        else:
+            units.extend(truncate_to_tokens(sentence, passage_tokens) for sentence in split_sentences(paragraph))
+
+    passages = []
+    current, used = [], 0
+    for unit in units:
+        tokens = estimate_tokens(unit)
+        if current and used + tokens > passage_tokens:
+            passages.append("\n".join(current))
+            current, used = [], 0
+        current.append(unit)
+        used += tokens
+    if current:
+        passages.append("\n".join(current))
+    return passages
+
+
+def relevance(query_shingles: Set[str], passage: str) -> float:
+    """段落覆盖问题中n元组的比例"""
+    if not query_shingles:
+        return 0.0
+    return len(query_shingles & text_shingles(passage)) / len(query_shingles)
+
+
+def pack_context(text: str, query: str, max_tokens: int, passage_tokens: int = 200, min_fill_tokens: int = 40) -> str:
+    """
+    把文档压缩到max_tokens以内，放进提示词
+
+    文档没有超出预算时原样返回；否则按与问题的相关度从高到低挑选段落，放不下的段落跳过，
+    剩余预算不少于min_fill_tokens时截断一段补上；选中的段落按原文顺序拼接。
+    问题与各段落都不相关时，相当于保留文档开头。
+
+    Args:
+        text: 文档全文
+        query: 问题，用于计算段落的相关度
+        max_tokens: token数上限
+        passage_tokens: 每个段落的token数上限
+        min_fill_tokens: 剩余预算不少于该值时截断一段补上
+
+    Returns:
+        打包后的文档
+    """
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text
+    passages = split_passages(text, passage_tokens)
+    query_shingles = text_shingles(query)
+    ranked = sorted(range(len(passages)), key=lambda i: (-relevance(query_shingles, passages[i]), i))
+
+    selected: Dict[int, str] = {}
+    used = 0
+    for i in ranked:
+        remaining = max_tokens - used
+        tokens = estimate_tokens(passages[i])
+        if tokens <= remaining:
+            selected[i] = passages[i]
+            used += tokens
+        elif remaining >= min_fill_tokens:
+            selected[i] = truncate_to_tokens(passages[i], remaining)
+            used += estimate_tokens(selected[i])
+        if max_tokens - used < min_fill_tokens:
+            break
+    return "\n".join(selected[i] for i in sorted(selected))
@@ -0,0 +1,54 @@
+from typing import Any, Dict, Optional
+'''
+报告生成事件：ReportGenerator按类型输出事件，调用方按type分发处理，不再在文本中查找标记
+'''
+
+# 大纲生成完成，data: structure（大纲字典）
+OUTLINE = "outline"
+# 开始生成章节，data: index（章节序号）
+SECTION_START = "section_start"
+# 章节的一个检索问题，data: index、question、reused_from（复用其检索结果的已有问题，可能为None）
+QUESTION = "question"
+# 一个问题检索完成，data: index、question、results（检索结果列表）
+SEARCH_DONE = "search_done"
+# 章节内容增量，data: revision、content（本次增量）、reset（是否开始了新一版内容，调用方应丢弃旧内容）；
+# 增量提炼的段落级修改另有change，调用方用section_document.apply_change应用到已有内容上，content为空
+DELTA = "delta"
+# 章节生成完成，data: index、content（章节最终内容）、error（出错时的错误信息）
+SECTION_DONE = "section_done"
+# 统计信息，data为各项指标
+METRICS = "metrics"
+# 报告生成完成，data: report（完整报告字典）
+REPORT_DONE = "report_done"
+# 其他进度信息，只有text
+PROGRESS = "progress"
+
+
+class ReportEvent:
+    """
+    报告生成事件
+
+    type为事件类型，data为结构化数据，section为事件所属章节的标题（与章节无关时为None），
+    text为事件的文字描述，str(event)返回text，只需要打印生成过程的调用方可以直接拼接输出。
+    """
+    __slots__ = ("type", "text", "section", "data")
+
+    def __init__(self, type: str, text: str = "", section: Optional[str] = None, **data: Any):
+        self.type = type
+        self.text = text
+        self.section = section
+        self.data: Dict[str, Any] = data
+
+    def __str__(self) -> str:
+        return self.text
+
+    def __repr__(self) -> str:
+        return f"ReportEvent(type={self.type!r}, section={self.section!r}, data={self.data!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": self.type, "text": self.text, "section": self.section, "data": self.data}
+
+
+def progress(text: str, section: Optional[str] = None) -> ReportEvent:
+    """创建进度事件"""
+    return ReportEvent(PROGRESS, text, section)
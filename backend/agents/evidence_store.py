@@ -0,0 +1,157 @@
+import logging
+import threading
+from typing import Any, Dict, List, Tuple
+from backend.agents.similarity import cosine_similarity
+'''
+报告级证据库：缓存检索到的网页摘要和知识库全文，按URL和片段编号索引并计算向量，
+后续章节先在证据库中查找相关证据，证据不足时才重新检索
+'''
+
+
+class EvidenceStore:
+    """
+    内存中的报告级证据库，一份报告一个实例，可在并发生成的章节之间共享
+
+    每条检索结果按URL登记，带全文的结果切分为片段，片段编号为"{url}#{序号}"。
+    查询时按向量相似度返回相关片段，并按URL重新组装为与search_web相同格式的结果。
+    """
+    def __init__(self, embeddings: Any = None, similarity_threshold: float = 0.82,
+                 min_results: int = 2, chunk_size: int = 800):
+        """
+        Args:
+            embeddings: 向量模型，需提供embed_documents和embed_query；None时证据库只登记不查询
+            similarity_threshold: 片段与问题的余弦相似度不低于该值时视为相关证据
+            min_results: 相关的全文证据至少覆盖多少个来源时才不再重新检索
+            chunk_size: 全文切分片段的字符数
+        """
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.min_results = min_results
+        self.chunk_size = chunk_size
+        self.logger = logging.getLogger(__name__)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._sources: Dict[str, Dict] = {}
+        self._chunks: Dict[str, Dict] = {}
+
+    def _split(self, text: str) -> List[str]:
+        return [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [text]
+
+    def add_results(self, results: List[Dict]) -> int:
+        """
+        登记一批检索结果，已登记的URL不重复登记
+
+        Args:
+            results: search_web返回的检索结果
+
+        Returns:
+            新登记的片段数量
+        """
+        new_chunks = []
+        with self._lock:
+            for result in results:
+                url = result.get("url")
+                if not url or url in self._sources:
+                    continue
+                has_full_text = bool(result.get("full_text"))
+                text = result["full_text"] if has_full_text else result.get("snippet", "")
+                if not text:
+                    continue
+                self._sources[url] = {
+                    "title": result.get("title", ""),
+                    "url": url,
+                    "source": result.get("source", "web"),
+                    "has_full_text": has_full_text,
+                }
+                for i, chunk_text in enumerate(self._split(text)):
+                    new_chunks.append({"chunk_id": f"{url}#{i}", "url": url, "index": i, "text": chunk_text, "vector": None})
+
+        if new_chunks and self.embeddings is not None:
+            try:
+                vectors = self.embeddings.embed_documents([chunk["text"] for chunk in new_chunks])
+                for chunk, vector in zip(new_chunks, vectors):
+                    chunk["vector"] = vector
+            except Exception as e:
+                self.logger.warning(f"计算证据向量失败，这些证据不参与查询: {str(e)}")
+
+        with self._lock:
+            for chunk in new_chunks:
+                self._chunks[chunk["chunk_id"]] = chunk
+        return len(new_chunks)
+
+    def query(self, question: str, k: int = 8) -> List[Dict]:
+        """
+        查询与问题相关的证据
+
+        Args:
+            question: 检索问题
+            k: 最多参与组装的片段数量
+
+        Returns:
+            按相关度排序、与search_web格式相同的结果，带全文的来源只包含相关片段
+        """
+        if self.embeddings is None:
+            return []
+        with self._lock:
+            chunks = [chunk for chunk in self._chunks.values() if chunk["vector"] is not None]
+        if not chunks:
+            return []
+        try:
+            query_vector = self.embeddings.embed_query(question)
+        except Exception as e:
+            self.logger.warning(f"计算问题向量失败，跳过证据库查询: {str(e)}")
+            return []
+
+        scored = [(cosine_similarity(query_vector, chunk["vector"]), chunk) for chunk in chunks]
+        scored = [item for item in scored if item[0] >= self.similarity_threshold]
+        scored.sort(key=lambda item: item[0], reverse=True)
+
+        grouped: Dict[str, List] = {}
+        for score, chunk in scored[:k]:
+            grouped.setdefault(chunk["url"], []).append((score, chunk))
+
+        results = []
+        for url, items in grouped.items():
+            source = self._sources[url]
+            text = "\n".join(chunk["text"] for _, chunk in sorted(items, key=lambda item: item[1]["index"]))
+            result = {
+                "title": source["title"],
+                "url": url,
+                "snippet": text[:200] + "..." if len(text) > 200 else text,
+                "source": source["source"],
+                "evidence_score": items[0][0],
+            }
+            if source["has_full_text"]:
+                result["full_text"] = text
+            results.append(result)
+        return results
+
+    def lookup(self, question: str) -> Tuple[List[Dict], bool]:
+        """
+        在证据库中查找并记录命中情况，相关的全文证据覆盖至少min_results个来源时记为命中
+
+        Args:
+            question: 检索问题
+
+        Returns:
+            (相关证据列表, 是否命中)
+        """
+        results = self.query(question)
+        enough = sum(1 for result in results if "full_text" in result) >= self.min_results
+        with self._lock:
+            if enough:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return results, enough
+
+    def stats(self) -> Dict[str, int]:
+        """返回命中次数、未命中次数、来源数和片段数"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "sources": len(self._sources),
+                "chunks": len(self._chunks),
+            }
@@ -0,0 +1,134 @@
+import json
+from typing import Any, List, Optional
+'''
+增量JSON解析：在模型流式输出的过程中，数组里的每个对象一旦语法完整就立即解析出来
+'''
+
+
+class IncrementalJsonArrayParser:
+    """
+    增量解析JSON数组中的对象元素
+
+    array_key为None时解析顶层数组的元素；否则解析顶层对象中该键对应数组的元素，
+    例如大纲{"title": ..., "structure": [{...}, {...}]}中的每个章节。
+    JSON开始之前的说明文字和```json代码块标记会被忽略。
+    """
+    def __init__(self, array_key: Optional[str] = None):
+        self.array_key = array_key
+        self.buffer = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._started = False
+        self._done = False
+        self._root_start: Optional[int] = None
+        self._root_end: Optional[int] = None
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._current_key: Optional[str] = None
+        # 目标数组所在的嵌套深度（数组本身入栈后的栈长度）
+        self._array_depth: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._array_found = False
+
+    def _reset_root(self):
+        self._started = False
+        self._root_start = None
+        self._last_string = None
+        self._current_key = None
+        self._array_depth = None
+        self._item_start = None
+
+    @property
+    def done(self) -> bool:
+        """顶层JSON是否已经结束"""
+        return self._done
+
+    def feed(self, text: str) -> List[Any]:
+        """
+        追加一段模型输出
+
+        Args:
+            text: 新增的文本
+
+        Returns:
+            本次新解析出的完整对象列表
+        """
+        self.buffer += text
+        items = []
+        root_opener = "[" if self.array_key is None else "{"
+        while self._pos < len(self.buffer) and not self._done:
+            i = self._pos
+            ch = self.buffer[i]
+            self._pos += 1
+
+            if not self._started:
+                if ch != root_opener:
+                    continue
+                self._started = True
+                self._root_start = i
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = self._decode_string(self.buffer[self._string_start:i + 1])
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                self._stack.append(ch)
+                depth = len(self._stack)
+                if self._array_depth is None and ch == "[":
+                    if self.array_key is None and depth == 1:
+                        self._array_depth = 1
+                    elif depth == 2 and self._current_key == self.array_key:
+                        self._array_depth = 2
+                elif self._array_depth is not None and ch == "{" and depth == self._array_depth + 1:
+                    self._item_start = i
+            elif ch in "}]":
+                depth = len(self._stack)
+                if ch == "}" and self._item_start is not None and depth == self._array_depth + 1:
+                    try:
+                        items.append(json.loads(self.buffer[self._item_start:i + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self._item_start = None
+                if ch == "]" and depth == self._array_depth:
+                    self._array_found = True
+                if self._stack:
+                    self._stack.pop()
+                if not self._stack:
+                    if not self._array_found and self.array_key is not None:
+                        # 说明文字中的花括号被误认为JSON开头，重新寻找
+                        self._reset_root()
+                        continue
+                    self._done = True
+                    self._root_end = i
+            elif ch == ":" and len(self._stack) == 1:
+                self._current_key = self._last_string
+            elif ch == "," and len(self._stack) == 1:
+                self._current_key = None
+        return items
+
+    def result(self) -> Any:
+        """顶层JSON结束后返回完整解析结果，尚未结束或无法解析时返回None"""
+        if not self._done:
+            return None
+        try:
+            return json.loads(self.buffer[self._root_start:self._root_end + 1])
+        except json.JSONDecodeError:
+            return None
+
+    @staticmethod
+    def _decode_string(raw: str) -> Optional[str]:
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError:
+            return None
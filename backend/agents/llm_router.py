@@ -0,0 +1,468 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, ClassVar, Dict, Iterator, List, Optional, Tuple
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel, generate_from_stream
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.rate_limiters import BaseRateLimiter
+from pydantic import PrivateAttr
+from backend.agents.cancellation import CancellationToken, OperationCancelled
+from backend.agents.tracing import record_llm_usage, span
+from backend.agents.usage import record_usage, set_price
+from backend.agents.stats import percentile
+'''
+多模型路由：记录每个模型提供方的滚动延迟（p50/p95）和错误率，
+按延迟排序选择提供方，慢请求对冲（hedge）到备用提供方，失败时自动切换
+'''
+
+# 未配置LLM_ROUTER_CONFIG时只有DeepSeek一个提供方
+DEFAULT_ROUTER_CONFIG = {
+    "providers": [
+        {
+            "name": "deepseek",
+            "model": "deepseek-chat",
+            "model_provider": "deepseek",
+            "tiers": ["default", "fast"],
+        }
+    ],
+    "hedge": True,
+    "hedge_min_delay": 2.0,
+}
+
+# 流式输出结束标记
+_STREAM_DONE = object()
+# 取消令牌触发时放入事件队列的标记
+_STREAM_CANCELLED = object()
+
+
+def load_router_config(path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    读取路由配置，路径依次取参数、环境变量LLM_ROUTER_CONFIG，都没有时使用默认配置
+
+    配置格式：
+    {
+        "providers": [
+            {"name": "deepseek", "model": "deepseek-chat", "model_provider": "deepseek", "tiers": ["default"]},
+            {"name": "local", "model": "fake-chat", "model_provider": "openai",
+             "base_url": "http://127.0.0.1:8765/v1", "api_key": "fake", "tiers": ["default", "fast"]}
+        ],
+        "hedge": true,
+        "hedge_min_delay": 2.0
+    }
+    providers中除name/tiers/price外的字段都传给模型初始化；tiers表示该提供方服务于哪些调用档位，
+    "fast"档位用于生成检索问题这类简单步骤；price为可选的每百万token价格，如{"input": 2, "output": 8}，
+    用于用量计量中的费用统计。
+    """
+    path = path or os.getenv("LLM_ROUTER_CONFIG")
+    if not path:
+        return DEFAULT_ROUTER_CONFIG
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _prompt_text(messages: List[BaseMessage]) -> str:
+    """拼接消息文本，用于在提供方没有返回用量时估算输入token数"""
+    return "\n".join(message.content if isinstance(message.content, str) else str(message.content) for message in messages)
+
+
+class ProviderStats:
+    """单个提供方最近window次调用的延迟、首个token延迟和成败"""
+    def __init__(self, window: int = 100):
+        self.latencies = deque(maxlen=window)
+        self.first_token_latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1.0 - sum(self.outcomes) / len(self.outcomes)
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = list(self.latencies)
+        first_token_latencies = list(self.first_token_latencies)
+        return {
+            "calls": len(self.outcomes),
+            "error_rate": self.error_rate,
+            "samples": len(latencies),
+            "first_token_samples": len(first_token_latencies),
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "first_token_p50": percentile(first_token_latencies, 0.5),
+            "first_token_p95": percentile(first_token_latencies, 0.95),
+        }
+
+
+class LatencyTracker:
+    """线程安全的各提供方延迟统计，同一提供方在不同档位之间共享"""
+    def __init__(self, window: int = 100, min_samples: int = 3):
+        self.window = window
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._stats: Dict[str, ProviderStats] = {}
+
+    def _get(self, name: str) -> ProviderStats:
+        if name not in self._stats:
+            self._stats[name] = ProviderStats(self.window)
+        return self._stats[name]
+
+    def record(self, name: str, latency: float, ok: bool):
+        with self._lock:
+            stats = self._get(name)
+            stats.outcomes.append(1 if ok else 0)
+            if ok:
+                stats.latencies.append(latency)
+
+    def record_first_token(self, name: str, latency: float):
+        with self._lock:
+            self._get(name).first_token_latencies.append(latency)
+
+    def snapshot(self, name: str) -> Dict[str, Any]:
+        with self._lock:
+            return self._get(name).snapshot()
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: stats.snapshot() for name, stats in self._stats.items()}
+
+    def rank(self, names: List[str], streaming: bool = False) -> List[str]:
+        """
+        按延迟排序提供方
+
+        错误率超过一半的提供方排在最后；样本不足的提供方按配置顺序排在最前，
+        先积累min_samples次统计，之后按惩罚错误率后的p50排序。
+        """
+        def key(item):
+            index, name = item
+            snapshot = self.snapshot(name)
+            unhealthy = snapshot["calls"] >= self.min_samples and snapshot["error_rate"] > 0.5
+            latency = snapshot["first_token_p50"] if streaming else snapshot["p50"]
+            samples = snapshot["first_token_samples"] if streaming else snapshot["samples"]
+            if samples < self.min_samples:
+                return (unhealthy, 0.0, index)
+            return (unhealthy, latency * (1 + 4 * snapshot["error_rate"]), index)
+        return [name for _, name in sorted(enumerate(names), key=key)]
+
+    def hedge_delay(self, name: str, streaming: bool, min_delay: float) -> Optional[float]:
+        """主提供方超过自身p95仍未响应时发起对冲请求；没有足够统计时不对冲"""
+        snapshot = self.snapshot(name)
+        p95 = snapshot["first_token_p95"] if streaming else snapshot["p95"]
+        samples = snapshot["first_token_samples"] if streaming else snapshot["samples"]
+        if samples < self.min_samples:
+            return None
+        return max(min_delay, p95)
+
+
+class RoutedChatModel(BaseChatModel):
+    """
+    在多个聊天模型之间路由的聊天模型，可以直接替代init_chat_model返回的模型使用
+
+    每次调用按延迟排序选出主提供方；主提供方超过p95仍未返回（流式调用按首个token计）时，
+    再向下一个提供方发送同样的请求，先返回的结果胜出；请求出错时依次切换到后续提供方。
+
+    调用时可以传入cancel_token（CancellationToken）：取消后调用立即抛出OperationCancelled，
+    后台的流式请求在下一段输出到达时关闭连接。
+    """
+    supports_cancellation: ClassVar[bool] = True
+
+    tier: str = "default"
+    hedge: bool = True
+    hedge_min_delay: float = 2.0
+
+    _providers: List[Tuple[str, BaseChatModel]] = PrivateAttr(default_factory=list)
+    _tracker: LatencyTracker = PrivateAttr(default=None)
+    _executor: ThreadPoolExecutor = PrivateAttr(default=None)
+
+    def __init__(self, providers: List[Tuple[str, BaseChatModel]], tracker: Optional[LatencyTracker] = None, **kwargs: Any):
+        """
+        Args:
+            providers: (提供方名称, 聊天模型)列表，顺序即没有统计数据时的优先级
+            tracker: 延迟统计，多个路由模型可以共享
+        """
+        super().__init__(**kwargs)
+        if not providers:
+            raise ValueError(f"档位 '{self.tier}' 没有可用的模型提供方")
+        self._providers = list(providers)
+        self._tracker = tracker or LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix=f"llm-router-{self.tier}")
+
+    @property
+    def _llm_type(self) -> str:
+        return "routed-chat-model"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"tier": self.tier, "providers": [name for name, _ in self._providers]}
+
+    @property
+    def tracker(self) -> LatencyTracker:
+        return self._tracker
+
+    def latency_report(self) -> Dict[str, Dict[str, Any]]:
+        """各提供方当前的延迟和错误率统计"""
+        return {name: self._tracker.snapshot(name) for name, _ in self._providers}
+
+    def _ranked_providers(self, streaming: bool) -> List[Tuple[str, BaseChatModel]]:
+        models = dict(self._providers)
+        return [(name, models[name]) for name in self._tracker.rank([name for name, _ in self._providers], streaming)]
+
+    def _hedge_delay(self, name: str, streaming: bool) -> Optional[float]:
+        if not self.hedge or len(self._providers) < 2:
+            return None
+        return self._tracker.hedge_delay(name, streaming, self.hedge_min_delay)
+
+    def _invoke_provider(self, name: str, model: BaseChatModel, messages: List[BaseMessage], stop: Optional[List[str]], **kwargs: Any) -> BaseMessage:
+        start = time.monotonic()
+        try:
+            message = model.invoke(messages, stop=stop, **kwargs)
+        except Exception:
+            self._tracker.record(name, time.monotonic() - start, ok=False)
+            raise
+        self._tracker.record(name, time.monotonic() - start, ok=True)
+        return message
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        if kwargs.get("cancel_token") is not None:
+            # 非流式请求无法中途关闭，需要取消时改用流式请求拼接结果
+            return generate_from_stream(self._stream(messages, stop=stop, run_manager=run_manager, **kwargs))
+        kwargs.pop("cancel_token", None)
+        with span("llm.call", tier=self.tier, streaming=False) as call_span:
+            result = self._generate_hedged(messages, stop, **kwargs)
+            message = result.generations[0].message
+            record_usage(result.llm_output["provider"], getattr(message, "usage_metadata", None),
+                         _prompt_text(messages), message.content or "")
+            if call_span is not None:
+                call_span.set(provider=result.llm_output["provider"], hedged=result.llm_output["hedged"],
+                              output_chars=len(message.content or ""))
+                record_llm_usage(call_span, message)
+            return result
+
+    def _generate_hedged(self, messages: List[BaseMessage], stop: Optional[List[str]], **kwargs: Any) -> ChatResult:
+        """非流式请求：按排序调用提供方，主提供方过慢时对冲，失败时切换"""
+        ranked = self._ranked_providers(streaming=False)
+        hedge_delay = self._hedge_delay(ranked[0][0], streaming=False)
+        pending = {}
+        next_index = 0
+        hedged = False
+        last_error = None
+
+        def launch():
+            nonlocal next_index
+            name, model = ranked[next_index]
+            next_index += 1
+            pending[self._executor.submit(self._invoke_provider, name, model, messages, stop, **kwargs)] = name
+
+        launch()
+        while pending:
+            can_hedge = hedge_delay is not None and not hedged and next_index < len(ranked)
+            done, _ = wait(list(pending), timeout=hedge_delay if can_hedge else None, return_when=FIRST_COMPLETED)
+            if not done:
+                # 主提供方过慢，对冲到下一个提供方
+                hedged = True
+                launch()
+                continue
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    message = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                return ChatResult(generations=[ChatGeneration(message=message)], llm_output={"provider": name, "hedged": hedged})
+            # 已完成的请求都失败了：没有其他进行中的请求时切换到下一个提供方
+            if not pending and next_index < len(ranked):
+                launch()
+        raise last_error
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        cancel_token: Optional[CancellationToken] = kwargs.pop("cancel_token", None)
+        with span("llm.call", tier=self.tier, streaming=True) as call_span:
+            info: Dict[str, Any] = {}
+            start = time.monotonic()
+            output_parts: List[str] = []
+            output_chars = 0
+            # 开启stream_usage的提供方在最后一个增量中返回用量
+            usage: Dict[str, int] = {}
+            try:
+                for chunk in self._stream_hedged(messages, stop, cancel_token, info, **kwargs):
+                    content = chunk.message.content or ""
+                    if call_span is not None and not output_chars and content:
+                        call_span.set(ttft=time.monotonic() - start)
+                    output_chars += len(content)
+                    output_parts.append(content)
+                    chunk_usage = getattr(chunk.message, "usage_metadata", None)
+                    if chunk_usage:
+                        for key in ("input_tokens", "output_tokens"):
+                            usage[key] = usage.get(key, 0) + chunk_usage.get(key, 0)
+                    if call_span is not None:
+                        record_llm_usage(call_span, chunk.message)
+                    yield chunk
+            finally:
+                # 取消或出错时也计入已经产生的用量
+                if info.get("provider") is not None:
+                    record_usage(info["provider"], usage, _prompt_text(messages), "".join(output_parts))
+                if call_span is not None:
+                    call_span.set(provider=info.get("provider"), hedged=info.get("hedged", False), output_chars=output_chars)
+
+    def _stream_hedged(self, messages: List[BaseMessage], stop: Optional[List[str]], cancel_token: Optional[CancellationToken],
+                       info: Dict[str, Any], **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        """流式请求：第一个产生输出的提供方胜出，胜出的提供方和是否对冲记录到info"""
+        ranked = self._ranked_providers(streaming=True)
+        hedge_delay = self._hedge_delay(ranked[0][0], streaming=True)
+        events = queue.Queue()
+        stop_events: Dict[str, threading.Event] = {}
+        next_index = 0
+        running = 0
+        hedged = False
+        winner = None
+        last_error = None
+
+        def pump(name: str, model: BaseChatModel, stop_event: threading.Event):
+            start = time.monotonic()
+            first = True
+            stream = model.stream(messages, stop=stop, **kwargs)
+            try:
+                for chunk in stream:
+                    if stop_event.is_set():
+                        return
+                    if first:
+                        first = False
+                        self._tracker.record_first_token(name, time.monotonic() - start)
+                    events.put((name, chunk, None))
+                self._tracker.record(name, time.monotonic() - start, ok=True)
+                events.put((name, _STREAM_DONE, None))
+            except Exception as e:
+                self._tracker.record(name, time.monotonic() - start, ok=False)
+                events.put((name, None, e))
+            finally:
+                # 提前退出时关闭底层流，释放HTTP连接
+                stream.close()
+
+        def launch():
+            nonlocal next_index, running
+            name, model = ranked[next_index]
+            next_index += 1
+            running += 1
+            stop_events[name] = threading.Event()
+            self._executor.submit(pump, name, model, stop_events[name])
+
+        remove_callback = lambda: None
+        if cancel_token is not None:
+            remove_callback = cancel_token.add_callback(lambda: events.put((None, _STREAM_CANCELLED, None)))
+        launch()
+        try:
+            while True:
+                can_hedge = winner is None and hedge_delay is not None and not hedged and next_index < len(ranked)
+                try:
+                    name, chunk, error = events.get(timeout=hedge_delay if can_hedge else None)
+                except queue.Empty:
+                    # 首个token迟迟未到，对冲到下一个提供方
+                    hedged = True
+                    info["hedged"] = True
+                    launch()
+                    continue
+
+                if chunk is _STREAM_CANCELLED:
+                    raise OperationCancelled(cancel_token.reason)
+                if winner is None:
+                    if error is not None:
+                        running -= 1
+                        last_error = error
+                        if running == 0:
+                            if next_index >= len(ranked):
+                                raise last_error
+                            launch()
+                        continue
+                    # 第一个产生输出的提供方胜出，停止其他请求
+                    winner = name
+                    info["provider"] = name
+                    for other, stop_event in stop_events.items():
+                        if other != winner:
+                            stop_event.set()
+
+                if name != winner:
+                    continue
+                if error is not None:
+                    # 已经输出了部分内容，无法再切换提供方
+                    raise error
+                if chunk is _STREAM_DONE:
+                    return
+                yield ChatGenerationChunk(message=chunk)
+        finally:
+            remove_callback()
+            for stop_event in stop_events.values():
+                stop_event.set()
+
+
+def build_routed_models(config: Dict[str, Any], get_model, tracker: Optional[LatencyTracker] = None,
+                        rate_limiter: Optional[BaseRateLimiter] = None) -> Dict[str, RoutedChatModel]:
+    """
+    根据配置为每个档位创建路由模型
+
+    Args:
+        config: load_router_config返回的配置
+        get_model: 根据提供方配置创建聊天模型的函数，参数同init_chat_model
+        tracker: 共享的延迟统计
+        rate_limiter: 各档位共享的速率限制，每次调用路由模型前取一个令牌
+
+    Returns:
+        {档位: 路由模型}
+    """
+    tracker = tracker or LatencyTracker()
+    tiers: Dict[str, List[Tuple[str, BaseChatModel]]] = {}
+    for provider in config["providers"]:
+        params = {key: value for key, value in provider.items() if key not in ("name", "tiers", "price")}
+        if "price" in provider:
+            set_price(provider["name"], provider["price"]["input"], provider["price"]["output"])
+        model = get_model(params.pop("model"), **params)
+        for tier in provider.get("tiers", ["default"]):
+            tiers.setdefault(tier, []).append((provider["name"], model))
+    return {
+        tier: RoutedChatModel(
+            providers,
+            tracker=tracker,
+            tier=tier,
+            hedge=config.get("hedge", True),
+            hedge_min_delay=config.get("hedge_min_delay", 2.0),
+            rate_limiter=rate_limiter,
+        )
+        for tier, providers in tiers.items()
+    }
+
+
+if __name__ == "__main__":
+    # 离线演示：一个慢提供方和一个快提供方，观察路由如何转向更快的提供方
+    import sys
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+    from backend.benchmarks.fake_llm_server import FakeLLMServer
+    from backend.agents.model_registry import ModelRegistry
+
+    slow_server = FakeLLMServer(first_token_latency=1.0, seed=1).start()
+    fast_server = FakeLLMServer(first_token_latency=0.2, seed=2).start()
+    demo_config = {
+        "providers": [
+            {"name": "slow", "model": "fake-chat", "model_provider": "openai", "base_url": slow_server.base_url, "api_key": "fake"},
+            {"name": "fast", "model": "fake-chat", "model_provider": "openai", "base_url": fast_server.base_url, "api_key": "fake"},
+        ],
+        "hedge": True,
+        "hedge_min_delay": 0.3,
+    }
+    registry = ModelRegistry()
+    routed_model = build_routed_models(demo_config, registry.get_chat_model, registry.latency_tracker)["default"]
+
+    for i in range(20):
+        start = time.monotonic()
+        routed_model.invoke("量子计算技术动态")
+        print(f"第{i + 1}次调用耗时 {time.monotonic() - start:.2f}s")
+    print(json.dumps(routed_model.latency_report(), ensure_ascii=False, indent=2))
+
+    slow_server.stop()
+    fast_server.stop()
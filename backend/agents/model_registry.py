@@ -0,0 +1,169 @@
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+import dotenv
+import httpx
+from langchain.chat_models import init_chat_model
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_openai import OpenAIEmbeddings
+from backend.agents.llm_router import LatencyTracker, RoutedChatModel, build_routed_models, load_router_config
+from backend.agents.rate_limit import LLM, get_rate_limiter
+'''
+进程级模型注册表：各代理共享同一批模型客户端和HTTP连接池，创建代理不再重复初始化模型
+'''
+dotenv.load_dotenv()
+
+
+class ModelRegistry:
+    """
+    模型注册表：按配置缓存聊天模型和向量模型，所有模型共用一个带连接上限的HTTP客户端
+    
+    代理通过get_routed_model按档位获取路由模型，路由配置见llm_router.load_router_config。
+
+    连接池上限同时就是并发请求上限，超出的请求会等待空闲连接。
+    默认值可以通过环境变量LLM_MAX_CONNECTIONS、LLM_MAX_KEEPALIVE_CONNECTIONS、
+    LLM_TIMEOUT、LLM_MAX_RETRIES配置。
+    """
+    def __init__(self, max_connections: Optional[int] = None, max_keepalive_connections: Optional[int] = None,
+                 timeout: Optional[float] = None, max_retries: Optional[int] = None):
+        """
+        Args:
+            max_connections: 连接池最大连接数，即同时进行的模型请求上限
+            max_keepalive_connections: 保持活跃的空闲连接数
+            timeout: 单次请求超时（秒），包括等待空闲连接的时间
+            max_retries: 模型请求失败后的重试次数
+        """
+        self.max_connections = max_connections or int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+        self.max_keepalive_connections = max_keepalive_connections or int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+        self.timeout = timeout or float(os.getenv("LLM_TIMEOUT", "120"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+        self._lock = threading.Lock()
+        self._chat_models: Dict[Tuple, BaseChatModel] = {}
+        self._embeddings: Dict[str, OpenAIEmbeddings] = {}
+        self._http_client: Optional[httpx.Client] = None
+        self._routed_models: Optional[Dict[str, RoutedChatModel]] = None
+        self.latency_tracker = LatencyTracker()
+
+    @property
+    def http_client(self) -> httpx.Client:
+        """共享的同步HTTP客户端，httpx.Client本身是线程安全的"""
+        with self._lock:
+            return self._get_http_client()
+
+    def _get_http_client(self) -> httpx.Client:
+        # 调用方需持有self._lock
+        if self._http_client is None:
+            self._http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=60,
+                ),
+                timeout=httpx.Timeout(self.timeout),
+            )
+        return self._http_client
+
+    def get_chat_model(self, model: str = "deepseek-chat", model_provider: str = "deepseek", temperature: float = 0, **kwargs: Any) -> BaseChatModel:
+        """
+        获取共享的聊天模型，相同配置只创建一次
+
+        Args:
+            model: 模型名称
+            model_provider: 模型提供方，同init_chat_model
+            temperature: 温度
+            **kwargs: 其他传给init_chat_model的参数
+
+        Returns:
+            聊天模型
+        """
+        key = (model, model_provider, temperature, tuple(sorted(kwargs.items())))
+        with self._lock:
+            if key not in self._chat_models:
+                params = {"max_retries": self.max_retries, "timeout": self.timeout}
+                if model_provider in ("openai", "deepseek"):
+                    # 流式输出的最后一个增量中返回token用量，用于用量计量
+                    params["stream_usage"] = True
+                params.update(kwargs)
+                self._chat_models[key] = init_chat_model(
+                    model,
+                    model_provider=model_provider,
+                    temperature=temperature,
+                    http_client=self._get_http_client(),
+                    **params
+                )
+            return self._chat_models[key]
+
+    def get_routed_model(self, tier: str = "default") -> RoutedChatModel:
+        """
+        获取指定档位的路由模型，路由配置和全局速率限制（LLM_RATE_LIMIT）在第一次调用时读取
+
+        Args:
+            tier: 调用档位，"default"用于撰写类调用，"fast"用于生成检索问题这类简单步骤；
+                  配置中没有该档位时退回"default"
+
+        Returns:
+            路由模型
+        """
+        if self._routed_models is None:
+            routed_models = build_routed_models(load_router_config(), self.get_chat_model, self.latency_tracker,
+                                                get_rate_limiter(LLM))
+            with self._lock:
+                if self._routed_models is None:
+                    self._routed_models = routed_models
+        return self._routed_models.get(tier) or self._routed_models["default"]
+
+    def get_embeddings(self, model: str = "text-embedding-ada-002") -> OpenAIEmbeddings:
+        """
+        获取共享的向量模型
+
+        设置环境变量EMBEDDINGS_BASE_URL时改用该地址的OpenAI兼容向量服务（例如本地假LLM服务），
+        此时直接发送原文，不在本地用tiktoken切分。
+        """
+        with self._lock:
+            if model not in self._embeddings:
+                params = {}
+                base_url = os.getenv("EMBEDDINGS_BASE_URL")
+                if base_url:
+                    params = {"openai_api_base": base_url, "check_embedding_ctx_length": False}
+                self._embeddings[model] = OpenAIEmbeddings(
+                    openai_api_key=os.getenv("OPENAI_API_KEY"),
+                    model=model,
+                    http_client=self._get_http_client(),
+                    max_retries=self.max_retries,
+                    **params
+                )
+            return self._embeddings[model]
+
+    def close(self):
+        """关闭连接池并清空缓存的模型"""
+        with self._lock:
+            if self._http_client is not None:
+                self._http_client.close()
+                self._http_client = None
+            self._chat_models.clear()
+            self._embeddings.clear()
+            self._routed_models = None
+
+
+_default_registry = ModelRegistry()
+
+
+def get_registry() -> ModelRegistry:
+    """获取进程级默认注册表"""
+    return _default_registry
+
+
+def get_chat_model(model: str = "deepseek-chat", model_provider: str = "deepseek", temperature: float = 0, **kwargs: Any) -> BaseChatModel:
+    """从默认注册表获取共享的聊天模型"""
+    return _default_registry.get_chat_model(model, model_provider=model_provider, temperature=temperature, **kwargs)
+
+
+def get_routed_model(tier: str = "default") -> RoutedChatModel:
+    """从默认注册表获取指定档位的路由模型"""
+    return _default_registry.get_routed_model(tier)
+
+
+def get_embeddings(model: str = "text-embedding-ada-002") -> OpenAIEmbeddings:
+    """从默认注册表获取共享的向量模型"""
+    return _default_registry.get_embeddings(model)
@@ -0,0 +1,93 @@
+from typing import Dict, List, Set, Tuple
+from backend.agents.similarity import text_shingles
+'''
+新信息检测：按n元组重合度判断检索结果中有多少内容是章节尚未覆盖的，
+重复的结果不再整合，连续几个问题都没有新信息时提前结束章节的检索
+'''
+
+
+class NoveltyGate:
+    """
+    章节级的新信息门限，一个章节一个实例
+
+    已整合的文档的n元组记入已覆盖集合；一篇新文档中不在已覆盖集合里的n元组比例即为它的新信息比例，
+    低于threshold时视为重复。连续patience个问题的检索结果都没有新信息时，认为章节信息已饱和。
+    """
+    def __init__(self, threshold: float = 0.25, patience: int = 2, n: int = 3):
+        """
+        Args:
+            threshold: 新信息比例低于该值的文档视为重复，0表示不过滤
+            patience: 连续多少个问题没有新信息时结束章节的检索，0表示不提前结束
+            n: n元组长度，中文按字计；取3可以避免同一主题的常用词被当成重复
+        """
+        self.threshold = threshold
+        self.patience = patience
+        self.n = n
+        self.skipped_documents = 0
+        self.stale_questions = 0
+        # 章节是否因信息饱和跳过了剩余问题，由调用方设置
+        self.stopped_early = False
+        self._covered: Set[str] = set()
+
+    def add(self, text: str):
+        """把已整合的内容记入已覆盖集合"""
+        if text:
+            self._covered |= text_shingles(text, self.n)
+
+    def novelty(self, text: str) -> float:
+        """文本中尚未覆盖的n元组比例，空文本为0"""
+        shingles = text_shingles(text, self.n)
+        if not shingles:
+            return 0.0
+        return len(shingles - self._covered) / len(shingles)
+
+    def filter(self, search_results: List[Dict]) -> Tuple[List[Dict], int]:
+        """
+        去掉没有新信息的全文结果，同一批结果之间也会去重
+
+        只有带全文的结果参与整合，不带全文的结果原样保留。保留的结果不记入已覆盖集合，
+        整合成功后由调用方调用add_results记入，整合失败时之后的检索结果不会被误判为重复。
+
+        Args:
+            search_results: 一个问题的检索结果
+
+        Returns:
+            (保留的结果, 去掉的结果数)
+        """
+        if not self.threshold:
+            return search_results, 0
+        kept = []
+        skipped = 0
+        batch: Set[str] = set()
+        for result in search_results:
+            if "full_text" in result:
+                shingles = text_shingles(result["full_text"], self.n)
+                if not shingles or len(shingles - self._covered - batch) / len(shingles) < self.threshold:
+                    skipped += 1
+                    continue
+                batch |= shingles
+            kept.append(result)
+        self.skipped_documents += skipped
+        return kept, skipped
+
+    def add_results(self, search_results: List[Dict]):
+        """把已整合的检索结果的全文记入已覆盖集合"""
+        if not self.threshold:
+            return
+        for result in search_results:
+            if "full_text" in result:
+                self.add(result["full_text"])
+
+    def record_question(self, has_new_information: bool) -> bool:
+        """
+        记录一个问题的检索结果是否有新信息
+
+        Returns:
+            章节信息是否已饱和，应当结束检索
+        """
+        self.stale_questions = 0 if has_new_information else self.stale_questions + 1
+        return self.saturated
+
+    @property
+    def saturated(self) -> bool:
+        return bool(self.patience) and self.stale_questions >= self.patience
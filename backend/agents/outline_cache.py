@@ -0,0 +1,196 @@
+import copy
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from backend.agents.similarity import most_similar
+from backend.agents.model_registry import get_embeddings
+'''
+大纲缓存：按主题向量保存生成过的报告大纲并落盘，相近主题（例如每周的同一份简报）直接复用已有大纲，
+省去报告开头生成大纲的一次完整模型调用
+'''
+
+DEFAULT_OUTLINE_CACHE_PATH = os.getenv("OUTLINE_CACHE_PATH", "./outline_cache.json")
+
+
+def _normalize(topic: str) -> str:
+    return "".join(topic.split()).lower()
+
+
+def adapt_outline(structure: Dict, source_topic: str, topic: str) -> Dict:
+    """
+    把相近主题的大纲改写为新主题的大纲：标题换成新主题，章节和要点中出现的原主题替换为新主题
+
+    Args:
+        structure: 原主题的大纲
+        source_topic: 原主题
+        topic: 新主题
+
+    Returns:
+        新的大纲，不修改原大纲
+    """
+    adapted = copy.deepcopy(structure)
+    adapted["title"] = topic
+    if source_topic == topic:
+        return adapted
+    for section in adapted.get("structure", []):
+        section["subtitle"] = section.get("subtitle", "").replace(source_topic, topic)
+        section["content"] = [point.replace(source_topic, topic) if isinstance(point, str) else point
+                              for point in section.get("content", [])]
+    return adapted
+
+
+class OutlineCache:
+    """
+    落盘的大纲缓存，保存为一个JSON文件，多份报告并发生成时共享同一个实例
+
+    主题规范化后完全相同时不需要向量即可命中；否则按主题向量的余弦相似度查找，
+    不低于similarity_threshold时命中。超过max_age_days的大纲不再复用，下次生成后覆盖。
+    """
+    def __init__(self, path: str = DEFAULT_OUTLINE_CACHE_PATH, embeddings: Any = None,
+                 similarity_threshold: float = 0.9, max_age_days: float = 30, max_entries: int = 200):
+        """
+        Args:
+            path: 缓存文件路径
+            embeddings: 向量模型，需提供embed_query；None时只按完全相同的主题命中
+            similarity_threshold: 主题向量相似度不低于该值时复用大纲
+            max_age_days: 大纲的最长复用天数
+            max_entries: 最多保存的大纲数，超出时淘汰最早生成的
+        """
+        self.path = path
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.max_age_days = max_age_days
+        self.max_entries = max_entries
+        self.logger = logging.getLogger(__name__)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: Optional[List[Dict]] = None
+        # 主题 -> 向量，lookup计算过的向量在store时直接使用
+        self._vectors: Dict[str, List[float]] = {}
+
+    def _load(self) -> List[Dict]:
+        if self._entries is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except FileNotFoundError:
+                self._entries = []
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"读取大纲缓存失败，重新开始缓存: {str(e)}")
+                self._entries = []
+        return self._entries
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _embed(self, topic: str) -> Optional[List[float]]:
+        if self.embeddings is None:
+            return None
+        if topic not in self._vectors:
+            try:
+                self._vectors[topic] = self.embeddings.embed_query(topic)
+            except Exception as e:
+                self.logger.warning(f"计算主题向量失败，只按完全相同的主题查找大纲: {str(e)}")
+                return None
+        return self._vectors[topic]
+
+    def lookup(self, topic: str) -> Optional[Dict]:
+        """
+        查找可以复用的大纲
+
+        Args:
+            topic: 报告主题
+
+        Returns:
+            {"structure": 改写为新主题的大纲, "topic": 原主题, "score": 相似度}，没有可复用的大纲时返回None
+        """
+        with self._lock:
+            oldest = time.time() - self.max_age_days * 86400
+            entries = [entry for entry in self._load() if entry["created_at"] >= oldest]
+        match, score = None, 0.0
+        key = _normalize(topic)
+        for entry in entries:
+            if _normalize(entry["topic"]) == key:
+                match, score = entry, 1.0
+                break
+        if match is None:
+            vector = self._embed(topic)
+            candidates = [entry for entry in entries if entry.get("vector")]
+            if vector is not None and candidates:
+                index, score = most_similar(vector, [entry["vector"] for entry in candidates])
+                if score >= self.similarity_threshold:
+                    match = candidates[index]
+        with self._lock:
+            if match is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return {"structure": adapt_outline(match["structure"], match["topic"], topic), "topic": match["topic"], "score": score}
+
+    def store(self, topic: str, structure: Dict):
+        """
+        保存新生成的大纲，同一主题的旧大纲被替换
+
+        Args:
+            topic: 报告主题
+            structure: 完整的报告大纲
+        """
+        if not structure.get("structure"):
+            return
+        vector = self._embed(topic)
+        with self._lock:
+            key = _normalize(topic)
+            entries = [entry for entry in self._load() if _normalize(entry["topic"]) != key]
+            entries.append({"topic": topic, "vector": vector, "structure": structure, "created_at": time.time()})
+            entries.sort(key=lambda entry: entry["created_at"])
+            self._entries = entries[-self.max_entries:]
+            self._vectors.pop(topic, None)
+            try:
+                self._save()
+            except OSError as e:
+                self.logger.warning(f"写入大纲缓存失败: {str(e)}")
+
+    def stats(self) -> Dict[str, int]:
+        """返回命中次数、未命中次数和保存的大纲数"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._load())}
+
+
+_default_cache: Optional[OutlineCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_outline_cache() -> Optional[OutlineCache]:
+    """
+    获取进程级大纲缓存，第一次调用时创建；环境变量OUTLINE_CACHE_PATH设为空时不使用缓存
+
+    相似度阈值和最长复用天数分别由环境变量OUTLINE_CACHE_THRESHOLD和OUTLINE_CACHE_MAX_AGE_DAYS设置
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None and DEFAULT_OUTLINE_CACHE_PATH:
+            try:
+                embeddings = get_embeddings()
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"无法加载向量模型，大纲缓存只按完全相同的主题命中: {str(e)}")
+                embeddings = None
+            _default_cache = OutlineCache(
+                embeddings=embeddings,
+                similarity_threshold=float(os.getenv("OUTLINE_CACHE_THRESHOLD", "0.9")),
+                max_age_days=float(os.getenv("OUTLINE_CACHE_MAX_AGE_DAYS", "30")),
+            )
+        return _default_cache
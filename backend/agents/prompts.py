@@ -111,3 +111,34 @@ refine_template = """
 只需要返回完善后的部分，无需回答其他语言
 """
 
+
+delta_refine_template = """
+你是一个专业的研究报告撰写助手。你之前已经为主题"{topic}"的报告的"{section}"部分撰写了以下内容，每个段落前的方括号里是段落编号:
+
+已有内容:
+{existing_content}
+
+现在你有了新的参考文档:
+{document}
+
+请根据新文档对已有内容进行完善，但不要重写整个章节，只返回需要做的修改。修改以JSON数组的形式返回，支持以下几种：
+1. 替换段落：{{"op": "replace", "id": "p2", "text": "修改后的完整段落"}}
+2. 在某段之后插入新段落：{{"op": "insert_after", "id": "p3", "text": "新段落"}}，id为"start"时插在最前面
+3. 在末尾追加新段落：{{"op": "append", "text": "新段落"}}
+4. 删除段落：{{"op": "delete", "id": "p4"}}
+不要改变原有的标注出处。如果用到了新文档的内容，在后面加一个括号，括号里写上新文档的url。
+text中不要包含段落编号。新文档没有可补充的内容时返回[]。
+只返回JSON数组，不要返回其他内容。
+"""
+
+followup_question_template = """
+你是一个检索词生成专家，正在撰写一份关于"{topic}"的报告的"{section}"部分。你已经用搜索问题"{question}"检索到以下证据:
+{evidence}
+
+本章节已经检索过的问题:
+{known_questions}
+
+请找出证据中提到但没有说清楚的内容，或者撰写本章节还缺少的关键信息（例如具体数据、时间、主体、原因和影响），针对这些缺口生成最多{max_questions}个新的搜索问题。不要重复已经检索过的问题。证据已经足够时不生成问题。
+用<|think_start|><|think_end|>来表示你的思考过程。
+用<|question_start|><|question_end|>来表示你生成的搜索问题。
+"""
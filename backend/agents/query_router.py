@@ -0,0 +1,227 @@
+import json
+import math
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+'''
+本地路由：在调用LLM之前，用关键词/特征打分的小型逻辑回归模型
+判断"是否需要网络搜索"和"是否需要获取全文"，只有低置信度时才交给LLM判断
+'''
+
+NEED_SEARCH = "need_search"
+NEED_FULL_TEXT = "need_full_text"
+
+# 关键词特征组
+RECENCY_WORDS = ["最新", "最近", "近期", "今年", "去年", "本周", "本月", "今天", "昨天", "目前", "当前", "现在", "动态", "进展", "新闻", "发布", "宣布"]
+DATA_WORDS = ["多少", "数据", "价格", "排名", "统计", "规模", "市场", "份额", "增长", "销量", "融资", "投资"]
+SPECIFIC_WORDS = ["哪些", "哪家", "哪个", "谁", "公司", "企业", "政策", "法规", "会议", "报告", "计划", "战略"]
+GENERAL_WORDS = ["什么是", "是什么", "原理", "定义", "概念", "含义", "区别", "介绍一下", "解释"]
+SUBJECTIVE_WORDS = ["你觉得", "你认为", "怎么看", "建议", "如何评价", "意见"]
+CHITCHAT_WORDS = ["你好", "您好", "谢谢", "再见", "你是谁", "哈哈"]
+DEPTH_WORDS = ["详细", "具体", "全面", "深入", "分析", "解读", "原因", "影响", "对比", "为什么", "如何", "细节", "全文"]
+BRIEF_WORDS = ["简单", "简要", "一句话", "概括", "是否", "有没有", "是不是"]
+
+YEAR_PATTERN = re.compile(r"(19|20)\d{2}")
+NUMBER_PATTERN = re.compile(r"\d")
+
+# 没有训练数据时使用的先验权重
+DEFAULT_WEIGHTS = {
+    NEED_SEARCH: {
+        "bias": 0.0,
+        "recency": 2.5,
+        "year": 2.0,
+        "data": 1.8,
+        "specific": 1.2,
+        "general": -2.2,
+        "subjective": -2.5,
+        "chitchat": -4.0,
+        "short_query": -0.8,
+        "long_query": 0.4,
+    },
+    NEED_FULL_TEXT: {
+        "bias": -0.5,
+        "depth": 2.2,
+        "brief": -2.0,
+        "data": 0.6,
+        "long_query": 0.8,
+        "short_query": -0.6,
+        "few_results": -0.8,
+        "short_snippets": 1.0,
+    },
+}
+
+
+def _count_hits(text: str, words: List[str]) -> float:
+    """统计关键词命中数，命中多次时收益递减"""
+    hits = sum(1 for word in words if word in text)
+    return math.log1p(hits) / math.log(2) if hits else 0.0
+
+
+def extract_search_features(query: str) -> Dict[str, float]:
+    """提取"是否需要网络搜索"的特征"""
+    length = len(query.strip())
+    return {
+        "bias": 1.0,
+        "recency": _count_hits(query, RECENCY_WORDS),
+        "year": 1.0 if YEAR_PATTERN.search(query) else 0.0,
+        "data": _count_hits(query, DATA_WORDS) + (0.5 if NUMBER_PATTERN.search(query) else 0.0),
+        "specific": _count_hits(query, SPECIFIC_WORDS),
+        "general": _count_hits(query, GENERAL_WORDS),
+        "subjective": _count_hits(query, SUBJECTIVE_WORDS),
+        "chitchat": _count_hits(query, CHITCHAT_WORDS),
+        "short_query": 1.0 if length <= 6 else 0.0,
+        "long_query": 1.0 if length >= 25 else 0.0,
+    }
+
+
+def extract_full_text_features(query: str, search_results_text: str = "") -> Dict[str, float]:
+    """提取"是否需要获取全文"的特征"""
+    length = len(query.strip())
+    blocks = [block for block in search_results_text.split("\n---\n") if block.strip()]
+    snippet_length = sum(len(line) for block in blocks for line in block.split("\n") if line.startswith("摘要:"))
+    return {
+        "bias": 1.0,
+        "depth": _count_hits(query, DEPTH_WORDS),
+        "brief": _count_hits(query, BRIEF_WORDS),
+        "data": _count_hits(query, DATA_WORDS),
+        "long_query": 1.0 if length >= 25 else 0.0,
+        "short_query": 1.0 if length <= 6 else 0.0,
+        "few_results": 1.0 if len(blocks) <= 1 else 0.0,
+        "short_snippets": 1.0 if blocks and snippet_length / len(blocks) < 60 else 0.0,
+    }
+
+
+FEATURE_EXTRACTORS = {
+    NEED_SEARCH: lambda query, context: extract_search_features(query),
+    NEED_FULL_TEXT: extract_full_text_features,
+}
+
+
+def _sigmoid(x: float) -> float:
+    if x >= 0:
+        return 1.0 / (1.0 + math.exp(-x))
+    z = math.exp(x)
+    return z / (1.0 + z)
+
+
+class QueryRouter:
+    """
+    本地路由器：对每个判断任务做逻辑回归打分
+
+    置信度（max(p, 1-p)）不低于阈值时直接给出判断，否则返回None，由调用方回退到LLM。
+    LLM的判断结果可以通过log_decision记录下来，再用train_from_log训练出新的权重。
+    """
+    def __init__(self, model_path: Optional[str] = "./router_model.json",
+                 log_path: Optional[str] = "./router_decisions.jsonl",
+                 confidence_threshold: float = 0.85):
+        """
+        Args:
+            model_path: 训练后权重文件路径，不存在时使用先验权重
+            log_path: LLM判断结果的日志路径，None表示不记录
+            confidence_threshold: 本地判断的最低置信度
+        """
+        self.model_path = model_path
+        self.log_path = log_path
+        self.confidence_threshold = confidence_threshold
+        self.weights = {task: dict(weights) for task, weights in DEFAULT_WEIGHTS.items()}
+        self._log_lock = threading.Lock()
+        if model_path and os.path.exists(model_path):
+            with open(model_path, "r", encoding="utf-8") as f:
+                for task, weights in json.load(f).items():
+                    self.weights.setdefault(task, {}).update(weights)
+
+    def probability(self, task: str, query: str, context: str = "") -> float:
+        """返回任务判断为"是"的概率"""
+        features = FEATURE_EXTRACTORS[task](query, context)
+        weights = self.weights[task]
+        return _sigmoid(sum(weights.get(name, 0.0) * value for name, value in features.items()))
+
+    def predict(self, task: str, query: str, context: str = "") -> Tuple[Optional[bool], float]:
+        """
+        本地判断
+
+        Returns:
+            (判断结果, 置信度)，置信度不足时判断结果为None
+        """
+        p = self.probability(task, query, context)
+        confidence = max(p, 1.0 - p)
+        if confidence < self.confidence_threshold:
+            return None, confidence
+        return p >= 0.5, confidence
+
+    def predict_need_search(self, query: str) -> Tuple[Optional[bool], float]:
+        return self.predict(NEED_SEARCH, query)
+
+    def predict_need_full_text(self, query: str, search_results_text: str = "") -> Tuple[Optional[bool], float]:
+        return self.predict(NEED_FULL_TEXT, query, search_results_text)
+
+    def log_decision(self, task: str, query: str, decision: bool, context: str = ""):
+        """记录一次LLM判断，作为本地路由的训练数据"""
+        if not self.log_path:
+            return
+        record = {"task": task, "query": query, "context": context, "label": bool(decision)}
+        with self._log_lock:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    @staticmethod
+    def train_from_log(log_path: str, model_path: str, epochs: int = 200, learning_rate: float = 0.1, l2: float = 0.01) -> Dict[str, Dict[str, float]]:
+        """
+        用记录下来的LLM判断训练逻辑回归权重，从先验权重开始做梯度下降
+
+        Args:
+            log_path: log_decision写入的日志
+            model_path: 权重输出路径
+            epochs: 训练轮数
+            learning_rate: 学习率
+            l2: 向先验权重收缩的L2系数
+
+        Returns:
+            训练得到的权重
+        """
+        samples = {task: [] for task in DEFAULT_WEIGHTS}
+        with open(log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                task = record.get("task")
+                if task not in FEATURE_EXTRACTORS:
+                    continue
+                features = FEATURE_EXTRACTORS[task](record["query"], record.get("context", ""))
+                samples[task].append((features, 1.0 if record["label"] else 0.0))
+
+        trained = {}
+        for task, task_samples in samples.items():
+            prior = DEFAULT_WEIGHTS[task]
+            weights = dict(prior)
+            if not task_samples:
+                trained[task] = weights
+                continue
+            for _ in range(epochs):
+                gradients = {name: l2 * (weights[name] - prior[name]) for name in weights}
+                for features, label in task_samples:
+                    error = _sigmoid(sum(weights[name] * value for name, value in features.items())) - label
+                    for name, value in features.items():
+                        gradients[name] += error * value / len(task_samples)
+                for name in weights:
+                    weights[name] -= learning_rate * gradients[name]
+            trained[task] = weights
+
+        with open(model_path, "w", encoding="utf-8") as f:
+            json.dump(trained, f, ensure_ascii=False, indent=2)
+        return trained
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="用记录的LLM判断训练本地路由权重")
+    parser.add_argument("--log", default="./router_decisions.jsonl", help="判断日志路径")
+    parser.add_argument("--model", default="./router_model.json", help="权重输出路径")
+    parser.add_argument("--epochs", type=int, default=200)
+    args = parser.parse_args()
+
+    weights = QueryRouter.train_from_log(args.log, args.model, epochs=args.epochs)
+    print(json.dumps(weights, ensure_ascii=False, indent=2))
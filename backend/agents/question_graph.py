@@ -0,0 +1,201 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from backend.agents.usage import UsageMeter
+from backend.agents.tracing import span, with_context
+'''
+多跳检索问题图：章节的初始问题是第0层，每个问题检索完成后根据证据中的缺口生成追问，作为下一层问题，
+按层广度优先扩展；同一层的追问生成并发执行，并发数、深度、节点数、token数和耗时都有全局上限
+'''
+
+
+class GraphLimits:
+    """检索问题图的全局上限，None表示不限制"""
+    def __init__(self, max_depth: int = 0, max_nodes: Optional[int] = 20, max_tokens: Optional[int] = None,
+                 max_seconds: Optional[float] = None, max_parallel: int = 3, followups_per_node: int = 2):
+        """
+        Args:
+            max_depth: 追问的最大层数，0表示只处理初始问题
+            max_nodes: 整份报告最多追加的追问数
+            max_tokens: 报告的token用量达到该值后不再追问
+            max_seconds: 报告开始生成后超过该秒数不再追问
+            max_parallel: 同一层同时生成追问和检索的最大并发数
+            followups_per_node: 每个问题最多生成的追问数
+        """
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.max_parallel = max(1, max_parallel)
+        self.followups_per_node = followups_per_node
+
+    @classmethod
+    def from_env(cls) -> "GraphLimits":
+        """从环境变量GRAPH_MAX_DEPTH、GRAPH_MAX_NODES、GRAPH_TOKEN_BUDGET、GRAPH_MAX_SECONDS、GRAPH_MAX_PARALLEL、GRAPH_FOLLOWUPS读取上限"""
+        def optional(name: str, convert: Callable):
+            value = os.getenv(name)
+            return convert(value) if value else None
+
+        # GRAPH_MAX_NODES=0表示不追加追问，只有未设置时才使用默认值
+        max_nodes = optional("GRAPH_MAX_NODES", int)
+        return cls(
+            max_depth=int(os.getenv("GRAPH_MAX_DEPTH", "0")),
+            max_nodes=20 if max_nodes is None else max_nodes,
+            max_tokens=optional("GRAPH_TOKEN_BUDGET", int),
+            max_seconds=optional("GRAPH_MAX_SECONDS", float),
+            max_parallel=int(os.getenv("GRAPH_MAX_PARALLEL", "3")),
+            followups_per_node=int(os.getenv("GRAPH_FOLLOWUPS", "2")),
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "max_depth": self.max_depth,
+            "max_nodes": self.max_nodes,
+            "max_tokens": self.max_tokens,
+            "max_seconds": self.max_seconds,
+            "max_parallel": self.max_parallel,
+            "followups_per_node": self.followups_per_node,
+        }
+
+
+class QuestionNode:
+    """检索问题图中的一个问题"""
+    __slots__ = ("question", "section", "depth", "parent", "results", "expanded")
+
+    def __init__(self, question: str, section: str, depth: int = 0, parent: Optional[str] = None):
+        self.question = question
+        self.section = section
+        self.depth = depth
+        self.parent = parent
+        # 检索结果，检索完成后设置，用于寻找证据中的缺口
+        self.results: Optional[List[Dict]] = None
+        self.expanded = False
+
+
+class QuestionGraph:
+    """
+    报告级的检索问题图，一份报告一个实例，并发生成的章节共享节点数、token和耗时上限
+
+    各章节各自按层扩展：expand对一层中已检索的问题并发生成追问，
+    超出任一全局上限后不再扩展，已生成的追问仍会处理完。
+    """
+    def __init__(self, limits: GraphLimits, meter: Optional[UsageMeter] = None):
+        """
+        Args:
+            limits: 全局上限
+            meter: 报告的用量计量器，用于判断token上限
+        """
+        self.limits = limits
+        self.meter = meter
+        self.started_at = time.time()
+        self.stop_reason: Optional[str] = None
+        self._lock = threading.Lock()
+        self._nodes: Dict[tuple, QuestionNode] = {}
+        self._followups = 0
+
+    def add(self, section: str, question: str, depth: int = 0, parent: Optional[str] = None) -> QuestionNode:
+        """登记问题，已登记的问题返回原节点"""
+        with self._lock:
+            key = (section, question)
+            if key not in self._nodes:
+                self._nodes[key] = QuestionNode(question, section, depth, parent)
+            return self._nodes[key]
+
+    def node(self, section: str, question: str) -> Optional[QuestionNode]:
+        with self._lock:
+            return self._nodes.get((section, question))
+
+    @property
+    def followups(self) -> int:
+        with self._lock:
+            return self._followups
+
+    def _exhausted(self) -> Optional[str]:
+        """返回已达到的全局上限说明，调用方需持有self._lock"""
+        limits = self.limits
+        if limits.max_nodes is not None and self._followups >= limits.max_nodes:
+            return f"追问数达到上限{limits.max_nodes}"
+        if limits.max_tokens is not None and self.meter is not None and self.meter.total.total_tokens >= limits.max_tokens:
+            return f"token用量达到追问上限{limits.max_tokens}"
+        if limits.max_seconds is not None and time.time() - self.started_at >= limits.max_seconds:
+            return f"生成时间超过追问上限{limits.max_seconds:.0f}秒"
+        return None
+
+    def exhausted(self) -> Optional[str]:
+        """返回已达到的全局上限说明，没有达到时返回None"""
+        with self._lock:
+            reason = self._exhausted()
+            if reason is not None and self.stop_reason is None:
+                self.stop_reason = reason
+            return reason
+
+    def _reserve(self, count: int) -> int:
+        """预留count个追问名额，返回实际可用的数量"""
+        with self._lock:
+            if self._exhausted() is not None:
+                return 0
+            if self.limits.max_nodes is not None:
+                count = min(count, self.limits.max_nodes - self._followups)
+            self._followups += count
+            return count
+
+    def _release(self, count: int):
+        with self._lock:
+            self._followups -= count
+
+    def expand(self, nodes: List[QuestionNode], generate: Callable[[QuestionNode, int], List[str]],
+               accept: Callable[[List[str]], List[str]]) -> List[QuestionNode]:
+        """
+        对一层问题并发生成追问，返回新一层的问题节点
+
+        Args:
+            nodes: 本层已检索的问题节点，未达到最大深度、有检索结果且未扩展过的节点才会生成追问
+            generate: generate(节点, 最多追问数)返回追问列表，在线程池中调用
+            accept: 对全部追问去重，返回保留的追问，在调用线程中按节点顺序调用
+
+        Returns:
+            新一层的问题节点，按节点顺序排列
+        """
+        candidates = [node for node in nodes
+                      if not node.expanded and node.results and node.depth < self.limits.max_depth]
+        if not candidates or self.exhausted():
+            return []
+
+        def run(node: QuestionNode) -> List[str]:
+            quota = self._reserve(self.limits.followups_per_node)
+            if not quota:
+                return []
+            try:
+                followups = generate(node, quota)[:quota]
+            except Exception:
+                self._release(quota)
+                raise
+            self._release(quota - len(followups))
+            return followups
+
+        with span("graph.expand", parents=len(candidates)) as expand_span:
+            with ThreadPoolExecutor(max_workers=min(self.limits.max_parallel, len(candidates)),
+                                    thread_name_prefix="question-graph") as executor:
+                futures = [executor.submit(with_context(run), node) for node in candidates]
+                generated = [future.result() for future in futures]
+
+            new_nodes = []
+            for node, followups in zip(candidates, generated):
+                node.expanded = True
+                accepted = accept(followups) if followups else []
+                # 被去掉的追问不占用名额
+                self._release(len(followups) - len(accepted))
+                for question in accepted:
+                    new_nodes.append(self.add(node.section, question, node.depth + 1, node.question))
+            if expand_span is not None:
+                expand_span.set(followups=len(new_nodes))
+        return new_nodes
+
+    def summary(self) -> Dict:
+        """返回追问数、达到的最大深度和停止扩展的原因"""
+        with self._lock:
+            depth = max((node.depth for node in self._nodes.values()), default=0)
+            return {"followups": self._followups, "max_depth": depth, "stop_reason": self.stop_reason,
+                    "limits": self.limits.to_dict()}
@@ -0,0 +1,143 @@
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+from backend.agents.similarity import most_similar
+from backend.agents.cancellation import OperationCancelled
+'''
+报告级检索问题登记表：各章节生成的检索问题先按向量相似度合并近似重复，重复的问题复用已有的检索结果
+'''
+
+# 负责检索的报告被取消时交给等待者的标记，等待者重新检索
+_OWNER_CANCELLED = object()
+
+
+class QuestionRegistry:
+    """
+    报告级检索问题登记表，一份报告一个实例，可在并发生成的章节之间共享
+
+    每个问题登记时计算向量，与已登记问题的相似度不低于threshold时视为重复，
+    记录为已有问题的别名；检索时别名复用已有问题的检索结果，
+    已有问题仍在检索中时等待其结果，不会重复检索。
+    """
+    def __init__(self, embeddings: Any = None, threshold: float = 0.92):
+        """
+        Args:
+            embeddings: 向量模型，需提供embed_documents；None表示只合并完全相同的问题
+            threshold: 判定为重复问题的余弦相似度阈值
+        """
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.logger = logging.getLogger(__name__)
+        self.reused_searches = 0
+        self._lock = threading.Lock()
+        self._questions: List[str] = []
+        self._vectors: List[List[float]] = []
+        self._aliases: Dict[str, str] = {}
+        self._results: Dict[str, Future] = {}
+
+    def _embed(self, questions: List[str]) -> Optional[List[List[float]]]:
+        if self.embeddings is None or not questions:
+            return None
+        try:
+            return self.embeddings.embed_documents(questions)
+        except Exception as e:
+            self.logger.warning(f"计算检索问题向量失败，只合并完全相同的问题: {str(e)}")
+            return None
+
+    def register(self, questions: List[str], limit: Optional[int] = None) -> List[Optional[str]]:
+        """
+        登记一批检索问题
+
+        Args:
+            questions: 检索问题列表
+            limit: 最多登记的不重复问题数，与本批前面的问题重复的问题不计数；
+                达到limit后不再登记后面的问题，未登记的问题不会被其他章节复用。None表示全部登记
+
+        Returns:
+            与登记的问题一一对应（达到limit时比questions短），重复问题为其合并到的已有问题，新问题为None
+        """
+        vectors = self._embed(questions)
+        matches = []
+        kept = set()
+        with self._lock:
+            for i, question in enumerate(questions):
+                if limit is not None and len(kept) >= limit:
+                    break
+                if question in self._aliases:
+                    match = self._aliases[question]
+                    kept.add(match)
+                    matches.append(match)
+                    continue
+                match = None
+                if vectors is not None and self._vectors:
+                    index, score = most_similar(vectors[i], self._vectors)
+                    if score >= self.threshold:
+                        match = self._questions[index]
+                if match is None:
+                    self._questions.append(question)
+                    if vectors is not None:
+                        self._vectors.append(vectors[i])
+                    self._aliases[question] = question
+                else:
+                    self._aliases[question] = match
+                kept.add(match or question)
+                matches.append(match)
+        return matches
+
+    def canonical(self, question: str) -> str:
+        """返回问题合并到的已有问题，未登记或不重复时返回问题本身"""
+        with self._lock:
+            return self._aliases.get(question, question)
+
+    def search(self, question: str, search_func: Callable[[str], List[Dict]]) -> List[Dict]:
+        """
+        检索问题，重复问题复用已有问题的检索结果
+
+        负责检索的调用被取消时，等待中的重复问题不会收到取消，而是由其中一个重新检索；
+        检索出错时错误传给所有等待者。
+
+        Args:
+            question: 检索问题
+            search_func: 实际执行检索的函数
+
+        Returns:
+            检索结果列表
+        """
+        while True:
+            with self._lock:
+                canonical = self._aliases.get(question, question)
+                future = self._results.get(canonical)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self._results[canonical] = future
+
+            if not owner:
+                results = future.result()
+                if results is _OWNER_CANCELLED:
+                    # 负责检索的报告被取消，由第一个重新取到问题的等待者在自己的取消令牌下重新检索
+                    continue
+                with self._lock:
+                    self.reused_searches += 1
+                return results
+
+            try:
+                results = search_func(canonical)
+            except OperationCancelled:
+                # 取消只属于发起检索的报告，不传给其他报告中等待的重复问题
+                self._discard(canonical, future)
+                future.set_result(_OWNER_CANCELLED)
+                raise
+            except Exception as e:
+                # 检索失败不缓存，之后的重复问题重新检索
+                self._discard(canonical, future)
+                future.set_exception(e)
+                raise
+            future.set_result(results)
+            return results
+
+    def _discard(self, canonical: str, future: Future):
+        with self._lock:
+            if self._results.get(canonical) is future:
+                del self._results[canonical]
@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+from typing import Dict, Optional
+from langchain_core.rate_limiters import BaseRateLimiter
+from backend.agents.cancellation import CancellationToken
+'''
+进程级速率限制：令牌桶限制模型请求和网络搜索的全局速率，
+多份报告同时生成时（例如批量生成）所有线程共用同一个桶
+'''
+
+# 限制名称 -> 设置速率的环境变量
+LLM = "llm"
+SEARCH = "search"
+_ENV_VARS = {LLM: "LLM_RATE_LIMIT", SEARCH: "SEARCH_RATE_LIMIT"}
+
+
+class RateLimiter(BaseRateLimiter):
+    """
+    线程安全的令牌桶，实现langchain的BaseRateLimiter接口，可以直接作为聊天模型的rate_limiter
+
+    每秒补充requests_per_second个令牌，最多积累burst个；每次请求消耗一个令牌。
+    """
+    def __init__(self, requests_per_second: float, burst: int = 1):
+        """
+        Args:
+            requests_per_second: 每秒允许的请求数
+            burst: 空闲后允许连续发出的请求数
+        """
+        if requests_per_second <= 0:
+            raise ValueError("requests_per_second必须大于0")
+        self.requests_per_second = requests_per_second
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self) -> float:
+        """取一个令牌，成功返回0，否则返回还需等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.requests_per_second)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.requests_per_second
+
+    def acquire(self, *, blocking: bool = True, cancel_token: Optional[CancellationToken] = None) -> bool:
+        """
+        取一个令牌
+
+        Args:
+            blocking: 没有令牌时是否等待
+            cancel_token: 可选的取消令牌，等待期间取消时抛出OperationCancelled
+
+        Returns:
+            是否取得令牌，blocking为True时总是True
+        """
+        while True:
+            delay = self._try_acquire()
+            if not delay:
+                return True
+            if not blocking:
+                return False
+            if cancel_token is not None:
+                cancel_token.wait(delay)
+            else:
+                time.sleep(delay)
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        import asyncio
+
+        while True:
+            delay = self._try_acquire()
+            if not delay:
+                return True
+            if not blocking:
+                return False
+            await asyncio.sleep(delay)
+
+
+_limiters: Dict[str, Optional[RateLimiter]] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str) -> Optional[RateLimiter]:
+    """
+    获取进程级的速率限制器，第一次获取时从环境变量读取速率（每秒请求数），没有设置时返回None
+
+    Args:
+        name: LLM（环境变量LLM_RATE_LIMIT）或SEARCH（环境变量SEARCH_RATE_LIMIT）
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            rate = os.getenv(_ENV_VARS[name])
+            _limiters[name] = RateLimiter(float(rate)) if rate else None
+        return _limiters[name]
+
+
+def set_rate_limit(name: str, requests_per_second: Optional[float], burst: int = 1):
+    """
+    设置进程级速率限制，None表示不限制；模型请求的限制需要在第一次获取路由模型之前设置
+
+    Args:
+        name: LLM或SEARCH
+        requests_per_second: 每秒请求数
+        burst: 空闲后允许连续发出的请求数
+    """
+    with _limiters_lock:
+        _limiters[name] = RateLimiter(requests_per_second, burst) if requests_per_second else None
@@ -0,0 +1,134 @@
+import re
+from typing import Dict, List, Optional, Tuple
+'''
+章节文档模型：章节内容按段落编号保存，增量精炼时模型只返回针对段落编号的修改，在本地应用
+'''
+
+PARAGRAPH_ID_PATTERN = re.compile(r"^\[(p\d+)\]\s*")
+
+
+class SectionDocument:
+    """按段落保存的章节内容，段落编号为p1、p2……，新段落编号递增，不复用"""
+    def __init__(self, paragraphs: Optional[List[str]] = None):
+        self._paragraphs: List[Tuple[str, str]] = []
+        self._next_id = 1
+        for text in paragraphs or []:
+            self._paragraphs.append((self._new_id(), text))
+
+    @classmethod
+    def from_text(cls, text: Optional[str]) -> "SectionDocument":
+        """按空行把文本切分为段落"""
+        if not text:
+            return cls()
+        paragraphs = [paragraph.strip() for paragraph in re.split(r"\n\s*\n", text) if paragraph.strip()]
+        return cls(paragraphs)
+
+    def _new_id(self) -> str:
+        paragraph_id = f"p{self._next_id}"
+        self._next_id += 1
+        return paragraph_id
+
+    def _index(self, paragraph_id: Optional[str]) -> Optional[int]:
+        for i, (existing_id, _) in enumerate(self._paragraphs):
+            if existing_id == paragraph_id:
+                return i
+        return None
+
+    @property
+    def paragraph_ids(self) -> List[str]:
+        return [paragraph_id for paragraph_id, _ in self._paragraphs]
+
+    @property
+    def paragraphs(self) -> List[str]:
+        return [text for _, text in self._paragraphs]
+
+    def render(self) -> str:
+        """返回章节正文"""
+        return "\n\n".join(text for _, text in self._paragraphs)
+
+    def render_with_ids(self) -> str:
+        """返回带段落编号的正文，用于增量精炼提示词"""
+        return "\n\n".join(f"[{paragraph_id}] {text}" for paragraph_id, text in self._paragraphs)
+
+    def apply_edit(self, edit: Dict) -> Optional[Dict]:
+        """
+        应用一条修改
+
+        支持的修改：
+            {"op": "replace", "id": "p2", "text": "..."}       替换段落
+            {"op": "insert_after", "id": "p3", "text": "..."}  在段落后插入新段落，id为"start"时插在最前面
+            {"op": "append", "text": "..."}                    在末尾追加新段落
+            {"op": "delete", "id": "p4"}                       删除段落
+
+        Returns:
+            按段落位置表示的修改，见apply_change；没有修改文档时返回None。
+            格式不正确或编号不存在的替换/删除会被忽略，插入位置不存在时追加到末尾
+        """
+        if not isinstance(edit, dict):
+            return None
+        op = edit.get("op")
+        paragraph_id = edit.get("id")
+        text = edit.get("text")
+        if isinstance(text, str):
+            # 模型有时会把段落编号也写进正文；段落内的空行合并，保证按空行重新切分正文时段落位置不变
+            text = re.sub(r"\n\s*\n", "\n", PARAGRAPH_ID_PATTERN.sub("", text.strip()))
+
+        if op == "replace":
+            index = self._index(paragraph_id)
+            if index is None or not text:
+                return None
+            self._paragraphs[index] = (paragraph_id, text)
+            return {"op": "replace", "index": index, "id": paragraph_id, "text": text}
+        if op in ("insert_after", "append"):
+            if not text:
+                return None
+            if op == "insert_after" and paragraph_id == "start":
+                position = 0
+            else:
+                index = self._index(paragraph_id) if op == "insert_after" else None
+                position = len(self._paragraphs) if index is None else index + 1
+            new_id = self._new_id()
+            self._paragraphs.insert(position, (new_id, text))
+            return {"op": "insert", "index": position, "id": new_id, "text": text}
+        if op == "delete":
+            index = self._index(paragraph_id)
+            if index is None:
+                return None
+            del self._paragraphs[index]
+            return {"op": "delete", "index": index, "id": paragraph_id}
+        return None
+
+
+def apply_change(text: Optional[str], change: Dict) -> str:
+    """
+    把apply_edit返回的修改应用到章节正文上，调用方只需保存正文，不需要保存段落编号
+
+    修改按段落位置表示：
+        {"op": "replace", "index": 1, "id": "p2", "text": "..."}  替换第index段
+        {"op": "insert", "index": 3, "id": "p5", "text": "..."}   插入为第index段
+        {"op": "delete", "index": 0, "id": "p1"}                  删除第index段
+    index从0开始，与SectionDocument.from_text(text)的段落一一对应
+
+    Returns:
+        修改后的正文，与SectionDocument.render()的结果相同
+    """
+    paragraphs = SectionDocument.from_text(text).paragraphs
+    op = change["op"]
+    index = change["index"]
+    if op == "replace" and index < len(paragraphs):
+        paragraphs[index] = change["text"]
+    elif op == "insert":
+        paragraphs.insert(min(index, len(paragraphs)), change["text"])
+    elif op == "delete" and index < len(paragraphs):
+        del paragraphs[index]
+    return "\n\n".join(paragraphs)
+
+
+def format_change(change: Dict) -> str:
+    """修改的简短说明，用于生成过程日志"""
+    position = change["index"] + 1
+    if change["op"] == "replace":
+        return f"修改第{position}段：{change['text']}"
+    if change["op"] == "insert":
+        return f"新增第{position}段：{change['text']}"
+    return f"删除第{position}段"
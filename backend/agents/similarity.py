@@ -0,0 +1,48 @@
+import math
+import re
+from typing import List, Optional, Sequence, Set, Tuple
+'''
+向量和文本相似度工具
+'''
+
+# 中文按字、其他按单词切分
+_TOKEN_PATTERN = re.compile(r"[一-鿿]|[a-z0-9]+")
+
+
+def cosine_similarity(a: Sequence[float], b: Sequence[float]) -> float:
+    """计算两个向量的余弦相似度，任一向量为零向量时返回0"""
+    dot = sum(x * y for x, y in zip(a, b))
+    norm_a = math.sqrt(sum(x * x for x in a))
+    norm_b = math.sqrt(sum(y * y for y in b))
+    if not norm_a or not norm_b:
+        return 0.0
+    return dot / (norm_a * norm_b)
+
+
+def most_similar(vector: Sequence[float], candidates: List[Sequence[float]]) -> Tuple[Optional[int], float]:
+    """
+    在候选向量中找出与vector最相似的一个
+
+    Returns:
+        (候选下标, 相似度)，没有候选时为(None, 0.0)
+    """
+    best_index, best_score = None, 0.0
+    for i, candidate in enumerate(candidates):
+        score = cosine_similarity(vector, candidate)
+        if best_index is None or score > best_score:
+            best_index, best_score = i, score
+    return best_index, best_score
+
+
+def text_shingles(text: str, n: int = 2) -> Set[str]:
+    """
+    把文本切分为n元组集合：中文按字、其他按单词切分后取相邻的n个，文本过短时返回单个词
+
+    Args:
+        text: 文本
+        n: 每个元组的长度
+    """
+    tokens = _TOKEN_PATTERN.findall(text.lower())
+    if len(tokens) < n:
+        return set(tokens)
+    return {" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)}
@@ -0,0 +1,22 @@
+from typing import List, Optional
+'''
+延迟统计等处共用的简单统计函数
+'''
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    最近秩百分位数
+
+    Args:
+        values: 样本，不要求有序
+        q: 0到1之间的分位，例如0.95
+
+    Returns:
+        百分位数，没有样本时返回None
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
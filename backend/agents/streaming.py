@@ -1,14 +1,38 @@
 import asyncio
+import queue
+import threading
 import time
-from typing import Dict, List, Generator, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Generator, Any, Optional
 import logging
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 from backend.agents.Structure_Agent import Structure_Agent
 from backend.agents.Graph_Agent import GraphAgent
+from backend.agents.question_registry import QuestionRegistry
+from backend.agents.evidence_store import EvidenceStore
+from backend.agents.outline_cache import OutlineCache, get_outline_cache
+from backend.agents.novelty import NoveltyGate
+from backend.agents.question_graph import GraphLimits, QuestionGraph, QuestionNode
+from backend.agents.checkpoint import ReportCheckpoint
+from backend.agents.section_document import apply_change, format_change
+from backend.agents.cancellation import CancellationToken, OperationCancelled, raise_if_cancelled
+from backend.agents.tracing import trace_run, span, current_span, with_context
+from backend.agents.usage import UsageBudget, UsageMeter, BUDGET_DEGRADE, BUDGET_STOP, metering, usage_scope, format_usage
+from backend.agents.events import (ReportEvent, progress, OUTLINE, SECTION_START, QUESTION, SEARCH_DONE, DELTA,
+                                   SECTION_DONE, METRICS, REPORT_DONE)
+from backend.agents.model_registry import get_embeddings
 
 
+# 并发章节生成时，标记某个章节的输出已经结束
+_SECTION_FINISHED = object()
+# 大纲流式生成完成/失败的标记
+_OUTLINE_FINISHED = object()
+_OUTLINE_FAILED = object()
+# 报告生成被取消的标记
+_REPORT_CANCELLED = object()
+
 # 移除了循环导入: from backend.agents.streaming import stream_text
 
 # 添加stream_text函数定义
@@ -29,13 +53,46 @@ class ReportGenerator:
     """
     报告生成器：协调Structure_Agent和Graph_Agent生成完整报告
     """
-    def __init__(self):
+    def __init__(self, refine_mode: str = "rewrite", question_similarity_threshold: float = 0.92,
+                 question_registry: Optional[QuestionRegistry] = None, evidence_store: Optional[EvidenceStore] = None,
+                 outline_cache: Optional[OutlineCache] = None, novelty_threshold: Optional[float] = None,
+                 novelty_patience: Optional[int] = None, graph_limits: Optional[GraphLimits] = None):
         """
         初始化报告生成器
+
+        Args:
+            refine_mode: 章节提炼方式，"rewrite"每篇文档重写整个章节，"delta"只让模型返回段落级修改
+            question_similarity_threshold: 检索问题向量相似度不低于该值时视为重复问题，复用已有检索结果
+            question_registry: 可选的共享检索问题登记表，传入时在多份报告之间共享（例如批量生成），否则每份报告新建
+            evidence_store: 可选的共享证据库，同question_registry
+            outline_cache: 大纲缓存，None表示使用进程级缓存（见get_outline_cache）
+            novelty_threshold: 检索结果中新信息的比例低于该值时不整合，0表示不过滤，
+                               None表示读取环境变量NOVELTY_THRESHOLD（默认0.25）
+            novelty_patience: 连续多少个问题没有新信息时结束章节的检索，0表示不提前结束，
+                              None表示读取环境变量NOVELTY_PATIENCE（默认2）
+            graph_limits: 多跳检索问题图的默认上限，None表示从环境变量读取（见GraphLimits.from_env），默认不追问
         """
         self.logger = logging.getLogger(__name__)
+        self.refine_mode = refine_mode
+        self.question_similarity_threshold = question_similarity_threshold
+        self.novelty_threshold = novelty_threshold if novelty_threshold is not None else float(os.getenv("NOVELTY_THRESHOLD", "0.25"))
+        self.novelty_patience = novelty_patience if novelty_patience is not None else int(os.getenv("NOVELTY_PATIENCE", "2"))
+        self._shared_question_registry = question_registry
+        self._shared_evidence_store = evidence_store
+        # 生成完整报告时的检查点，单独生成章节时为None
+        self.checkpoint: Optional[ReportCheckpoint] = None
+        # 当前报告的取消令牌，取消后进行中的模型请求和网络请求立即返回
+        self.cancel_token: Optional[CancellationToken] = None
+        # 当前报告的模型用量计量器
+        self.usage_meter = UsageMeter()
+        # 当前报告是否复用相近主题的大纲
+        self.reuse_outline = True
+        # 当前报告的检索问题图，单独生成章节时使用默认上限
+        self.graph_limits = graph_limits or GraphLimits.from_env()
+        self.question_graph = QuestionGraph(self.graph_limits, self.usage_meter)
+        self._reset_report_state()
 
-        self.structure_agent = Structure_Agent()
+        self.structure_agent = Structure_Agent(outline_cache=outline_cache or get_outline_cache())
         self.graph_agent = GraphAgent()
         
     def generate_report_structure(self, topic: str) :
@@ -49,12 +106,12 @@ class ReportGenerator:
             报告结构字典
         """
         self.structure_agent.user_input_topic = topic
-        yield "正在生成报告结构...\n"
+        yield progress("正在生成报告结构...\n")
         report_structure = self.structure_agent.forward()
-        yield f"报告结构已生成：\n{report_structure}\n"
+        yield ReportEvent(OUTLINE, f"报告结构已生成：\n{report_structure}\n", structure=report_structure)
         return report_structure
         
-    def generate_section_content(self, topic: str, section: str, max_questions: int = 1) -> Generator[str, None, None]:
+    def generate_section_content(self, topic: str, section: str, max_questions: int = 1, search_prefetch: int = 0) -> Generator[ReportEvent, None, str]:
         """
         生成报告章节内容
         
@@ -62,108 +119,621 @@ class ReportGenerator:
             topic: 报告主题
             section: 章节名称
             max_questions: 最多处理的问题数量，None表示处理所有问题
+            search_prefetch: 流水线模式下最多预先检索的问题数量，0表示逐个问题先检索再整合
             
         Yields:
-            生成过程和内容
+            生成过程事件，章节内容以DELTA事件输出
+
+        Returns:
+            章节最终内容
+        """
+        record = self.checkpoint.get_section(section) if self.checkpoint is not None else None
+        if record and record["done"]:
+            yield progress(f"章节 '{section}' 已完成，从检查点恢复\n", section)
+            draft = record["draft"] or ""
+            yield ReportEvent(DELTA, f"\n当前章节内容更新：\n{draft}", section, revision=1, content=draft, reset=True)
+            return record["draft"]
+
+        if record and record["questions"] is not None:
+            # 检查点中保存的是去重和截断之后实际处理的问题，不再重复处理
+            questions = record["questions"]
+            self.question_registry.register(questions)
+            yield progress(f"从检查点恢复章节 '{section}' 的检索问题：\n", section)
+            for i, question in enumerate(questions):
+                yield ReportEvent(QUESTION, f"{i+1}. {question}\n", section, index=i, question=question, reused_from=None)
+        else:
+            questions = yield from self._generate_questions(topic, section, max_questions)
+
+        # 初始化精炼文档，从检查点恢复时跳过已经整合过的问题
+        refined_doc = None
+        processed = 0
+        if record and record["processed"]:
+            processed = record["processed"]
+            refined_doc = record["draft"]
+            yield progress(f"已从检查点恢复前 {processed} 个问题的整合结果\n", section)
+            # 之后的增量修改在这一版内容上应用
+            yield ReportEvent(DELTA, f"\n当前章节内容更新：\n{refined_doc or ''}", section, revision=0, content=refined_doc or "", reset=True)
+        novelty_gate = NoveltyGate(self.novelty_threshold, self.novelty_patience)
+        novelty_gate.add(refined_doc)
+        self.novelty_gates[section] = novelty_gate
+
+        # 初始问题是检索问题图的第0层，每层处理完后根据检索结果中的缺口生成下一层追问；从检查点恢复的追问沿用记录的层数，
+        # 未处理的问题按层数分组，所有问题都已处理时从最后一层重新生成追问
+        depths = (record or {}).get("question_depths") or []
+        nodes = [self.question_graph.add(section, question, depths[k] if k < len(depths) else 0)
+                 for k, question in enumerate(questions)]
+        pending = []
+        for node in nodes[processed:]:
+            if pending and pending[-1][0].depth == node.depth:
+                pending[-1].append(node)
+            else:
+                pending.append([node])
+        if not pending and nodes and not self.usage_meter.exceeded:
+            level = yield from self._expand_questions(topic, section, questions, self._level_nodes(section, nodes, nodes[-1].depth))
+            if level:
+                nodes += level
+                pending.append(level)
+        level_start = processed
+        stopped = False
+        while pending:
+            level = pending.pop(0)
+            level_questions = [node.question for node in level]
+            # 检索结果按问题顺序逐个取出；流水线模式下后续问题的检索与当前问题的整合同时进行，追问按图的并发上限同时检索
+            if level[0].depth > 0:
+                search_stream = self._parallel_search_results(section, level_questions, self.question_graph.limits.max_parallel)
+            elif search_prefetch is not None and search_prefetch > 0:
+                search_stream = self._prefetch_search_results(section, level_questions, search_prefetch)
+            else:
+                search_stream = (self._search_question(section, question) for question in level_questions)
+            
+            # 对每个问题进行搜索和内容精炼
+            try:
+                for i, (node, question) in enumerate(zip(level, level_questions), start=level_start):
+                    raise_if_cancelled(self.cancel_token)
+                    if refined_doc and self.usage_meter.exceeded and self.usage_meter.budget.mode == BUDGET_DEGRADE:
+                        # 超出预算后降级：已有内容的章节不再检索新问题
+                        yield progress(f"\n已超出用量预算，跳过剩余 {len(questions) - i} 个问题\n", section)
+                        stopped = True
+                        break
+                    yield progress(f"\n正在处理问题 {i+1}/{len(questions)}: {question}\n", section)
+                    saturated = False
+                    
+                    # 搜索网络
+                    yield progress(f"正在搜索相关信息...\n", section)
+                    search_results = next(search_stream)
+                    node.results = search_results
+                    
+                    if not search_results:
+                        yield ReportEvent(SEARCH_DONE, f"未找到与问题 '{question}' 相关的搜索结果\n", section,
+                                          index=i, question=question, results=[])
+                    else:
+                        yield ReportEvent(SEARCH_DONE, f"找到 {len(search_results)} 条相关结果\n", section,
+                                          index=i, question=question, results=search_results)
+
+                        # 与章节已整合内容重复的文档不再整合，全部重复时不调用模型
+                        search_results, skipped = novelty_gate.filter(search_results)
+                        if skipped:
+                            yield progress(f"{skipped} 条结果与已整合的内容重复，不再整合\n", section)
+                        if not any("full_text" in result for result in search_results):
+                            saturated = bool(skipped) and novelty_gate.record_question(False)
+                        else:
+                            # 精炼文档，直接转发模型的流式输出；有检查点时出错直接抛出，保留上一版草稿以便继续生成
+                            yield progress(f"正在整合信息...\n", section)
+                            current_revision = None
+                            for revision, delta in self.graph_agent.refine_documents_stream(search_results, topic, section, refined_doc,
+                                                                                            self.refine_mode, raise_errors=self.checkpoint is not None,
+                                                                                            cancel_token=self.cancel_token, question=question):
+                                if isinstance(delta, dict):
+                                    # 增量提炼的段落级修改：只输出这一条修改，调用方在已有内容上应用
+                                    refined_doc = apply_change(refined_doc, delta)
+                                    yield ReportEvent(DELTA, f"\n{format_change(delta)}\n", section, revision=revision,
+                                                      content="", reset=False, change=delta)
+                                    continue
+                                reset = revision != current_revision
+                                if reset:
+                                    current_revision = revision
+                                    refined_doc = ""
+                                refined_doc += delta
+                                text = f"\n当前章节内容更新：\n{delta}" if reset else delta
+                                yield ReportEvent(DELTA, text, section, revision=revision, content=delta, reset=reset)
+                            # 整合成功后才记入已覆盖内容，整合失败时之后的检索结果不会被误判为重复
+                            novelty_gate.add_results(search_results)
+                            novelty_gate.record_question(True)
+                    if self.checkpoint is not None:
+                        self.checkpoint.record_draft(section, i + 1, refined_doc)
+                    remaining = len(questions) - i - 1
+                    if saturated and remaining > 0:
+                        yield progress(f"\n连续 {novelty_gate.stale_questions} 个问题的检索结果都没有新信息，跳过剩余 {remaining} 个问题\n", section)
+                        novelty_gate.stopped_early = True
+                        stopped = True
+                        break
+            finally:
+                search_stream.close()
+
+            level_start += len(level)
+            if stopped or self.usage_meter.exceeded:
+                break
+            if not pending:
+                level = yield from self._expand_questions(topic, section, questions, self._level_nodes(section, nodes, level[0].depth))
+                if level:
+                    nodes += level
+                    pending.append(level)
+
+        if self.checkpoint is not None:
+            self.checkpoint.finish_section(section, refined_doc or "")
+        return refined_doc
+
+    def _generate_questions(self, topic: str, section: str, max_questions: int = None) -> Generator[ReportEvent, None, List[str]]:
+        """
+        生成章节的检索问题，合并近似重复的问题并按max_questions截断
+
+        Returns:
+            实际要处理的检索问题
         """
         # 生成检索问题
-        yield f"正在为章节 '{section}' 生成检索问题...\n"
-        questions, think_processes = self.graph_agent.generate_initial_questions(topic, section)
+        yield progress(f"正在为章节 '{section}' 生成检索问题...\n", section)
+        questions, think_processes = self.graph_agent.generate_initial_questions(topic, section, self.cancel_token)
         
+        # 输出思考过程
         if think_processes:
-            yield f"\n思考过程：\n"
-            for i, process in enumerate(think_processes):
-                yield f"{process}\n"
+            yield progress(f"\n思考过程：\n" + "".join(f"{process}\n" for process in think_processes), section)
         
-        # 输出思考过程
-        yield f"为章节 '{section}' 生成的检索问题：\n"
-        for i, question in enumerate(questions):
-            yield f"{i+1}. {question}\n"
+        yield progress(f"为章节 '{section}' 生成的检索问题：\n"
+                       + "".join(f"{i+1}. {question}\n" for i, question in enumerate(questions)), section)
+
+        # 合并近似重复的问题：本章节内的重复问题直接去掉，与其他章节重复的问题复用其检索结果；
+        # 设置了最大问题数时只登记实际要处理的问题，不处理的问题不会被其他章节当作可复用的检索
+        limit = max_questions if max_questions is not None and max_questions > 0 else None
+        unique_questions = []
+        reused_from = {}
+        seen = set()
+        for question, match in zip(questions, self.question_registry.register(questions, limit=limit)):
+            canonical = match or question
+            if canonical in seen:
+                yield progress(f"问题 '{question}' 与本章节的其他问题重复，已跳过\n", section)
+                continue
+            seen.add(canonical)
+            reused_from[question] = match
+            unique_questions.append(question)
+        questions = unique_questions
+
+        if limit is not None:
+            yield progress(f"\n将处理前 {max_questions} 个问题\n", section)
 
-        # 如果设置了最大问题数，则限制问题数量
-        if max_questions is not None and max_questions > 0:
-            questions = questions[:max_questions]
-            yield f"\n将处理前 {max_questions} 个问题\n"
+        for i, question in enumerate(questions):
+            match = reused_from[question]
+            text = f"待处理问题 {i+1}: {question}\n"
+            if match is not None:
+                text = f"待处理问题 {i+1}: {question}（与已检索的问题 '{match}' 相近，将复用其检索结果）\n"
+            yield ReportEvent(QUESTION, text, section, index=i, question=question, reused_from=match)
         
-        # 初始化精炼文档
-        refined_doc = None
+        if self.checkpoint is not None:
+            self.checkpoint.set_questions(section, questions, think_processes)
+        return questions
+
+    def _level_nodes(self, section: str, nodes: List[QuestionNode], depth: int) -> List[QuestionNode]:
+        """返回章节中第depth层的全部问题节点；从检查点恢复时中断前处理过的问题没有检索结果，从检查点补上"""
+        level = [node for node in nodes if node.depth == depth]
+        if self.checkpoint is not None:
+            for node in level:
+                if node.results is None:
+                    node.results = self.checkpoint.get_search(section, node.question)
+        return level
+
+    def _expand_questions(self, topic: str, section: str, questions: List[str], level: List[QuestionNode]) -> Generator[ReportEvent, None, List[QuestionNode]]:
+        """
+        根据本层问题检索结果中的缺口生成下一层追问，追问追加到questions并写入检查点
+
+        Returns:
+            下一层的问题节点，不再追问时为空列表
+        """
+        limits = self.question_graph.limits
+        if not any(node.results and node.depth < limits.max_depth for node in level):
+            return []
+        yield progress(f"\n正在根据检索结果中的缺口生成追问...\n", section)
+
+        def accept(followups: List[str]) -> List[str]:
+            # 与已登记问题（包括其他章节的问题）重复的追问不再检索
+            return [question for question, match in zip(followups, self.question_registry.register(followups)) if match is None]
+
+        new_nodes = self.question_graph.expand(
+            level,
+            lambda node, count: self.graph_agent.generate_followup_questions(topic, section, node.question, node.results, questions,
+                                                                             count, cancel_token=self.cancel_token),
+            accept,
+        )
+        if not new_nodes:
+            reason = self.question_graph.stop_reason
+            yield progress(f"不再追问：{reason}\n" if reason else "检索结果没有需要追问的缺口\n", section)
+            return []
+        for node in new_nodes:
+            questions.append(node.question)
+            yield ReportEvent(QUESTION, f"追问 {len(questions)}（第{node.depth}层，来自 '{node.parent}'）: {node.question}\n", section,
+                              index=len(questions) - 1, question=node.question, reused_from=None, depth=node.depth, parent=node.parent)
+        if self.checkpoint is not None:
+            self.checkpoint.add_followups(section, [node.question for node in new_nodes], [node.depth for node in new_nodes])
+        return new_nodes
+
+    def _reset_report_state(self):
+        """重建报告级的检索问题登记表和证据库，它们只在同一份报告的章节之间共享；传入了共享实例时直接使用"""
+        # 章节标题 -> 章节的新信息门限，用于汇总跳过的整合次数
+        self.novelty_gates: Dict[str, NoveltyGate] = {}
+        if self._shared_question_registry is not None and self._shared_evidence_store is not None:
+            self.question_registry = self._shared_question_registry
+            self.evidence_store = self._shared_evidence_store
+            return
+        try:
+            embeddings = get_embeddings()
+        except Exception as e:
+            self.logger.warning(f"无法加载向量模型，只合并完全相同的检索问题，证据库不参与查询: {str(e)}")
+            embeddings = None
+        self.question_registry = self._shared_question_registry or QuestionRegistry(embeddings, threshold=self.question_similarity_threshold)
+        self.evidence_store = self._shared_evidence_store or EvidenceStore(embeddings)
+
+    def _search_question(self, section: str, question: str) -> List[Dict]:
+        """检索问题，检查点中已有结果时直接使用；与已检索问题重复时复用其结果，否则先查证据库"""
+        if self.checkpoint is not None:
+            search_results = self.checkpoint.get_search(section, question)
+            if search_results is not None:
+                self.evidence_store.add_results(search_results)
+                return search_results
+        search_results = self.question_registry.search(
+            question, lambda canonical: self.graph_agent.search_web(canonical, self.evidence_store, self.cancel_token)
+        )
+        if self.checkpoint is not None:
+            self.checkpoint.record_search(section, question, search_results)
+        return search_results
+
+    def _prefetch_search_results(self, section: str, questions: List[str], search_prefetch: int) -> Generator[List[Dict], None, None]:
+        """
+        在后台线程中按顺序检索所有问题，结果经有界队列按问题顺序交给整合阶段
         
-        # 对每个问题进行搜索和内容精炼
-        for i, question in enumerate(questions):
-            yield f"\n正在处理问题 {i+1}/{len(questions)}: {question}\n"
-            
-            # 搜索网络
-            yield f"正在搜索相关信息...\n"
-            search_results = self.graph_agent.search_web(question)
-            
-            if not search_results:
-                yield f"未找到与问题 '{question}' 相关的搜索结果\n"
-                continue
-                
-            yield f"找到 {len(search_results)} 条相关结果\n"
-            
-            # 精炼文档
-            yield f"正在整合信息...\n"
-            refined_doc = self.graph_agent.refine_documents(search_results, topic, section, refined_doc)
-            
-            # 流式输出当前精炼结果
-            yield f"\n当前章节内容更新：\n"
-            for char in refined_doc:
-                yield char
-                time.sleep(0.01)  # 减慢输出速度，便于阅读
+        Args:
+            section: 章节名称
+            questions: 检索问题列表
+            search_prefetch: 队列容量，即检索阶段最多领先整合阶段的问题数
             
-        return refined_doc
+        Yields:
+            每个问题的检索结果
+        """
+        results_queue = queue.Queue(maxsize=search_prefetch)
+        stop_event = threading.Event()
+
+        def producer():
+            for question in questions:
+                if stop_event.is_set():
+                    return
+                try:
+                    item = (self._search_question(section, question), None)
+                except Exception as e:
+                    item = ([], e)
+                # 队列已满时等待整合阶段取走结果，调用方停止后直接退出
+                while not stop_event.is_set():
+                    try:
+                        results_queue.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+
+        threading.Thread(target=with_context(producer), name="section-search-prefetch", daemon=True).start()
+        try:
+            for _ in questions:
+                search_results, error = results_queue.get()
+                if error is not None:
+                    raise error
+                yield search_results
+        finally:
+            stop_event.set()
+        
+    def _parallel_search_results(self, section: str, questions: List[str], max_parallel: int) -> Generator[List[Dict], None, None]:
+        """
+        以最多max_parallel个并发检索一层问题，按问题顺序输出检索结果
+
+        Yields:
+            每个问题的检索结果
+        """
+        executor = ThreadPoolExecutor(max_workers=max(1, max_parallel), thread_name_prefix="section-search")
+        try:
+            futures = [executor.submit(with_context(self._search_question), section, question) for question in questions]
+            for future in futures:
+                yield future.result()
+        finally:
+            # 调用方提前停止时不再开始剩余的检索
+            executor.shutdown(wait=False, cancel_futures=True)
         
-    def generate_full_report(self, topic: str, max_questions: int = None, max_sections: int =1) -> Generator[str, None, None]:
+    def generate_full_report(self, topic: str, max_questions: int = None, max_sections: int =1, max_concurrency: int = 1, search_prefetch: int = 0,
+                             checkpoint: Optional[ReportCheckpoint] = None,
+                             cancel_token: Optional[CancellationToken] = None,
+                             budget: Optional[UsageBudget] = None, reuse_outline: bool = True,
+                             graph_limits: Optional[GraphLimits] = None) -> Generator[ReportEvent, None, Dict]:
         """
-        生成完整报告
+        生成完整报告，各阶段完成时写入检查点
         
         Args:
             topic: 报告主题
             max_questions: 每个章节最多处理的问题数量，None表示处理所有问题
             max_sections: 最多处理的章节数量，None表示处理所有章节
+            max_concurrency: 同时生成的章节数量上限，1表示按顺序逐章生成
+            search_prefetch: 每个章节内最多预先检索的问题数量，0表示不使用流水线
+            checkpoint: 要继续生成的检查点，None表示新建检查点，见resume
+            cancel_token: 可选的取消令牌，取消后进行中的模型请求、网络请求立即返回，
+                          生成器抛出OperationCancelled，已完成的步骤保留在检查点中
+            budget: 本次生成的用量预算，None表示从环境变量REPORT_TOKEN_BUDGET、REPORT_COST_BUDGET、
+                    REPORT_BUDGET_MODE读取；超出后"stop"模式像取消一样中止生成，
+                    "degrade"模式不再检索新问题，每个章节用已有内容完成
+            reuse_outline: 是否复用大纲缓存中相近主题的大纲，False时重新生成大纲
+            graph_limits: 多跳检索问题图的上限，None表示使用创建生成器时的默认上限；
+                          max_depth大于0时，每层问题检索完成后根据证据中的缺口生成追问
             
         Yields:
-            生成过程和内容
+            生成过程事件，见backend.agents.events
+
+        Returns:
+            完整报告
+
+        Raises:
+            OperationCancelled: 生成被取消
         """
+        if checkpoint is None:
+            checkpoint = ReportCheckpoint.create(topic, {
+                "max_questions": max_questions,
+                "max_sections": max_sections,
+                "max_concurrency": max_concurrency,
+                "search_prefetch": search_prefetch,
+                "refine_mode": self.refine_mode,
+                "graph_limits": (graph_limits or self.graph_limits).to_dict(),
+            })
+        self.checkpoint = checkpoint
+        self.usage_meter = UsageMeter(budget or UsageBudget.from_env())
+        if self.usage_meter.budget.enabled and self.usage_meter.budget.mode == BUDGET_STOP:
+            cancel_token = cancel_token or CancellationToken()
+            self.usage_meter.on_exceeded(lambda reason: cancel_token.cancel(f"超出用量预算：{reason}"))
+        self.cancel_token = cancel_token
+        self.reuse_outline = reuse_outline
+        # 追问的节点数、token和耗时上限对整份报告生效
+        self.question_graph = QuestionGraph(graph_limits or self.graph_limits, self.usage_meter)
+
+        # 每次生成报告是一次追踪运行，结束时导出追踪文件；模型调用计入本报告的用量
+        with trace_run("report", topic=topic, report_id=checkpoint.report_id), metering(self.usage_meter):
+            return (yield from self._generate_full_report(topic, checkpoint, max_questions, max_sections, max_concurrency, search_prefetch))
+
+    def _generate_full_report(self, topic: str, checkpoint: ReportCheckpoint, max_questions: int = None, max_sections: int = 1,
+                              max_concurrency: int = 1, search_prefetch: int = 0) -> Generator[ReportEvent, None, Dict]:
+        """generate_full_report的主体，在追踪运行中执行"""
         # 生成报告结构
-        yield "开始生成报告...\n\n"
-        
-        # 直接调用方法获取报告结构，而不是使用生成器
-        structure = self.structure_agent.forward()
-        yield f"报告结构已生成：{structure}"
+        start_time = time.time()
+        yield progress("开始生成报告...\n\n")
+        yield progress(f"报告编号：{checkpoint.report_id}，生成中断后可以用该编号继续生成\n")
+        self.structure_agent.user_input_topic = topic
+        self._reset_report_state()
         
         # 生成每个章节的内容
         full_report = {"title": topic, "sections": []}
-        
-        # 如果设置了最大章节数，则限制章节数量
-        sections_to_process = structure["structure"]
-        if max_sections is not None and max_sections > 0:
-            sections_to_process = structure["structure"][:max_sections]
-            # yield f"将只处理前 {max_sections} 个章节\n"
-        
-        for section_info in sections_to_process:
-            section_title = section_info["subtitle"]
-            yield f"\n\n开始生成章节: {section_title}\n"
-            yield f"{'='*50}\n"
-            
-            section_content = ""
-            for chunk in self.generate_section_content(topic, section_title, max_questions):
-                yield chunk
-                if isinstance(chunk, str) and not chunk.startswith("正在") and not chunk.startswith("找到") and not chunk.startswith("为章节"):
-                    section_content += chunk
-            
+        section_titles = []
+        section_contents = []
+        if max_concurrency is not None and max_concurrency > 1:
+            yield progress(f"\n将以最多 {max_concurrency} 个并发任务生成章节\n")
+        yield from self._generate_sections(topic, section_titles, section_contents, max_questions, max_sections,
+                                           max(1, max_concurrency or 1), search_prefetch)
+
+        for section_title, section_content in zip(section_titles, section_contents):
             full_report["sections"].append({
                 "title": section_title,
                 "content": section_content
             })
-            
-            yield f"\n{'='*50}\n"
-            yield f"章节 '{section_title}' 生成完成\n"
-            
-        yield "\n报告生成完成！\n"
+
+        reused_searches = self.question_registry.reused_searches
+        evidence_stats = self.evidence_store.stats()
+        metrics_text = ""
+        if reused_searches:
+            metrics_text += f"\n跨章节复用检索结果 {reused_searches} 次\n"
+        metrics_text += (f"\n证据库：命中 {evidence_stats['hits']} 次，未命中 {evidence_stats['misses']} 次，"
+                         f"共 {evidence_stats['sources']} 个来源、{evidence_stats['chunks']} 个片段\n")
+        skipped_documents = sum(gate.skipped_documents for gate in self.novelty_gates.values())
+        saturated_sections = [title for title, gate in self.novelty_gates.items() if gate.stopped_early]
+        if skipped_documents:
+            metrics_text += f"跳过与已整合内容重复的检索结果 {skipped_documents} 条"
+            if saturated_sections:
+                metrics_text += f"，{len(saturated_sections)} 个章节因信息饱和提前结束检索"
+            metrics_text += "\n"
+        graph_summary = self.question_graph.summary()
+        if graph_summary["followups"]:
+            metrics_text += f"追问 {graph_summary['followups']} 个，最深到第 {graph_summary['max_depth']} 层"
+            if graph_summary["stop_reason"]:
+                metrics_text += f"，{graph_summary['stop_reason']}后停止追问"
+            metrics_text += "\n"
+        root_span = current_span()
+        trace_path = root_span.trace.path if root_span is not None else None
+        if trace_path:
+            metrics_text += f"追踪文件：{trace_path}\n"
+        usage = self.usage_meter.summary()
+        metrics_text += f"用量：{format_usage(usage)}\n"
+        if usage["exceeded"]:
+            degraded = self.usage_meter.budget.mode == BUDGET_DEGRADE
+            metrics_text += f"{usage['exceeded']}{'，已降级生成' if degraded else ''}\n"
+        yield ReportEvent(METRICS, metrics_text, reused_searches=reused_searches, evidence=evidence_stats,
+                          elapsed=time.time() - start_time, trace_path=trace_path, usage=usage,
+                          novelty={"skipped_documents": skipped_documents, "saturated_sections": saturated_sections},
+                          question_graph=graph_summary)
+        unfinished = [title for title in section_titles if not (checkpoint.get_section(title) or {}).get("done")]
+        if unfinished:
+            yield progress(f"\n章节 {'、'.join(unfinished)} 未完成，可以用报告编号 {checkpoint.report_id} 继续生成\n")
+        else:
+            checkpoint.finish()
+        yield ReportEvent(REPORT_DONE, "\n报告生成完成！\n", report=full_report, report_id=checkpoint.report_id,
+                          unfinished=unfinished)
         return full_report
 
+    def resume(self, report_id: str, max_concurrency: Optional[int] = None, search_prefetch: Optional[int] = None,
+               cancel_token: Optional[CancellationToken] = None, budget: Optional[UsageBudget] = None) -> Generator[ReportEvent, None, Dict]:
+        """
+        从检查点继续生成报告：已生成的大纲、检索问题、检索结果和整合草稿直接复用，只生成剩余部分
+
+        Args:
+            report_id: 报告编号
+            max_concurrency: 并发章节数，None表示沿用原设置
+            search_prefetch: 预检索问题数，None表示沿用原设置
+            cancel_token: 可选的取消令牌，同generate_full_report
+            budget: 本次继续生成的用量预算，同generate_full_report，只计算继续生成部分的用量
+
+        Yields:
+            生成过程事件，同generate_full_report
+
+        Raises:
+            FileNotFoundError: 检查点不存在
+        """
+        checkpoint = ReportCheckpoint.load(report_id)
+        settings = checkpoint.data["settings"]
+        self.refine_mode = settings.get("refine_mode", self.refine_mode)
+        yield progress(f"从检查点继续生成报告 {report_id}\n")
+        return (yield from self.generate_full_report(
+            checkpoint.data["topic"],
+            max_questions=settings.get("max_questions"),
+            max_sections=settings.get("max_sections"),
+            max_concurrency=max_concurrency if max_concurrency is not None else settings.get("max_concurrency", 1),
+            search_prefetch=search_prefetch if search_prefetch is not None else settings.get("search_prefetch", 0),
+            graph_limits=GraphLimits(**settings["graph_limits"]) if settings.get("graph_limits") else None,
+            checkpoint=checkpoint,
+            cancel_token=cancel_token,
+            budget=budget,
+        ))
+
+    def _generate_section_block(self, topic: str, section_titles: List[str], section_contents: List[str], index: int, max_questions: int = None, search_prefetch: int = 0) -> Generator[ReportEvent, None, None]:
+        """
+        生成单个章节，输出章节的开始/结束事件，并把最终内容写入section_contents[index]
+        """
+        section_title = section_titles[index]
+        start_time = time.time()
+        yield ReportEvent(SECTION_START, f"\n\n开始生成章节: {section_title}\n{'='*50}\n", section_title, index=index)
+
+        with span("section", title=section_title) as section_span, usage_scope(section_title):
+            refined_doc = yield from self.generate_section_content(topic, section_title, max_questions, search_prefetch)
+            section_contents[index] = refined_doc or ""
+            if section_span is not None:
+                section_span.set(content_chars=len(section_contents[index]))
+
+        yield ReportEvent(SECTION_DONE, f"\n{'='*50}\n章节 '{section_title}' 生成完成\n", section_title,
+                          index=index, content=section_contents[index], error=None, elapsed=time.time() - start_time)
+
+    def _outline_stream(self) -> Generator[Dict, None, Dict]:
+        """流式输出大纲中的章节，检查点中已有大纲时直接使用，否则生成后写入检查点"""
+        if self.checkpoint is not None and self.checkpoint.outline is not None:
+            self.structure_agent.reused_from = None
+            structure = self.checkpoint.outline
+            for section_info in structure.get("structure", []):
+                yield section_info
+            return structure
+        with usage_scope("大纲"):
+            structure = yield from self.structure_agent.stream_structure(self.cancel_token, self.reuse_outline)
+        if self.checkpoint is not None:
+            self.checkpoint.set_outline(structure)
+        return structure
+
+    def _generate_sections(self, topic: str, section_titles: List[str], section_contents: List[str], max_questions: int = None,
+                           max_sections: int = None, max_concurrency: int = 1, search_prefetch: int = 0) -> Generator[ReportEvent, None, Dict]:
+        """
+        边流式生成大纲边生成章节：大纲中的章节一旦完整就提交到有界线程池开始生成，
+        不必等待整份大纲输出完毕
+        
+        排在最前面的未完成章节实时输出，其余章节的输出先缓存，
+        等前面的章节完成后再按大纲顺序依次输出，因此输出顺序与逐章生成一致。
+        
+        Args:
+            section_titles: 输出参数，按大纲顺序记录要生成的章节标题
+            section_contents: 输出参数，记录每个章节的最终内容
+            
+        Returns:
+            完整的报告大纲
+        """
+        output_queue = queue.Queue()
+        stop_event = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="report-section")
+
+        def worker(index: int):
+            try:
+                for chunk in self._generate_section_block(topic, section_titles, section_contents, index, max_questions, search_prefetch):
+                    output_queue.put((index, chunk))
+            except Exception as e:
+                if isinstance(e, OperationCancelled) and self.cancel_token is not None and self.cancel_token.cancelled:
+                    # 报告被取消，主循环会直接结束，不再输出章节结果
+                    return
+                # 不是本报告的取消时也按出错处理，章节不会在没有任何事件的情况下消失
+                self.logger.error(f"生成章节 '{section_titles[index]}' 时出错: {str(e)}")
+                if not section_contents[index] and self.checkpoint is not None:
+                    # 出错前已整合的草稿保留在报告中，之后可以从检查点继续生成
+                    section_contents[index] = (self.checkpoint.get_section(section_titles[index]) or {}).get("draft") or ""
+                output_queue.put((index, ReportEvent(SECTION_DONE, f"\n章节 '{section_titles[index]}' 生成出错: {str(e)}\n",
+                                                     section_titles[index], index=index, content=section_contents[index],
+                                                     error=str(e), elapsed=None)))
+            finally:
+                output_queue.put((index, _SECTION_FINISHED))
+
+        # 章节任务挂在报告的根span下，而不是读取大纲时所在的span下
+        section_worker = with_context(worker)
+
+        def read_outline():
+            structure_stream = self._outline_stream()
+            try:
+                while not stop_event.is_set():
+                    try:
+                        section_info = next(structure_stream)
+                    except StopIteration as e:
+                        output_queue.put((None, (_OUTLINE_FINISHED, e.value)))
+                        return
+                    # 如果设置了最大章节数，则只生成前max_sections个章节
+                    if max_sections is not None and max_sections > 0 and len(section_titles) >= max_sections:
+                        continue
+                    section_titles.append(section_info["subtitle"])
+                    section_contents.append("")
+                    executor.submit(section_worker, len(section_titles) - 1)
+            except Exception as e:
+                output_queue.put((None, (_OUTLINE_FAILED, e)))
+            finally:
+                structure_stream.close()
+
+        threading.Thread(target=with_context(read_outline), name="report-outline", daemon=True).start()
+        remove_callback = lambda: None
+        if self.cancel_token is not None:
+            # 取消时立即唤醒主循环，不必等待进行中的章节
+            remove_callback = self.cancel_token.add_callback(lambda: output_queue.put((None, (_REPORT_CANCELLED, None))))
+        try:
+            structure = None
+            total = None
+            buffers = {}
+            finished = set()
+            head = 0
+            while total is None or head < total:
+                index, chunk = output_queue.get()
+                if index is None:
+                    kind, payload = chunk
+                    if kind is _REPORT_CANCELLED:
+                        raise OperationCancelled(self.cancel_token.reason)
+                    if kind is _OUTLINE_FAILED:
+                        raise payload
+                    structure = payload
+                    total = len(section_titles)
+                    reused_from = self.structure_agent.reused_from
+                    if reused_from is not None:
+                        yield progress(f"复用相近主题“{reused_from['topic']}”的大纲（相似度 {reused_from['score']:.2f}）\n")
+                    yield ReportEvent(OUTLINE, f"报告结构已生成：{structure}\n", structure=structure, reused_from=reused_from)
+                elif chunk is _SECTION_FINISHED:
+                    finished.add(index)
+                elif index == head:
+                    yield chunk
+                else:
+                    buffers.setdefault(index, []).append(chunk)
+
+                # 当前章节完成后，依次输出后续已缓存的章节
+                while head in finished:
+                    head += 1
+                    yield from buffers.pop(head, [])
+            return structure
+        finally:
+            # 调用方提前停止迭代时不等待未开始的章节
+            remove_callback()
+            stop_event.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
 if __name__ == "__main__":
     generator = ReportGenerator()
     topic = "量子计算技术动态"
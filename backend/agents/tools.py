@@ -2,29 +2,72 @@ from langchain.tools import Tool, BaseTool
 from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
 import requests
 from bs4 import BeautifulSoup
-from typing import Dict, List
+from typing import Dict, List, Optional
+import logging
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from backend.agents.cancellation import CancellationToken, OperationCancelled
+from backend.agents.tracing import span
 '''
 存了一些工具
 '''
+class JsonSearchAPIWrapper:
+    """
+    简单的JSON搜索接口：GET {base_url}?q=...&max_results=...，返回[{"title", "link", "snippet"}]，
+    与DuckDuckGoSearchAPIWrapper.results的返回格式相同，用于离线测试和基准测试中的假搜索服务
+    """
+    def __init__(self, base_url: str, timeout: float = 10):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def results(self, query: str, max_results: int) -> List[Dict[str, str]]:
+        response = requests.get(self.base_url, params={"q": query, "max_results": max_results}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
 class WebTools:
+    def __init__(self):
+        # 设置环境变量SEARCH_API_URL时使用该JSON搜索接口代替DuckDuckGo
+        search_api_url = os.getenv("SEARCH_API_URL")
+        self.search_api = JsonSearchAPIWrapper(search_api_url) if search_api_url else DuckDuckGoSearchAPIWrapper()
+
+    def search(self, query: str, max_results: int = 4, cancel_token: Optional[CancellationToken] = None) -> str:
+        """
+        网络搜索，返回带URL的结果文本
+
+        Args:
+            query: 搜索内容
+            max_results: 最多返回的结果数
+            cancel_token: 可选的取消令牌；DuckDuckGo请求无法中途关闭，有取消令牌时在后台线程中执行，取消后立即返回
+
+        Raises:
+            OperationCancelled: 搜索完成前被取消
+        """
+        if cancel_token is not None:
+            results = cancel_token.call(self.search_api.results, query, max_results)
+        else:
+            results = self.search_api.results(query, max_results)
+        formatted_results = []
+
+        for result in results:
+            formatted_results.append(
+                f"标题: {result['title']}\n"
+                f"链接: {result['link']}\n"
+                f"摘要: {result['snippet']}\n"
+            )
+
+        return "\n---\n".join(formatted_results)
+
     @staticmethod
     def get_search_tool() -> Tool:
-        """获取增强版搜索工具"""
-        search = DuckDuckGoSearchAPIWrapper()
-        
-        def enhanced_search(query: str,max_results: int = 4) -> str:
-            results = search.results(query, max_results)
-            formatted_results = []
-            
-            for result in results:
-                formatted_results.append(
-                    f"标题: {result['title']}\n"
-                    f"链接: {result['link']}\n"
-                    f"摘要: {result['snippet']}\n"
-                )
-            
-            return "\n---\n".join(formatted_results)
-            
+        """获取增强版搜索工具，供代理调用；Tool.run不会把额外参数传给工具函数，需要取消或指定结果数时直接调用search"""
+        web_tools = WebTools()
+
+        def enhanced_search(query: str) -> str:
+            return web_tools.search(query)
+
         return Tool(
             name="网络搜索",
             func=enhanced_search,
@@ -37,15 +80,38 @@ class GetFullText(BaseTool):
     description: str = "获取网页全文内容"
  
     def _run(self, url: str) -> str:
-        print('开始获取网页内容...')
+        return self.fetch(url)
+
+    def fetch(self, url: str, cancel_token: Optional[CancellationToken] = None) -> str:
+        """
+        获取网页全文，取消时关闭连接并抛出OperationCancelled
+
+        Args:
+            url: 网页地址
+            cancel_token: 可选的取消令牌
+        """
+        logging.getLogger(__name__).debug(f"获取网页内容: {url}")
         headers = {
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.6 Safari/605.1.15'
         }
         try:
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()  # 检查响应状态
-            response.encoding = response.apparent_encoding  # 自动检测编码
-            soup = BeautifulSoup(response.text, 'html.parser')
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            with span("tool.fetch_full_text") as fetch_span:
+                response = requests.get(url, headers=headers, timeout=10, stream=True)
+                # 取消时关闭响应，正在进行的读取立即出错返回
+                remove_callback = cancel_token.add_callback(response.close) if cancel_token is not None else (lambda: None)
+                try:
+                    response.raise_for_status()  # 检查响应状态
+                    content = b"".join(response.iter_content(chunk_size=65536))
+                finally:
+                    remove_callback()
+                    response.close()
+                if fetch_span is not None:
+                    fetch_span.set(bytes=len(content))
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            soup = BeautifulSoup(content, 'html.parser')  # 由BeautifulSoup自动检测编码
             
             # 获取所有文本内容，不仅仅是 p 标签
             text_content = []
@@ -59,12 +125,43 @@ class GetFullText(BaseTool):
                 
             return '\n'.join(text_content)
             
+        except OperationCancelled:
+            raise
         except requests.exceptions.RequestException as e:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
             return f"网络请求错误：{str(e)}"
         except Exception as e:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
             return f"处理内容时出错：{str(e)}"
 
 # test tools
 if __name__ == "__main__":
-    tool = WebTools()
-    print(tool.get_search_tool().run("量子计算相关政策"))
\ No newline at end of file
+    import threading
+    import time
+    from backend.benchmarks.fake_web_server import FakeWebServer
+
+    # 搜索进行中取消时应立即返回：假搜索服务延迟5秒，0.5秒后取消
+    web_server = FakeWebServer(search_latency=5, jitter=0).start()
+    search_api_url = os.environ.get("SEARCH_API_URL")
+    os.environ["SEARCH_API_URL"] = web_server.search_url
+    cancel_token = CancellationToken()
+    threading.Timer(0.5, cancel_token.cancel).start()
+    start = time.time()
+    try:
+        WebTools().search("量子计算相关政策", cancel_token=cancel_token)
+        raise AssertionError("搜索没有被取消")
+    except OperationCancelled:
+        elapsed = time.time() - start
+    web_server.stop()
+    assert elapsed < 1.5, f"取消后{elapsed:.1f}秒才返回"
+    print(f"取消搜索检查通过：{elapsed:.2f}秒后返回")
+
+    # 传入搜索内容时用配置的搜索接口搜索
+    if search_api_url is None:
+        del os.environ["SEARCH_API_URL"]
+    else:
+        os.environ["SEARCH_API_URL"] = search_api_url
+    if len(sys.argv) > 1:
+        print(WebTools().get_search_tool().run(sys.argv[1]))
\ No newline at end of file
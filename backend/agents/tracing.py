@@ -0,0 +1,291 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+'''
+轻量级链路追踪：在代理和工具调用外层打开嵌套的span，记录耗时、token数和数据量，
+每次运行导出为一个JSONL追踪文件，summary命令按阶段汇总为火焰图式的耗时分解
+'''
+
+TRACE_DIR = os.getenv("TRACE_DIR", "./traces")
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") not in ("0", "false", "False")
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """一段被追踪的操作，attrs中记录token数、数据量等属性"""
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start", "end", "attrs", "error", "thread")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attrs: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attrs = attrs
+        self.error: Optional[str] = None
+        self.thread = threading.current_thread().name
+
+    @property
+    def duration(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+    def set(self, **attrs: Any):
+        """设置属性"""
+        self.attrs.update(attrs)
+
+    def add(self, **counters: float):
+        """累加数值属性，例如流式输出时逐段累加输出字符数"""
+        for key, value in counters.items():
+            self.attrs[key] = self.attrs.get(key, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "duration": self.duration,
+            "thread": self.thread,
+            "error": self.error,
+            "attrs": self.attrs,
+        }
+
+
+class Trace:
+    """一次运行的全部span，运行结束时写入JSONL文件"""
+    def __init__(self, name: str, directory: str = TRACE_DIR):
+        self.trace_id = time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        self.name = name
+        self.directory = directory
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"{self.name}-{self.trace_id}.jsonl")
+
+    def _add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def export(self) -> str:
+        """写入追踪文件，未结束的span记为到导出时刻为止"""
+        now = time.time()
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            spans = list(self.spans)
+        with open(self.path, "w", encoding="utf-8") as f:
+            for span in spans:
+                record = span.to_dict()
+                if record["end"] is None:
+                    record["end"] = now
+                    record["duration"] = now - span.start
+                    record["attrs"] = dict(record["attrs"], unfinished=True)
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        return self.path
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def reset_context_var(var: contextvars.ContextVar, token: contextvars.Token, default: Any = None):
+    """恢复contextvar在set之前的值；生成器跨线程恢复执行时上下文已经不同，token无法使用，直接设为default"""
+    try:
+        var.reset(token)
+    except ValueError:
+        var.set(default)
+
+
+@contextmanager
+def trace_run(name: str, directory: Optional[str] = None, **attrs: Any) -> Iterator[Optional[Span]]:
+    """
+    开始一次新的追踪运行，退出时把追踪写入directory/{name}-{trace_id}.jsonl
+
+    已经处于追踪中时只打开一个普通的span；TRACING_ENABLED=0时不追踪。
+
+    Yields:
+        根span，不追踪时为None
+    """
+    if not TRACING_ENABLED:
+        yield None
+        return
+    if _current_span.get() is not None:
+        with span(name, **attrs) as child:
+            yield child
+        return
+    trace = Trace(name, directory or TRACE_DIR)
+    root = Span(trace, name, None, dict(attrs))
+    trace._add(root)
+    token = _current_span.set(root)
+    try:
+        yield root
+    except GeneratorExit:
+        # 流式生成器被调用方提前关闭，不算出错
+        raise
+    except BaseException as e:
+        root.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        root.end = time.time()
+        reset_context_var(_current_span, token)
+        try:
+            trace.export()
+        except OSError:
+            pass
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Optional[Span]]:
+    """
+    在当前追踪中打开一个子span；没有进行中的追踪时什么也不做
+
+    Yields:
+        新的span，没有进行中的追踪时为None
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.span_id, dict(attrs))
+    parent.trace._add(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except GeneratorExit:
+        # 流式生成器被调用方提前关闭，不算出错
+        raise
+    except BaseException as e:
+        child.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        child.end = time.time()
+        reset_context_var(_current_span, token)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """函数装饰器：每次调用打开一个span，默认以函数的限定名命名"""
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def with_context(func: Callable) -> Callable:
+    """
+    把当前上下文（包括当前span）绑定到func上，用于提交到线程池或新线程的任务，
+    使其中打开的span挂在提交时的span下面
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        # 同一个上下文不能被多个线程同时进入，每次调用复制一份
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+def record_llm_usage(target: Optional[Span], message: Any):
+    """从模型返回的消息中读取token用量（usage_metadata）记录到span"""
+    if target is None:
+        return
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        target.add(input_tokens=usage.get("input_tokens", 0), output_tokens=usage.get("output_tokens", 0))
+
+
+def load_trace(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(spans: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    按调用路径（从根span到当前span的名称序列）汇总
+
+    Returns:
+        按路径排序的汇总行：path、depth、count、total（总耗时）、self（去掉子span后的耗时）、
+        max以及累加的token和数据量属性
+    """
+    by_id = {record["span_id"]: record for record in spans}
+    children_time: Dict[str, float] = {}
+    for record in spans:
+        if record["parent_id"] in by_id:
+            children_time[record["parent_id"]] = children_time.get(record["parent_id"], 0.0) + (record["duration"] or 0.0)
+
+    def path_of(record: Dict[str, Any]) -> tuple:
+        names = []
+        while record is not None:
+            names.append(record["name"])
+            record = by_id.get(record["parent_id"])
+        return tuple(reversed(names))
+
+    rows: Dict[tuple, Dict[str, Any]] = {}
+    for record in spans:
+        path = path_of(record)
+        duration = record["duration"] or 0.0
+        row = rows.setdefault(path, {"path": path, "depth": len(path) - 1, "count": 0, "total": 0.0,
+                                     "self": 0.0, "max": 0.0, "errors": 0, "attrs": {}})
+        row["count"] += 1
+        row["total"] += duration
+        # 并发的子span耗时之和可能超过父span，self不小于0
+        row["self"] += max(0.0, duration - children_time.get(record["span_id"], 0.0))
+        row["max"] = max(row["max"], duration)
+        row["errors"] += 1 if record.get("error") else 0
+        for key, value in (record.get("attrs") or {}).items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                row["attrs"][key] = row["attrs"].get(key, 0) + value
+    return [rows[path] for path in sorted(rows)]
+
+
+def format_summary(rows: List[Dict[str, Any]], width: int = 30) -> str:
+    """把汇总行格式化为缩进的火焰图式文本，条形长度按占根span总耗时的比例"""
+    if not rows:
+        return "追踪文件中没有span"
+    root_total = max(row["total"] for row in rows if row["depth"] == 0) or 1.0
+    lines = [f"{'阶段':<48}{'次数':>6}{'总耗时':>10}{'自身':>10}{'最长':>9}  占比"]
+    for row in rows:
+        label = "  " * row["depth"] + row["path"][-1]
+        bar = "█" * max(1, round(width * row["total"] / root_total)) if row["total"] else ""
+        line = (f"{label:<48}{row['count']:>6}{row['total']:>9.2f}s{row['self']:>9.2f}s{row['max']:>8.2f}s  "
+                f"{bar} {100 * row['total'] / root_total:.0f}%")
+        extras = [f"{key}={value:g}" for key, value in sorted(row["attrs"].items())]
+        if row["errors"]:
+            extras.append(f"errors={row['errors']}")
+        if extras:
+            line += "  (" + ", ".join(extras) + ")"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="汇总追踪文件，输出各阶段耗时分解")
+    parser.add_argument("trace", nargs="?", help="追踪文件路径，默认使用追踪目录中最新的文件")
+    parser.add_argument("--dir", default=TRACE_DIR, help="追踪目录")
+    args = parser.parse_args()
+
+    trace_path = args.trace
+    if trace_path is None:
+        candidates = [os.path.join(args.dir, name) for name in os.listdir(args.dir) if name.endswith(".jsonl")] if os.path.isdir(args.dir) else []
+        if not candidates:
+            raise SystemExit(f"{args.dir} 中没有追踪文件")
+        trace_path = max(candidates, key=os.path.getmtime)
+    print(trace_path)
+    print(format_summary(summarize(load_trace(trace_path))))
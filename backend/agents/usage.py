@@ -0,0 +1,255 @@
+import contextvars
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from backend.agents.tracing import reset_context_var
+'''
+模型用量计量：在模型调用层记录每次调用的输入/输出token数和费用，按报告、章节、聊天轮次汇总，
+超出预算时通知调用方停止或降级。计量器和当前范围保存在contextvar中，随tracing.with_context传递到线程
+'''
+
+# 预算模式：超出预算后停止生成 / 降级（不再检索新问题，用已有内容完成报告）
+BUDGET_STOP = "stop"
+BUDGET_DEGRADE = "degrade"
+
+_current_meter: contextvars.ContextVar[Optional["UsageMeter"]] = contextvars.ContextVar("usage_meter", default=None)
+_current_scope: contextvars.ContextVar[Tuple[str, ...]] = contextvars.ContextVar("usage_scope", default=())
+
+# 提供方名称 -> (每百万输入token价格, 每百万输出token价格)，由路由配置中的price字段注册
+_prices: Dict[str, Tuple[float, float]] = {}
+_prices_lock = threading.Lock()
+
+
+def set_price(provider: str, input_price: float, output_price: float):
+    """
+    登记提供方的价格
+
+    Args:
+        provider: 提供方名称，同路由配置中的name
+        input_price: 每百万输入token的价格
+        output_price: 每百万输出token的价格
+    """
+    with _prices_lock:
+        _prices[provider] = (float(input_price), float(output_price))
+
+
+def get_price(provider: Optional[str]) -> Optional[Tuple[float, float]]:
+    with _prices_lock:
+        return _prices.get(provider)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计token数：中文按字计，其他按4个字符一个token计"""
+    if not text:
+        return 0
+    cjk = len(re.findall(r"[一-鿿]", text))
+    return cjk + max(0, len(text) - cjk) // 4 + 1
+
+
+class UsageStats:
+    """一组模型调用的用量合计"""
+    __slots__ = ("calls", "input_tokens", "output_tokens", "cost", "estimated_calls", "unpriced_calls")
+
+    def __init__(self):
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+        # 提供方没有返回用量、按文本长度估算的调用数
+        self.estimated_calls = 0
+        # 没有配置价格、未计入费用的调用数
+        self.unpriced_calls = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def add(self, input_tokens: int, output_tokens: int, cost: Optional[float], estimated: bool):
+        self.calls += 1
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        if cost is None:
+            self.unpriced_calls += 1
+        else:
+            self.cost += cost
+        if estimated:
+            self.estimated_calls += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "total_tokens": self.total_tokens,
+            "cost": round(self.cost, 6),
+            "estimated_calls": self.estimated_calls,
+            "unpriced_calls": self.unpriced_calls,
+        }
+
+
+class UsageBudget:
+    """token数和费用预算，None表示不限制"""
+    def __init__(self, max_tokens: Optional[int] = None, max_cost: Optional[float] = None, mode: str = BUDGET_STOP):
+        """
+        Args:
+            max_tokens: 输入和输出token总数上限
+            max_cost: 费用上限，单位同路由配置中的价格
+            mode: 超出预算后的处理方式，BUDGET_STOP或BUDGET_DEGRADE
+        """
+        if mode not in (BUDGET_STOP, BUDGET_DEGRADE):
+            raise ValueError(f"未知的预算模式: {mode}")
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.mode = mode
+
+    @classmethod
+    def from_env(cls, prefix: str = "REPORT") -> "UsageBudget":
+        """从环境变量{prefix}_TOKEN_BUDGET、{prefix}_COST_BUDGET、{prefix}_BUDGET_MODE读取预算"""
+        max_tokens = os.getenv(f"{prefix}_TOKEN_BUDGET")
+        max_cost = os.getenv(f"{prefix}_COST_BUDGET")
+        return cls(
+            max_tokens=int(max_tokens) if max_tokens else None,
+            max_cost=float(max_cost) if max_cost else None,
+            mode=os.getenv(f"{prefix}_BUDGET_MODE", BUDGET_STOP),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_tokens is not None or self.max_cost is not None
+
+    def exceeded_by(self, stats: UsageStats) -> Optional[str]:
+        """返回超出预算的说明，未超出时返回None"""
+        if self.max_tokens is not None and stats.total_tokens > self.max_tokens:
+            return f"token用量{stats.total_tokens}超出预算{self.max_tokens}"
+        if self.max_cost is not None and stats.cost > self.max_cost:
+            return f"费用{stats.cost:.4f}超出预算{self.max_cost:.4f}"
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"max_tokens": self.max_tokens, "max_cost": self.max_cost, "mode": self.mode}
+
+
+class UsageMeter:
+    """
+    一次运行（一份报告或一轮聊天）的用量计量器
+
+    每次调用同时计入总计、所在范围（例如章节）和提供方；第一次超出预算时调用已登记的回调。
+    """
+    def __init__(self, budget: Optional[UsageBudget] = None):
+        self.budget = budget or UsageBudget()
+        self.total = UsageStats()
+        self.by_scope: Dict[str, UsageStats] = {}
+        self.by_provider: Dict[str, UsageStats] = {}
+        self.exceeded_reason: Optional[str] = None
+        self._callbacks: List[Callable[[str], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def exceeded(self) -> bool:
+        return self.exceeded_reason is not None
+
+    def on_exceeded(self, callback: Callable[[str], None]):
+        """登记超出预算时的回调，参数为超出说明；已经超出时立即调用"""
+        with self._lock:
+            reason = self.exceeded_reason
+            if reason is None:
+                self._callbacks.append(callback)
+        if reason is not None:
+            callback(reason)
+
+    def record(self, provider: Optional[str], input_tokens: int, output_tokens: int,
+               scope: Tuple[str, ...] = (), estimated: bool = False):
+        """
+        记录一次模型调用
+
+        Args:
+            provider: 提供方名称，用于查找价格
+            input_tokens: 输入token数
+            output_tokens: 输出token数
+            scope: 调用所在的范围，例如("政策和战略",)
+            estimated: token数是否为估算值
+        """
+        price = get_price(provider)
+        cost = None if price is None else (input_tokens * price[0] + output_tokens * price[1]) / 1_000_000
+        callbacks = []
+        with self._lock:
+            self.total.add(input_tokens, output_tokens, cost, estimated)
+            if scope:
+                self.by_scope.setdefault("/".join(scope), UsageStats()).add(input_tokens, output_tokens, cost, estimated)
+            self.by_provider.setdefault(provider or "unknown", UsageStats()).add(input_tokens, output_tokens, cost, estimated)
+            if self.exceeded_reason is None:
+                self.exceeded_reason = self.budget.exceeded_by(self.total)
+                if self.exceeded_reason is not None:
+                    callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self.exceeded_reason)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "total": self.total.to_dict(),
+                "by_scope": {name: stats.to_dict() for name, stats in self.by_scope.items()},
+                "by_provider": {name: stats.to_dict() for name, stats in self.by_provider.items()},
+                "budget": self.budget.to_dict(),
+                "exceeded": self.exceeded_reason,
+            }
+
+
+def format_usage(summary: Dict[str, Any]) -> str:
+    """把UsageMeter.summary()格式化为一行文字"""
+    total = summary["total"]
+    text = f"模型调用{total['calls']}次，输入{total['input_tokens']} tokens，输出{total['output_tokens']} tokens"
+    if total["calls"] > total["unpriced_calls"]:
+        text += f"，费用{total['cost']:.4f}"
+    if total["unpriced_calls"]:
+        text += f"（{total['unpriced_calls']}次调用未配置价格）"
+    if total["estimated_calls"]:
+        text += f"（{total['estimated_calls']}次调用的token数为估算）"
+    return text
+
+
+def current_meter() -> Optional[UsageMeter]:
+    return _current_meter.get()
+
+
+@contextmanager
+def metering(meter: UsageMeter) -> Iterator[UsageMeter]:
+    """在with块内（包括用tracing.with_context绑定上下文的线程）把模型调用计入meter"""
+    meter_token = _current_meter.set(meter)
+    scope_token = _current_scope.set(())
+    try:
+        yield meter
+    finally:
+        reset_context_var(_current_scope, scope_token, ())
+        reset_context_var(_current_meter, meter_token, None)
+
+
+@contextmanager
+def usage_scope(name: str) -> Iterator[None]:
+    """在with块内的模型调用额外计入名为name的范围，可以嵌套"""
+    token = _current_scope.set(_current_scope.get() + (name,))
+    try:
+        yield
+    finally:
+        reset_context_var(_current_scope, token, ())
+
+
+def record_usage(provider: Optional[str], usage: Optional[Dict[str, Any]], prompt_text: str = "", output_text: str = ""):
+    """
+    把一次模型调用计入当前计量器，没有计量器时什么也不做
+
+    Args:
+        provider: 提供方名称
+        usage: 模型返回的usage_metadata，没有时按文本长度估算
+        prompt_text: 提示词文本，用于估算
+        output_text: 输出文本，用于估算
+    """
+    meter = _current_meter.get()
+    if meter is None:
+        return
+    if usage:
+        meter.record(provider, usage.get("input_tokens", 0), usage.get("output_tokens", 0), _current_scope.get())
+    else:
+        meter.record(provider, estimate_tokens(prompt_text), estimate_tokens(output_text), _current_scope.get(), estimated=True)
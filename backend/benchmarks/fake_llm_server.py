@@ -0,0 +1,326 @@
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from backend.agents.usage import estimate_tokens
+'''
+本地假LLM服务：兼容OpenAI的/v1/chat/completions接口（支持流式输出）和/v1/embeddings接口，
+延迟、吞吐和错误率可配置，返回内容由提示词确定性地生成，用于离线测试、压测模型路由和基准测试
+'''
+
+
+def fake_completion(prompt: str, response_chars: int = 400) -> str:
+    """根据提示词确定性地生成回复，覆盖项目中各类提示词需要的输出格式"""
+    seed = int(hashlib.md5(prompt.encode("utf-8")).hexdigest()[:8], 16)
+    quoted = re.findall(r'"([^"\n]{1,40})"', prompt)
+    topic = quoted[0] if quoted else "测试主题"
+    section = quoted[1] if len(quoted) > 1 else "概述"
+
+    # 检索问题生成
+    if "<|question_start|>" in prompt:
+        aspects = ["最新进展", "政策动向", "产业布局", "技术突破", "市场规模"]
+        start = seed % len(aspects)
+        parts = [f"<|think_start|>为'{section}'部分规划检索方向<|think_end|>"]
+        for i in range(4):
+            parts.append(f"<|question_start|>{topic} {section} {aspects[(start + i) % len(aspects)]}<|question_end|>")
+        return "\n".join(parts)
+
+    # 报告大纲
+    if '"structure"' in prompt:
+        outline = {
+            "title": topic,
+            "structure": [
+                {"subtitle": subtitle, "content": [f"{subtitle}要点{i + 1}" for i in range(3)]}
+                for subtitle in ["政策和战略", "产业进展", "科技前沿", "总结"]
+            ],
+        }
+        return json.dumps(outline, ensure_ascii=False, indent=2)
+
+    # 是/否判断
+    if '只回答"是"或"否"' in prompt:
+        return "是" if seed % 2 == 0 else "否"
+
+    sentences = [
+        f"围绕{topic}，相关机构持续推进关键技术研发与应用落地。",
+        f"在{section}方面，多方发布了新的规划与阶段性成果。",
+        "行业数据显示投入规模保持增长，产学研合作不断深化。",
+        "专家指出，标准体系建设与人才培养仍是下一阶段的重点。",
+        "国际竞争与合作并存，产业链上下游协同效应逐步显现。",
+    ]
+
+    # 段落级增量修改：替换已有内容中的一段并在末尾追加一段
+    if '"op"' in prompt:
+        paragraph_ids = re.findall(r"^\[(p\d+)\] ", prompt, re.M)
+        edits = []
+        if paragraph_ids:
+            edits.append({"op": "replace", "id": paragraph_ids[seed % len(paragraph_ids)],
+                          "text": sentences[seed % len(sentences)] + sentences[(seed + 1) % len(sentences)]})
+        edits.append({"op": "append", "text": sentences[(seed + 2) % len(sentences)]})
+        return json.dumps(edits, ensure_ascii=False)
+
+    text = ""
+    index = seed
+    while len(text) < response_chars:
+        text += sentences[index % len(sentences)]
+        index += 1
+    return text[:response_chars]
+
+
+def fake_embedding(text, dim: int = 256) -> List[float]:
+    """
+    确定性的假向量：字符二元组哈希到dim维后归一化，字面相近的文本向量也相近
+
+    Args:
+        text: 文本，或tiktoken编码后的token id列表
+        dim: 向量维度
+    """
+    vector = [0.0] * dim
+    if isinstance(text, list):
+        grams = [f"{a},{b}" for a, b in zip(text, text[1:])] or [str(token) for token in text]
+    else:
+        grams = [text[i:i + 2] for i in range(max(1, len(text) - 1))]
+    for gram in grams:
+        h = zlib.crc32(gram.encode("utf-8"))
+        vector[h % dim] += 1.0 if (h >> 16) & 1 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+def _messages_to_prompt(messages: List[Dict]) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        parts.append(content)
+    return "\n".join(parts)
+
+
+class FakeLLMServer:
+    """
+    可在后台线程中运行的假LLM服务
+
+    每个请求先等待first_token_latency（带jitter比例的随机抖动），
+    之后按tokens_per_second输出内容；error_rate比例的请求直接返回500。
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, first_token_latency: float = 0.2,
+                 tokens_per_second: float = 200.0, jitter: float = 0.1, error_rate: float = 0.0,
+                 response_chars: int = 400, seed: Optional[int] = 0, embedding_latency: float = 0.02,
+                 embedding_dim: int = 256):
+        """
+        Args:
+            host: 监听地址
+            port: 监听端口，0表示自动分配
+            first_token_latency: 首个token延迟（秒）
+            tokens_per_second: 输出速度，0表示不限速
+            jitter: 延迟的随机抖动比例
+            error_rate: 返回错误的请求比例
+            response_chars: 普通文本回复的长度
+            seed: 随机种子，None表示不固定
+            embedding_latency: 每次向量请求的延迟（秒）
+            embedding_dim: 向量维度
+        """
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.response_chars = response_chars
+        self.embedding_latency = embedding_latency
+        self.embedding_dim = embedding_dim
+        self.request_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeLLMServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-llm-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def _draw(self) -> Tuple[float, bool]:
+        """返回本次请求的首个token延迟和是否出错"""
+        with self._lock:
+            self.request_count += 1
+            factor = 1.0 + self._random.uniform(-self.jitter, self.jitter)
+            failed = self._random.random() < self.error_rate
+        return max(0.0, self.first_token_latency * factor), failed
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, payload: Dict):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send_json(200, {"object": "list", "data": [{"id": "fake-chat", "object": "model"}]})
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.rstrip("/").endswith("/chat/completions"):
+                    self._chat_completions(request)
+                elif self.path.rstrip("/").endswith("/embeddings"):
+                    self._embeddings(request)
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def _embeddings(self, request: Dict):
+                time.sleep(server.embedding_latency)
+                inputs = request.get("input", [])
+                # 单个字符串或单个token id列表
+                if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                    inputs = [inputs]
+                data = []
+                for i, item in enumerate(inputs):
+                    embedding = fake_embedding(item, server.embedding_dim)
+                    if request.get("encoding_format") == "base64":
+                        # openai客户端默认请求base64编码的float32数组
+                        embedding = base64.b64encode(struct.pack(f"<{len(embedding)}f", *embedding)).decode("ascii")
+                    data.append({"object": "embedding", "index": i, "embedding": embedding})
+                tokens = sum(len(item) if isinstance(item, list) else estimate_tokens(item) for item in inputs)
+                self._send_json(200, {
+                    "object": "list",
+                    "data": data,
+                    "model": request.get("model", "fake-embedding"),
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                })
+
+            def _chat_completions(self, request: Dict):
+                first_token_latency, failed = server._draw()
+                time.sleep(first_token_latency)
+                if failed:
+                    self._send_json(500, {"error": {"message": "fake server error", "type": "server_error"}})
+                    return
+
+                model = request.get("model", "fake-chat")
+                prompt = _messages_to_prompt(request.get("messages", []))
+                content = fake_completion(prompt, server.response_chars)
+                usage = {
+                    "prompt_tokens": estimate_tokens(prompt),
+                    "completion_tokens": estimate_tokens(content),
+                }
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+                created = int(time.time())
+
+                if not request.get("stream"):
+                    if server.tokens_per_second > 0:
+                        time.sleep(usage["completion_tokens"] / server.tokens_per_second)
+                    self._send_json(200, {
+                        "id": completion_id,
+                        "object": "chat.completion",
+                        "created": created,
+                        "model": model,
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                        "usage": usage,
+                    })
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+
+                def send_chunk(payload: Dict):
+                    self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+                def chunk_payload(delta: Dict, finish_reason=None) -> Dict:
+                    return {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                    }
+
+                # 每次输出约两个字，模拟逐token输出
+                pieces = [content[i:i + 2] for i in range(0, len(content), 2)]
+                delay = 2 / server.tokens_per_second if server.tokens_per_second > 0 else 0
+                try:
+                    send_chunk(chunk_payload({"role": "assistant", "content": ""}))
+                    for piece in pieces:
+                        send_chunk(chunk_payload({"content": piece}))
+                        if delay:
+                            time.sleep(delay)
+                    send_chunk(chunk_payload({}, finish_reason="stop"))
+                    if (request.get("stream_options") or {}).get("include_usage"):
+                        send_chunk({"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                                    "model": model, "choices": [], "usage": usage})
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前断开（例如对冲请求落败后被关闭）
+                    pass
+                self.close_connection = True
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="启动兼容OpenAI接口的本地假LLM服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="首个token延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="输出速度，0表示不限速")
+    parser.add_argument("--jitter", type=float, default=0.1, help="延迟随机抖动比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误的请求比例")
+    parser.add_argument("--response-chars", type=int, default=400, help="普通文本回复长度")
+    parser.add_argument("--embedding-latency", type=float, default=0.02, help="向量请求延迟（秒）")
+    args = parser.parse_args()
+
+    fake_server = FakeLLMServer(
+        host=args.host,
+        port=args.port,
+        first_token_latency=args.first_token_latency,
+        tokens_per_second=args.tokens_per_second,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        response_chars=args.response_chars,
+        embedding_latency=args.embedding_latency,
+    )
+    print(f"假LLM服务已启动: {fake_server.base_url}")
+    fake_server.serve_forever()
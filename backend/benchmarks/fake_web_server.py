@@ -0,0 +1,170 @@
+import hashlib
+import html
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, quote, urlparse
+'''
+本地假搜索/网页服务：/search返回与tools.JsonSearchAPIWrapper兼容的JSON搜索结果，
+/page/<id>返回结果对应的HTML网页，内容由查询确定性地生成，延迟可配置，
+配合环境变量SEARCH_API_URL用于离线测试和基准测试
+'''
+
+_PARAGRAPHS = [
+    "据最新公开资料，{query}相关工作在过去一年取得了阶段性进展，多个试点项目进入验收阶段。",
+    "业内人士表示，{query}的核心难点在于关键器件的稳定性和规模化制造能力。",
+    "从政策层面看，{query}已被纳入多项中长期规划，配套资金和标准制定同步推进。",
+    "市场研究机构估计，{query}相关产业规模将在未来五年保持两位数增长。",
+    "在国际合作方面，{query}领域的联合研究和人才交流日益频繁。",
+    "专家建议，{query}下一阶段应加强基础研究投入，完善产学研协同机制。",
+]
+
+
+def _seed(text: str) -> int:
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def fake_search_results(query: str, max_results: int, base_url: str) -> List[Dict[str, str]]:
+    """根据查询确定性地生成搜索结果，链接指向本服务的/page页面"""
+    seed = _seed(query)
+    results = []
+    for i in range(max_results):
+        page_id = f"{seed:08x}{i}"
+        paragraph = _PARAGRAPHS[(seed + i) % len(_PARAGRAPHS)].format(query=query)
+        results.append({
+            "title": f"{query}（第{i + 1}条）",
+            "link": f"{base_url}/page/{page_id}?q={quote(query)}",
+            "snippet": paragraph[:80],
+        })
+    return results
+
+
+def fake_page(page_id: str, query: str, paragraphs: int = 8) -> str:
+    """根据页面编号和查询确定性地生成网页HTML"""
+    seed = _seed(page_id)
+    body = "\n".join(
+        f"<p>{html.escape(_PARAGRAPHS[(seed + i) % len(_PARAGRAPHS)].format(query=query))}</p>"
+        for i in range(paragraphs)
+    )
+    return f"<html><head><title>{html.escape(query)}</title></head><body><article>{body}</article></body></html>"
+
+
+class FakeWebServer:
+    """
+    可在后台线程中运行的假搜索/网页服务
+
+    搜索请求等待search_latency，网页请求等待page_latency，均带jitter比例的随机抖动。
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, search_latency: float = 0.3,
+                 page_latency: float = 0.2, jitter: float = 0.1, page_paragraphs: int = 8, seed: Optional[int] = 0):
+        """
+        Args:
+            host: 监听地址
+            port: 监听端口，0表示自动分配
+            search_latency: 搜索请求延迟（秒）
+            page_latency: 网页请求延迟（秒）
+            jitter: 延迟的随机抖动比例
+            page_paragraphs: 每个网页的段落数
+            seed: 随机种子，None表示不固定
+        """
+        self.search_latency = search_latency
+        self.page_latency = page_latency
+        self.jitter = jitter
+        self.page_paragraphs = page_paragraphs
+        self.search_count = 0
+        self.page_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def search_url(self) -> str:
+        """SEARCH_API_URL应设置的地址"""
+        return f"{self.base_url}/search"
+
+    def start(self) -> "FakeWebServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-web-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def _delay(self, latency: float) -> float:
+        with self._lock:
+            factor = 1.0 + self._random.uniform(-self.jitter, self.jitter)
+        return max(0.0, latency * factor)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                query = params.get("q", [""])[0]
+                if url.path.rstrip("/") == "/search":
+                    with server._lock:
+                        server.search_count += 1
+                    time.sleep(server._delay(server.search_latency))
+                    max_results = int(params.get("max_results", ["4"])[0])
+                    results = fake_search_results(query, max_results, server.base_url)
+                    self._send(200, json.dumps(results, ensure_ascii=False).encode("utf-8"), "application/json")
+                elif url.path.startswith("/page/"):
+                    with server._lock:
+                        server.page_count += 1
+                    time.sleep(server._delay(server.page_latency))
+                    page = fake_page(url.path[len("/page/"):], query, server.page_paragraphs)
+                    self._send(200, page.encode("utf-8"), "text/html; charset=utf-8")
+                else:
+                    self._send(404, b"not found", "text/plain")
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="启动本地假搜索/网页服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--search-latency", type=float, default=0.3, help="搜索请求延迟（秒）")
+    parser.add_argument("--page-latency", type=float, default=0.2, help="网页请求延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.1, help="延迟随机抖动比例")
+    args = parser.parse_args()
+
+    fake_server = FakeWebServer(
+        host=args.host,
+        port=args.port,
+        search_latency=args.search_latency,
+        page_latency=args.page_latency,
+        jitter=args.jitter,
+    )
+    print(f"假搜索服务已启动: SEARCH_API_URL={fake_server.search_url}")
+    fake_server.serve_forever()
@@ -0,0 +1,311 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.append(REPO_ROOT)
+from backend.benchmarks.fake_llm_server import FakeLLMServer
+from backend.benchmarks.fake_web_server import FakeWebServer
+from backend.agents.stats import percentile
+'''
+离线端到端基准测试：启动假LLM服务（聊天和向量接口）和假搜索/网页服务，在临时目录中
+依次测量知识库导入速度（database/docs）、聊天问答延迟和报告生成吞吐量，以及进程峰值内存，
+结果可以保存为基线，之后每次运行与基线比较，超出容差的退化以非零退出码返回。
+
+python -m backend.benchmarks.run_benchmarks                  # 运行并与基线比较
+python -m backend.benchmarks.run_benchmarks --save-baseline  # 运行并保存为新基线
+'''
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_DOCS_DIR = os.path.join(REPO_ROOT, "database", "docs")
+
+# 指标名 -> 是否越大越好
+METRICS = {
+    "ingestion_chunks_per_sec": True,
+    "chat_p50_s": False,
+    "chat_p95_s": False,
+    "reports_per_min": True,
+    "peak_rss_mb": False,
+}
+
+CHAT_QUERIES = [
+    ("量子计算的最新政策有哪些？", "auto"),
+    ("工信部在量子科技方面有什么新动向？", "web"),
+    ("量子安全网络的未来发展趋势", "knowledge_base"),
+    ("量子科技写入二十届三中全会《决定》意味着什么？", "auto"),
+    ("量子通信产业规模有多大？", "web"),
+    ("什么是量子计算？", "knowledge_base"),
+]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """进程至今的峰值常驻内存（MB），不支持的平台返回None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux上单位是KB，macOS上是字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def setup_environment(workdir: str, llm_server: FakeLLMServer, web_server: FakeWebServer):
+    """
+    让模型、向量、搜索请求都指向假服务，知识库、检查点和追踪文件都写到临时目录
+
+    必须在导入backend.agents中的代理之前调用：部分模块在导入时读取环境变量。
+    """
+    router_config = {
+        "providers": [
+            {"name": "fake", "model": "fake-chat", "model_provider": "openai",
+             "base_url": llm_server.base_url, "api_key": "fake", "tiers": ["default", "fast"]}
+        ],
+        "hedge": False,
+    }
+    router_config_path = os.path.join(workdir, "router.json")
+    with open(router_config_path, "w", encoding="utf-8") as f:
+        json.dump(router_config, f)
+
+    os.environ.update({
+        "LLM_ROUTER_CONFIG": router_config_path,
+        "EMBEDDINGS_BASE_URL": llm_server.base_url,
+        "OPENAI_API_KEY": "fake",
+        "SEARCH_API_URL": web_server.search_url,
+        "REPORT_CHECKPOINT_DIR": os.path.join(workdir, "report_checkpoints"),
+        "TRACE_DIR": os.path.join(workdir, "traces"),
+        "ANONYMIZED_TELEMETRY": "False",
+    })
+    # 各代理默认使用./chroma_db等相对路径
+    os.chdir(workdir)
+
+
+def bench_ingestion(docs_dir: str) -> Dict[str, Any]:
+    """把docs_dir中的文档导入空知识库，测量每秒导入的文本块数"""
+    from backend.database.loader import DocumentLoader
+
+    doc_types = {".docx": "docx", ".pdf": "pdf", ".txt": "txt"}
+    files = sorted(path for path in glob.glob(os.path.join(docs_dir, "*")) if os.path.splitext(path)[1].lower() in doc_types)
+    if not files:
+        raise SystemExit(f"{docs_dir} 中没有可导入的文档")
+
+    loader = DocumentLoader()
+    start = time.perf_counter()
+    for path in files:
+        name = os.path.splitext(os.path.basename(path))[0]
+        loader.process_document(path, doc_type=doc_types[os.path.splitext(path)[1].lower()], title=name)
+    elapsed = time.perf_counter() - start
+    chunks = loader.collection.count()
+    return {
+        "files": len(files),
+        "chunks": chunks,
+        "seconds": elapsed,
+        "ingestion_chunks_per_sec": chunks / elapsed if elapsed > 0 else None,
+    }
+
+
+def bench_chat(queries: int, use_async: bool) -> Dict[str, Any]:
+    """依次执行问答，测量端到端延迟的p50/p95"""
+    from backend.agents.Chat_Search_Agent import ChatSearchAgent
+    from backend.agents.model_registry import get_routed_model
+
+    agent = ChatSearchAgent(llm=get_routed_model("default"))
+    latencies = []
+    for i in range(queries):
+        query, search_mode = CHAT_QUERIES[i % len(CHAT_QUERIES)]
+        start = time.perf_counter()
+        if use_async:
+            asyncio.run(agent.aprocess_query(query, search_mode=search_mode))
+        else:
+            agent.process_query(query, search_mode=search_mode)
+        latencies.append(time.perf_counter() - start)
+    return {
+        "queries": queries,
+        "async": use_async,
+        "chat_p50_s": percentile(latencies, 0.5),
+        "chat_p95_s": percentile(latencies, 0.95),
+        "chat_mean_s": sum(latencies) / len(latencies) if latencies else None,
+    }
+
+
+def bench_reports(reports: int, concurrency: int, report_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """生成reports份报告（最多concurrency份同时进行），测量每分钟完成的报告数"""
+    from backend.agents.events import REPORT_DONE
+    from backend.agents.streaming import ReportGenerator
+
+    topics = ["量子计算技术动态", "量子通信产业进展", "量子精密测量应用", "量子科技政策梳理"]
+    unfinished = []
+    lock = threading.Lock()
+
+    def run(index: int) -> float:
+        start = time.perf_counter()
+        generator = ReportGenerator(refine_mode=report_kwargs.get("refine_mode", "rewrite"))
+        done = None
+        kwargs = {key: value for key, value in report_kwargs.items() if key != "refine_mode"}
+        for event in generator.generate_full_report(topics[index % len(topics)], **kwargs):
+            if event.type == REPORT_DONE:
+                done = event
+        if done is None or done.data.get("unfinished"):
+            with lock:
+                unfinished.append(index)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        durations = list(executor.map(run, range(reports)))
+    elapsed = time.perf_counter() - start
+    return {
+        "reports": reports,
+        "concurrency": concurrency,
+        "unfinished": len(unfinished),
+        "seconds": elapsed,
+        "report_mean_s": sum(durations) / len(durations) if durations else None,
+        "reports_per_min": (reports - len(unfinished)) * 60 / elapsed if elapsed > 0 else None,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    与基线逐项比较
+
+    Args:
+        current: 本次结果
+        baseline: 基线结果
+        tolerance: 允许的相对退化比例，例如0.1表示变差不超过10%
+
+    Returns:
+        (比较行列表, 是否存在超出容差的退化)
+    """
+    rows = []
+    regressed = False
+    for name, higher_is_better in METRICS.items():
+        value = current["metrics"].get(name)
+        base = baseline.get("metrics", {}).get(name)
+        row = {"metric": name, "baseline": base, "current": value, "change": None, "status": "-"}
+        if value is not None and base:
+            change = (value - base) / base
+            row["change"] = change
+            worse = -change if higher_is_better else change
+            if worse > tolerance:
+                row["status"] = "退化"
+                regressed = True
+            elif worse < -tolerance:
+                row["status"] = "提升"
+            else:
+                row["status"] = "持平"
+        rows.append(row)
+    return rows, regressed
+
+
+def format_comparison(rows: List[Dict[str, Any]]) -> str:
+    def fmt(value):
+        return "-" if value is None else f"{value:.3f}"
+
+    lines = [f"{'指标':<28}{'基线':>12}{'本次':>12}{'变化':>10}  状态"]
+    for row in rows:
+        change = "-" if row["change"] is None else f"{100 * row['change']:+.1f}%"
+        lines.append(f"{row['metric']:<28}{fmt(row['baseline']):>12}{fmt(row['current']):>12}{change:>10}  {row['status']}")
+    return "\n".join(lines)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="离线端到端基准测试（假LLM、假向量、假搜索服务）")
+    parser.add_argument("--docs-dir", default=DEFAULT_DOCS_DIR, help="导入知识库的文档目录")
+    parser.add_argument("--chat-queries", type=int, default=12, help="问答次数")
+    parser.add_argument("--async-chat", action="store_true", help="使用aprocess_query")
+    parser.add_argument("--reports", type=int, default=2, help="生成报告数")
+    parser.add_argument("--report-concurrency", type=int, default=1, help="同时生成的报告数")
+    parser.add_argument("--max-sections", type=int, default=2, help="每份报告的章节数")
+    parser.add_argument("--max-questions", type=int, default=2, help="每个章节的检索问题数")
+    parser.add_argument("--section-concurrency", type=int, default=2, help="报告内同时生成的章节数")
+    parser.add_argument("--search-prefetch", type=int, default=1, help="章节内预取的检索结果数")
+    parser.add_argument("--refine-mode", default="rewrite", choices=["rewrite", "delta"])
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="假LLM首个token延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=400.0, help="假LLM输出速度，0表示不限速")
+    parser.add_argument("--embedding-latency", type=float, default=0.02, help="假向量接口延迟（秒）")
+    parser.add_argument("--search-latency", type=float, default=0.3, help="假搜索延迟（秒）")
+    parser.add_argument("--page-latency", type=float, default=0.2, help="假网页延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.1, help="延迟随机抖动比例")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="基线文件")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="允许的相对退化比例")
+    parser.add_argument("--output", help="把本次结果写入JSON文件")
+    args = parser.parse_args()
+
+    # 相对路径在切换到临时目录之前解析
+    docs_dir = os.path.abspath(args.docs_dir)
+    baseline_path = os.path.abspath(args.baseline)
+    output_path = os.path.abspath(args.output) if args.output else None
+
+    workdir = tempfile.mkdtemp(prefix="report-bench-")
+    llm_server = FakeLLMServer(first_token_latency=args.first_token_latency, tokens_per_second=args.tokens_per_second,
+                               jitter=args.jitter, embedding_latency=args.embedding_latency).start()
+    web_server = FakeWebServer(search_latency=args.search_latency, page_latency=args.page_latency, jitter=args.jitter).start()
+    setup_environment(workdir, llm_server, web_server)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("baseline", "save_baseline", "tolerance", "output", "docs_dir")}
+    results: Dict[str, Any] = {"config": config, "platform": platform.platform(), "python": platform.python_version(), "details": {}}
+    try:
+        print(f"工作目录: {workdir}")
+        print("导入知识库...")
+        results["details"]["ingestion"] = bench_ingestion(docs_dir)
+        print("问答...")
+        results["details"]["chat"] = bench_chat(args.chat_queries, args.async_chat)
+        print("生成报告...")
+        results["details"]["report"] = bench_reports(args.reports, args.report_concurrency, {
+            "refine_mode": args.refine_mode,
+            "max_questions": args.max_questions,
+            "max_sections": args.max_sections,
+            "max_concurrency": args.section_concurrency,
+            "search_prefetch": args.search_prefetch,
+        })
+    finally:
+        llm_server.stop()
+        web_server.stop()
+    results["details"]["requests"] = {
+        "llm": llm_server.request_count,
+        "search": web_server.search_count,
+        "page": web_server.page_count,
+    }
+
+    metrics = {}
+    for stage in results["details"].values():
+        metrics.update({key: value for key, value in stage.items() if key in METRICS})
+    metrics["peak_rss_mb"] = peak_rss_mb()
+    results["metrics"] = metrics
+
+    print(json.dumps(results["details"], ensure_ascii=False, indent=2))
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"已保存基线: {baseline_path}")
+        return 0
+
+    if not os.path.exists(baseline_path):
+        print(f"没有基线文件 {baseline_path}，使用 --save-baseline 保存本次结果作为基线")
+        for name in METRICS:
+            print(f"{name:<28}{'-' if metrics.get(name) is None else format(metrics[name], '.3f'):>12}")
+        return 0
+
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != config:
+        print("注意：基线的测试参数与本次不同，比较结果仅供参考")
+    rows, regressed = compare(results, baseline, args.tolerance)
+    print(format_comparison(rows))
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,21 +7,19 @@ from langchain_community.document_loaders import (
     TextLoader
 )
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
 import chromadb
 import os
 import dotenv
 from chromadb.api.models.Collection import Collection
+from backend.agents.model_registry import get_embeddings
 dotenv.load_dotenv()
 
 class ChromaManager:
     @staticmethod
     def get_collection(persist_directory="./chroma_db", collection_name="documents"):
         client = chromadb.PersistentClient(path=persist_directory)
-        embedding_model = OpenAIEmbeddings(
-            openai_api_key=os.getenv("OPENAI_API_KEY"),
-            model="text-embedding-ada-002"
-        )
+        # 共享的向量模型，连接池在各个DocumentLoader之间复用
+        embedding_model = get_embeddings("text-embedding-ada-002")
         
         # 创建符合新接口的embedding函数
         class OpenAIEmbeddingFunction:
@@ -0,0 +1,233 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+from typing import Any, Dict, List, Optional
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from backend.agents.streaming import ReportGenerator
+from backend.agents.question_registry import QuestionRegistry
+from backend.agents.evidence_store import EvidenceStore
+from backend.agents.events import METRICS, REPORT_DONE
+from backend.agents.model_registry import get_embeddings
+from backend.agents.rate_limit import LLM, SEARCH, set_rate_limit
+from backend.agents.usage import UsageBudget, BUDGET_DEGRADE, BUDGET_STOP
+from backend.agents.question_graph import GraphLimits
+from backend.agents.stats import percentile
+from backend.jobs.report_queue import ReportJobQueue, ReportJob, COMPLETED, FAILED, CANCELLED
+'''
+无界面批量生成报告：从文件读取主题，在任务队列中以给定并发生成，各报告共享检索问题登记表和证据库，
+模型请求和搜索受全局速率限制，每份报告输出Markdown和JSON，最后输出吞吐量汇总
+
+python -m backend.jobs.batch_reports topics.txt --output-dir reports --concurrency 3 --llm-rate-limit 5
+'''
+
+logger = logging.getLogger(__name__)
+
+
+def read_topics(path: str) -> List[str]:
+    """读取主题文件：每行一个主题，忽略空行和#开头的注释"""
+    with open(path, "r", encoding="utf-8") as f:
+        topics = [line.strip() for line in f]
+    return [topic for topic in topics if topic and not topic.startswith("#")]
+
+
+def report_to_markdown(report: Dict[str, Any]) -> str:
+    """把generate_full_report返回的报告字典转换为Markdown"""
+    parts = [f"# {report['title']}\n"]
+    for section in report.get("sections", []):
+        parts.append(f"## {section['title']}\n\n{(section['content'] or '').strip()}\n")
+    return "\n".join(parts)
+
+
+def _file_stem(index: int, topic: str) -> str:
+    # 保留中文，去掉文件名中不安全的字符
+    safe = re.sub(r'[\\/:*?"<>|\s]+', "_", topic).strip("_")[:60]
+    return f"{index + 1:03d}-{safe or 'report'}"
+
+
+def _job_record(job: ReportJob) -> Dict[str, Any]:
+    """从任务结束后保留的事件中取出用量和未完成章节，报告内容不放入记录"""
+    events, _ = job.read(0, timeout=0)
+    record = {
+        "topic": job.topic,
+        "job_id": job.job_id,
+        "report_id": job.report_id,
+        "status": job.status,
+        "error": job.error,
+        "elapsed": (job.finished_at - job.started_at) if job.started_at and job.finished_at else None,
+        "usage": None,
+        "unfinished": [],
+    }
+    for event in events:
+        if event.type == METRICS:
+            record["usage"] = event.data.get("usage")
+        elif event.type == REPORT_DONE:
+            record["unfinished"] = event.data.get("unfinished", [])
+    return record
+
+
+def run_batch(topics: List[str], output_dir: str, concurrency: int = 2, refine_mode: str = "rewrite",
+              share_caches: bool = True, **report_kwargs: Any) -> Dict[str, Any]:
+    """
+    批量生成报告
+
+    Args:
+        topics: 报告主题列表
+        output_dir: 输出目录，每份报告写入{序号}-{主题}.md和.json，汇总写入summary.json
+        concurrency: 同时生成的报告数
+        refine_mode: 章节提炼方式
+        share_caches: 是否在各报告之间共享检索问题登记表和证据库，相近主题可以复用检索结果
+        **report_kwargs: 传给ReportGenerator.generate_full_report的其他参数
+
+    Returns:
+        吞吐量汇总
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    question_registry = evidence_store = None
+    if share_caches:
+        try:
+            embeddings = get_embeddings()
+        except Exception as e:
+            logger.warning(f"无法加载向量模型，只合并完全相同的检索问题，证据库不参与查询: {str(e)}")
+            embeddings = None
+        question_registry = QuestionRegistry(embeddings)
+        evidence_store = EvidenceStore(embeddings)
+
+    def generator_factory(refine_mode: str) -> ReportGenerator:
+        return ReportGenerator(refine_mode=refine_mode, question_registry=question_registry, evidence_store=evidence_store)
+
+    job_queue = ReportJobQueue(
+        max_workers=concurrency,
+        max_queued=len(topics),
+        max_queued_per_owner=len(topics),
+        max_running_per_owner=concurrency,
+        generator_factory=generator_factory,
+        # 任务对象由本函数持有，队列中不必保留已结束的任务
+        keep_finished=0,
+    )
+    start = time.time()
+    jobs = [job_queue.submit(topic, owner="batch", refine_mode=refine_mode, **report_kwargs) for topic in topics]
+    records = []
+    try:
+        for index in range(len(jobs)):
+            # 等待任务结束，任务按提交顺序依次写出，后面的任务同时在后台生成；写出后不再持有任务和报告
+            job, jobs[index] = jobs[index], None
+            job.wait()
+            record = _job_record(job)
+            records.append(record)
+            stem = os.path.join(output_dir, _file_stem(index, job.topic))
+            if job.result is not None:
+                with open(f"{stem}.md", "w", encoding="utf-8") as f:
+                    f.write(report_to_markdown(job.result))
+            # 完整报告只写入文件，汇总时保留的记录中不包含报告内容
+            with open(f"{stem}.json", "w", encoding="utf-8") as f:
+                json.dump({**record, "report": job.result}, f, ensure_ascii=False, indent=2)
+            elapsed = f"{record['elapsed']:.1f}s" if record["elapsed"] is not None else "-"
+            print(f"[{index + 1}/{len(jobs)}] {job.topic}: {record['status']}，耗时{elapsed}"
+                  + (f"，{record['error']}" if record["error"] else ""), flush=True)
+    finally:
+        job_queue.shutdown()
+    wall_seconds = time.time() - start
+
+    durations = [record["elapsed"] for record in records if record["status"] == COMPLETED and record["elapsed"] is not None]
+    usage_total = {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0}
+    for record in records:
+        if record["usage"]:
+            for key in usage_total:
+                usage_total[key] += record["usage"]["total"][key]
+    completed = sum(record["status"] == COMPLETED for record in records)
+    summary = {
+        "topics": len(topics),
+        "completed": completed,
+        "failed": sum(record["status"] == FAILED for record in records),
+        "cancelled": sum(record["status"] == CANCELLED for record in records),
+        "with_unfinished_sections": sum(bool(record["unfinished"]) for record in records),
+        "concurrency": concurrency,
+        "wall_seconds": wall_seconds,
+        "reports_per_min": completed * 60 / wall_seconds if wall_seconds > 0 else None,
+        "report_seconds": {
+            "mean": sum(durations) / len(durations) if durations else None,
+            "p50": percentile(durations, 0.5),
+            "p95": percentile(durations, 0.95),
+        },
+        "usage": usage_total,
+        "reused_searches": question_registry.reused_searches if question_registry is not None else None,
+        "evidence": evidence_store.stats() if evidence_store is not None else None,
+    }
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
+
+
+def format_batch_summary(summary: Dict[str, Any]) -> str:
+    def seconds(value):
+        return "-" if value is None else f"{value:.1f}s"
+
+    lines = [
+        f"完成 {summary['completed']}/{summary['topics']} 份报告（失败 {summary['failed']}，取消 {summary['cancelled']}，"
+        f"有未完成章节 {summary['with_unfinished_sections']}），并发 {summary['concurrency']}",
+        f"总耗时 {seconds(summary['wall_seconds'])}，吞吐量 {summary['reports_per_min'] or 0:.2f} 份/分钟",
+        f"单份耗时：平均 {seconds(summary['report_seconds']['mean'])}，p50 {seconds(summary['report_seconds']['p50'])}，"
+        f"p95 {seconds(summary['report_seconds']['p95'])}",
+        f"模型调用 {summary['usage']['calls']} 次，输入 {summary['usage']['input_tokens']} tokens，"
+        f"输出 {summary['usage']['output_tokens']} tokens，费用 {summary['usage']['cost']:.4f}",
+    ]
+    if summary["reused_searches"] is not None:
+        lines.append(f"跨报告复用检索结果 {summary['reused_searches']} 次，证据库命中 {summary['evidence']['hits']} 次")
+    return "\n".join(lines)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="批量生成报告")
+    parser.add_argument("topics_file", help="主题文件，每行一个主题，#开头为注释")
+    parser.add_argument("--output-dir", default="./reports", help="输出目录")
+    parser.add_argument("--concurrency", type=int, default=2, help="同时生成的报告数")
+    parser.add_argument("--max-sections", type=int, default=None, help="每份报告的章节数，默认全部")
+    parser.add_argument("--max-questions", type=int, default=None, help="每个章节的检索问题数，默认全部")
+    parser.add_argument("--section-concurrency", type=int, default=2, help="每份报告内同时生成的章节数")
+    parser.add_argument("--search-prefetch", type=int, default=1, help="章节内预取的检索结果数")
+    parser.add_argument("--refine-mode", default="rewrite", choices=["rewrite", "delta"])
+    parser.add_argument("--graph-depth", type=int, default=None, help="追问深度，默认读取GRAPH_MAX_DEPTH")
+    parser.add_argument("--llm-rate-limit", type=float, default=None, help="全局模型请求速率（每秒），默认读取LLM_RATE_LIMIT")
+    parser.add_argument("--search-rate-limit", type=float, default=None, help="全局搜索速率（每秒），默认读取SEARCH_RATE_LIMIT")
+    parser.add_argument("--token-budget", type=int, default=None, help="每份报告的token预算，默认读取REPORT_TOKEN_BUDGET")
+    parser.add_argument("--budget-mode", default=BUDGET_DEGRADE, choices=[BUDGET_DEGRADE, BUDGET_STOP])
+    parser.add_argument("--no-shared-cache", action="store_true", help="各报告不共享检索问题登记表和证据库")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    topics = read_topics(args.topics_file)
+    if not topics:
+        print(f"{args.topics_file} 中没有主题")
+        return 1
+
+    # 速率限制必须在第一次获取路由模型之前设置
+    if args.llm_rate_limit:
+        set_rate_limit(LLM, args.llm_rate_limit)
+    if args.search_rate_limit:
+        set_rate_limit(SEARCH, args.search_rate_limit)
+
+    report_kwargs = {
+        "max_questions": args.max_questions,
+        "max_sections": args.max_sections,
+        "max_concurrency": args.section_concurrency,
+        "search_prefetch": args.search_prefetch,
+    }
+    if args.graph_depth is not None:
+        graph_limits = GraphLimits.from_env()
+        graph_limits.max_depth = args.graph_depth
+        report_kwargs["graph_limits"] = graph_limits
+    if args.token_budget:
+        report_kwargs["budget"] = UsageBudget(max_tokens=args.token_budget, mode=args.budget_mode)
+
+    summary = run_batch(topics, args.output_dir, concurrency=args.concurrency, refine_mode=args.refine_mode,
+                        share_caches=not args.no_shared_cache, **report_kwargs)
+    print(format_batch_summary(summary))
+    return 0 if summary["completed"] == len(topics) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
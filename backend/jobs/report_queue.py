@@ -0,0 +1,367 @@
+import bisect
+import itertools
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from backend.agents.streaming import ReportGenerator
+from backend.agents.cancellation import CancellationToken, OperationCancelled
+from backend.agents.events import OUTLINE, SECTION_START, SECTION_DONE, METRICS, REPORT_DONE
+'''
+后台报告任务队列：报告在有界工作线程池中生成，与Streamlit脚本的重跑解耦，
+页面通过任务编号轮询或订阅生成进度；多个用户的任务由调度器按用户轮转排队和限流
+'''
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (COMPLETED, FAILED, CANCELLED)
+# 任务结束后保留的事件类型，逐token输出的章节内容等其余事件在任务结束时丢弃
+RETAINED_EVENT_TYPES = (OUTLINE, SECTION_START, SECTION_DONE, METRICS, REPORT_DONE)
+
+
+class JobQueueFull(Exception):
+    """排队任务已达上限，或该用户的排队任务已达上限"""
+
+
+class ReportJob:
+    """
+    一个报告生成任务，生成过程的输出按顺序保存，任意数量的读者可以从任意位置读取
+
+    任务结束时只保留RETAINED_EVENT_TYPES中的事件，之后读取得到的是大纲、章节结果、统计和完整报告，
+    不再是完整的生成过程；读取位置仍按原输出编号计算。
+    """
+    def __init__(self, owner: str, topic: Optional[str], refine_mode: str = "rewrite",
+                 resume_report_id: Optional[str] = None, report_kwargs: Optional[Dict[str, Any]] = None):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.owner = owner
+        self.topic = topic
+        self.refine_mode = refine_mode
+        self.resume_report_id = resume_report_id
+        self.report_kwargs = report_kwargs or {}
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # 检查点中的报告编号，任务开始后才确定
+        self.report_id: Optional[str] = resume_report_id
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.cancel_token = CancellationToken()
+        self._chunks: List[Any] = []
+        # 任务结束压缩输出后，保留的每条输出在原输出中的位置
+        self._positions: Optional[List[int]] = None
+        self._total = 0
+        self._condition = threading.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def _append(self, chunk: Any):
+        with self._condition:
+            self._chunks.append(chunk)
+            self._total += 1
+            self._condition.notify_all()
+
+    def _compact(self):
+        # 调用方需持有self._condition
+        kept = [(position, chunk) for position, chunk in enumerate(self._chunks)
+                if getattr(chunk, "type", None) in RETAINED_EVENT_TYPES]
+        self._positions = [position for position, _ in kept]
+        self._chunks = [chunk for _, chunk in kept]
+
+    def _set_status(self, status: str, error: Optional[str] = None):
+        with self._condition:
+            self.status = status
+            if status == RUNNING:
+                self.started_at = time.time()
+            if status in FINISHED_STATUSES:
+                self.finished_at = time.time()
+                self._compact()
+            if error is not None:
+                self.error = error
+            self._condition.notify_all()
+
+    def read(self, offset: int = 0, timeout: Optional[float] = None) -> Tuple[List[Any], bool]:
+        """
+        读取offset之后的输出，没有新输出时最多等待timeout秒
+
+        Args:
+            offset: 已读取的输出数量
+            timeout: 等待新输出的时间，None表示一直等到有新输出或任务结束
+
+        Returns:
+            (新输出列表, 任务是否已结束且输出已读完)；任务结束后一次返回offset之后保留的全部输出
+        """
+        with self._condition:
+            if self._total <= offset and not self.done:
+                self._condition.wait_for(lambda: self._total > offset or self.done, timeout=timeout)
+            if self._positions is None:
+                chunks = self._chunks[offset:]
+            else:
+                chunks = self._chunks[bisect.bisect_left(self._positions, offset):]
+            return chunks, self.done
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待任务结束，返回任务是否已结束"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self.done, timeout=timeout)
+
+    def stream(self, offset: int = 0) -> Generator[Any, None, None]:
+        """订阅任务输出，从offset开始按顺序输出，直到任务结束"""
+        while True:
+            chunks, finished = self.read(offset)
+            offset += len(chunks)
+            yield from chunks
+            if finished:
+                return
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "owner": self.owner,
+            "topic": self.topic,
+            "status": self.status,
+            "report_id": self.report_id,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "chunks": self._total,
+        }
+
+
+class ReportJobQueue:
+    """
+    本地报告任务队列
+
+    max_workers个工作线程同时生成报告；每个用户最多同时运行max_running_per_owner个任务、
+    排队max_queued_per_owner个任务，调度器在用户之间轮转取任务，单个用户提交大量任务不会挤占其他用户。
+    默认值可以通过环境变量REPORT_MAX_WORKERS、REPORT_MAX_QUEUED、REPORT_MAX_QUEUED_PER_USER、
+    REPORT_MAX_RUNNING_PER_USER配置。
+    """
+    def __init__(self, max_workers: Optional[int] = None, max_queued: Optional[int] = None,
+                 max_queued_per_owner: Optional[int] = None, max_running_per_owner: Optional[int] = None,
+                 generator_factory: Callable[..., ReportGenerator] = ReportGenerator, keep_finished: int = 50):
+        """
+        Args:
+            max_workers: 同时生成的报告数量上限
+            max_queued: 排队任务总数上限
+            max_queued_per_owner: 每个用户排队任务数上限
+            max_running_per_owner: 每个用户同时运行的任务数上限
+            generator_factory: 创建报告生成器的函数，接受refine_mode参数
+            keep_finished: 保留的已结束任务数量，超出后丢弃最早结束的任务
+        """
+        self.max_workers = max_workers or int(os.getenv("REPORT_MAX_WORKERS", "2"))
+        self.max_queued = max_queued or int(os.getenv("REPORT_MAX_QUEUED", "20"))
+        self.max_queued_per_owner = max_queued_per_owner or int(os.getenv("REPORT_MAX_QUEUED_PER_USER", "3"))
+        self.max_running_per_owner = max_running_per_owner or int(os.getenv("REPORT_MAX_RUNNING_PER_USER", "1"))
+        self.generator_factory = generator_factory
+        self.keep_finished = keep_finished
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._work_available = threading.Condition(self._lock)
+        self._jobs: "OrderedDict[str, ReportJob]" = OrderedDict()
+        # 每个用户的排队任务，字典顺序即调度器的轮转顺序
+        self._pending: "OrderedDict[str, deque]" = OrderedDict()
+        self._running: Dict[str, int] = {}
+        self._shutdown = False
+        self._workers = [
+            threading.Thread(target=self._worker_loop, name=f"report-job-{i}", daemon=True)
+            for i in range(self.max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, topic: str, owner: str = "default", refine_mode: str = "rewrite", **report_kwargs: Any) -> ReportJob:
+        """
+        提交报告生成任务
+
+        Args:
+            topic: 报告主题
+            owner: 提交任务的用户，用于公平调度和限流
+            refine_mode: 章节提炼方式
+            **report_kwargs: 传给generate_full_report的其他参数
+
+        Returns:
+            排队中的任务
+
+        Raises:
+            JobQueueFull: 排队任务已达上限
+        """
+        return self._enqueue(ReportJob(owner, topic, refine_mode, report_kwargs=report_kwargs))
+
+    def submit_resume(self, report_id: str, owner: str = "default", **resume_kwargs: Any) -> ReportJob:
+        """
+        提交从检查点继续生成报告的任务，参数同ReportGenerator.resume
+
+        Raises:
+            JobQueueFull: 排队任务已达上限
+        """
+        return self._enqueue(ReportJob(owner, None, resume_report_id=report_id, report_kwargs=resume_kwargs))
+
+    def _enqueue(self, job: ReportJob) -> ReportJob:
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("任务队列已关闭")
+            pending_total = sum(len(jobs) for jobs in self._pending.values())
+            if pending_total >= self.max_queued:
+                raise JobQueueFull(f"排队任务已达上限（{self.max_queued}个），请稍后再试")
+            owner_pending = self._pending.setdefault(job.owner, deque())
+            if len(owner_pending) >= self.max_queued_per_owner:
+                raise JobQueueFull(f"每个用户最多排队{self.max_queued_per_owner}个任务，请等待已提交的任务完成")
+            owner_pending.append(job)
+            self._jobs[job.job_id] = job
+            self._prune_finished()
+            self._work_available.notify()
+        return job
+
+    def get(self, job_id: Optional[str]) -> Optional[ReportJob]:
+        with self._lock:
+            return self._jobs.get(job_id) if job_id else None
+
+    def list_jobs(self, owner: Optional[str] = None) -> List[ReportJob]:
+        with self._lock:
+            return [job for job in self._jobs.values() if owner is None or job.owner == owner]
+
+    def position(self, job_id: str) -> int:
+        """
+        任务前面还有多少个排队任务，按调度器的轮转顺序估算；任务不在排队中时返回0
+        """
+        with self._lock:
+            order = []
+            queues = [list(jobs) for jobs in self._pending.values()]
+            for round_jobs in itertools.zip_longest(*queues):
+                order.extend(job for job in round_jobs if job is not None)
+            for i, job in enumerate(order):
+                if job.job_id == job_id:
+                    return i
+            return 0
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        取消任务：排队中的任务直接移出队列，运行中的任务通过取消令牌立即中止进行中的模型和网络请求
+
+        Returns:
+            任务是否存在且尚未结束
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return False
+            owner_pending = self._pending.get(job.owner)
+            if owner_pending is not None and job in owner_pending:
+                owner_pending.remove(job)
+                job._set_status(CANCELLED)
+        # 在锁外取消，回调中可能要等待其他锁
+        job.cancel_token.cancel("报告生成已取消")
+        return True
+
+    def shutdown(self, cancel_running: bool = True):
+        """停止接受新任务，取消排队任务；cancel_running为True时同时取消运行中的任务"""
+        with self._lock:
+            self._shutdown = True
+            for owner_pending in self._pending.values():
+                for job in owner_pending:
+                    job._set_status(CANCELLED)
+                owner_pending.clear()
+            running = [job for job in self._jobs.values() if job.status == RUNNING] if cancel_running else []
+            self._work_available.notify_all()
+        for job in running:
+            job.cancel_token.cancel("任务队列已关闭")
+
+    def _prune_finished(self):
+        # 调用方需持有self._lock
+        finished = [job for job in self._jobs.values() if job.done]
+        for job in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job.job_id]
+
+    def _next_job(self) -> Optional[ReportJob]:
+        # 调用方需持有self._lock；在未达到运行上限的用户之间轮转取任务
+        for owner in list(self._pending.keys()):
+            owner_pending = self._pending[owner]
+            if not owner_pending:
+                del self._pending[owner]
+                continue
+            if self._running.get(owner, 0) >= self.max_running_per_owner:
+                continue
+            job = owner_pending.popleft()
+            # 取过任务的用户移到轮转顺序的末尾
+            self._pending.move_to_end(owner)
+            if not owner_pending:
+                del self._pending[owner]
+            self._running[owner] = self._running.get(owner, 0) + 1
+            return job
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._lock:
+                job = self._next_job()
+                while job is None and not self._shutdown:
+                    self._work_available.wait()
+                    job = self._next_job()
+                if job is None:
+                    return
+            try:
+                self._run(job)
+            finally:
+                with self._lock:
+                    self._running[job.owner] -= 1
+                    if not self._running[job.owner]:
+                        del self._running[job.owner]
+                    # 该用户的下一个任务可能因为运行上限在等待
+                    self._work_available.notify_all()
+
+    def _run(self, job: ReportJob):
+        job._set_status(RUNNING)
+        stream = None
+        try:
+            generator = self.generator_factory(refine_mode=job.refine_mode)
+            if job.resume_report_id:
+                stream = generator.resume(job.resume_report_id, cancel_token=job.cancel_token, **job.report_kwargs)
+            else:
+                stream = generator.generate_full_report(job.topic, cancel_token=job.cancel_token, **job.report_kwargs)
+            while True:
+                try:
+                    chunk = next(stream)
+                except StopIteration as e:
+                    job.result = e.value
+                    break
+                if job.report_id is None and generator.checkpoint is not None:
+                    job.report_id = generator.checkpoint.report_id
+                if job.topic is None and generator.checkpoint is not None:
+                    job.topic = generator.checkpoint.data["topic"]
+                job._append(chunk)
+            job._set_status(COMPLETED)
+        except OperationCancelled as e:
+            # 用户取消或超出用量预算，原因记录在error中
+            job._set_status(CANCELLED, error=str(e) or None)
+        except Exception as e:
+            self.logger.error(f"报告任务 {job.job_id} 出错: {str(e)}")
+            job._set_status(FAILED, error=str(e))
+        finally:
+            if stream is not None:
+                stream.close()
+
+
+_default_queue: Optional[ReportJobQueue] = None
+_default_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> ReportJobQueue:
+    """获取进程级默认任务队列，第一次调用时创建；Streamlit每次重跑脚本都拿到同一个队列"""
+    global _default_queue
+    with _default_queue_lock:
+        if _default_queue is None:
+            _default_queue = ReportJobQueue()
+        return _default_queue
@@ -5,12 +5,17 @@ import os
 import time
 from typing import List, Dict, Any
 import json
+import uuid
 
 # 添加项目根目录到 Python 路径
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-# 导入报告生成器
-from backend.agents.streaming import ReportGenerator
+# 导入报告任务队列
+from backend.agents.checkpoint import ReportCheckpoint
+from backend.agents.usage import UsageBudget, BUDGET_STOP, BUDGET_DEGRADE, format_usage
+from backend.agents.question_graph import GraphLimits
+from backend.jobs.report_queue import get_job_queue, JobQueueFull, QUEUED, FAILED, CANCELLED
+from frontend.report_renderer import ReportRenderer
 
 # 页面配置
 st.set_page_config(
@@ -26,6 +31,15 @@ st.title("📊 智能报告生成")
 st.write("这是一个智能报告生成工具，可以根据主题自动生成结构化报告。")
 st.caption("系统会自动搜索相关信息并生成完整报告内容。")
 
+# 报告在后台任务队列中生成，页面重跑或多个用户同时使用都不会中断生成
+job_queue = get_job_queue()
+if "client_id" not in st.session_state:
+    st.session_state.client_id = uuid.uuid4().hex
+if "job_id" not in st.session_state:
+    st.session_state.job_id = None
+if "rendered_job_id" not in st.session_state:
+    st.session_state.rendered_job_id = None
+
 # 侧边栏配置
 with st.sidebar:
     st.header("报告设置")
@@ -39,13 +53,40 @@ with st.sidebar:
                                       help="限制报告生成的最大章节数")
         max_questions = st.number_input("每章节最大问题数", min_value=1, max_value=5, value=1, 
                                        help="每个章节处理的最大问题数量")
+        max_concurrency = st.number_input("并发章节数", min_value=1, max_value=8, value=2,
+                                          help="同时生成的章节数量上限，1表示逐章生成")
+        search_prefetch = st.number_input("预检索问题数", min_value=0, max_value=5, value=1,
+                                          help="整合当前问题时提前检索后续问题的数量，0表示逐个问题处理")
+        graph_depth = st.number_input("追问深度", min_value=0, max_value=3, value=0,
+                                      help="每层问题检索完成后根据证据中的缺口生成追问的层数，0表示不追问")
+        refine_mode = st.selectbox("章节整合方式", options=["rewrite", "delta"],
+                                   format_func=lambda mode: {"rewrite": "整章重写", "delta": "段落级增量修改"}[mode],
+                                   help="增量修改只让模型返回需要修改的段落，章节较长时更快")
+        token_budget = st.number_input("token预算", min_value=0, value=0, step=10000,
+                                       help="本次生成的输入和输出token总数上限，0表示不限制")
+        budget_mode = st.selectbox("超出预算时", options=[BUDGET_DEGRADE, BUDGET_STOP],
+                                   format_func=lambda mode: {BUDGET_DEGRADE: "降级：用已有内容完成报告", BUDGET_STOP: "停止生成"}[mode])
+        reuse_outline = st.checkbox("复用相近主题的大纲", value=True,
+                                    help="之前生成过相近主题的报告时直接使用其大纲，不再调用模型生成大纲")
     
     # 生成报告按钮
     generate_button = st.button("生成报告", type="primary", use_container_width=True)
+
+    # 从检查点继续生成未完成的报告
+    resume_button = False
+    unfinished_reports = [report for report in ReportCheckpoint.list_reports() if report["status"] != "completed"]
+    if unfinished_reports:
+        with st.expander("继续未完成的报告"):
+            resume_report_id = st.selectbox("报告", options=[report["report_id"] for report in unfinished_reports],
+                                            format_func=lambda report_id: next(
+                                                f"{report['topic']}（{report_id}）" for report in unfinished_reports
+                                                if report["report_id"] == report_id))
+            resume_button = st.button("继续生成", use_container_width=True)
     
     # 取消生成按钮
     if "generating" in st.session_state and st.session_state.generating:
         if st.button("取消生成", type="secondary", use_container_width=True):
+            job_queue.cancel(st.session_state.job_id)
             st.session_state.generating = False
             st.rerun()
     
@@ -71,6 +112,42 @@ if "generating" not in st.session_state:
     st.session_state.generating = False
 if "live_sections" not in st.session_state:
     st.session_state.live_sections = []
+if "report_usage" not in st.session_state:
+    st.session_state.report_usage = None
+
+# 提交报告生成任务，继续生成时沿用原报告的主题和设置，只采用当前的并发和预算设置
+if generate_button or resume_button:
+    # 没有设置token预算时使用环境变量中的预算
+    budget = UsageBudget(max_tokens=int(token_budget), mode=budget_mode) if token_budget else None
+    # 追问的节点数、token和耗时上限沿用环境变量中的设置
+    graph_limits = GraphLimits.from_env()
+    graph_limits.max_depth = int(graph_depth)
+    try:
+        if resume_button:
+            job = job_queue.submit_resume(resume_report_id, owner=st.session_state.client_id,
+                                          max_concurrency=max_concurrency, search_prefetch=search_prefetch,
+                                          budget=budget)
+        else:
+            job = job_queue.submit(
+                report_topic,
+                owner=st.session_state.client_id,
+                refine_mode=refine_mode,
+                max_questions=max_questions,
+                max_sections=max_sections,
+                max_concurrency=max_concurrency,
+                search_prefetch=search_prefetch,
+                budget=budget,
+                reuse_outline=reuse_outline,
+                graph_limits=graph_limits
+            )
+        st.session_state.job_id = job.job_id
+        st.session_state.rendered_job_id = None
+    except JobQueueFull as e:
+        st.warning(str(e))
+
+job = job_queue.get(st.session_state.job_id)
+# 本次要渲染新任务时不再绘制上一份报告，渲染器从空容器开始输出
+render_job = job is not None and st.session_state.rendered_job_id != job.job_id
 
 # 创建两列布局
 col1, col2 = st.columns([3, 2])
@@ -81,7 +158,7 @@ with col1:
     process_container = st.container(height=600, border=True)
     
     # 显示生成过程
-    if st.session_state.report_content:
+    if st.session_state.report_content and not render_job:
         with process_container:
             st.markdown(st.session_state.report_content)
 
@@ -91,83 +168,81 @@ with col2:
     st.subheader("报告结构")
     structure_container = st.container(height=200, border=True)
     with structure_container:
-        if st.session_state.report_structure:
-            st.json(st.session_state.report_structure)
-        else:
-            st.info("报告结构将在生成过程中显示")
+        if not render_job:
+            if st.session_state.report_structure:
+                st.json(st.session_state.report_structure)
+            else:
+                st.info("报告结构将在生成过程中显示")
     
     # 当前章节内容
     st.subheader("当前章节内容")
     content_container = st.container(height=350, border=True)
     with content_container:
-        if st.session_state.refined_doc:
-            st.markdown(st.session_state.refined_doc)
-        else:
-            st.info("章节内容将在生成过程中更新")
+        if not render_job:
+            if st.session_state.refined_doc:
+                st.markdown(st.session_state.refined_doc)
+            else:
+                st.info("章节内容将在生成过程中更新")
 
-# 处理报告生成
-if generate_button:
+# 订阅任务输出：页面重跑后从头重放任务已有的输出并继续跟随，任务结束且已显示完的不再重放
+if render_job:
     # 重置状态
     st.session_state.report_content = ""
     st.session_state.report_structure = None
     st.session_state.current_section = None
     st.session_state.refined_doc = ""
+    st.session_state.report_usage = None
     st.session_state.generating = True
     
-    # 创建报告生成器
-    generator = ReportGenerator()
-    
-    # 使用st.empty()创建可更新的容器
-    process_placeholder = process_container.empty()
+    # 使用st.empty()创建可更新的容器，事件经渲染器缓冲后按帧率刷新
+    status_placeholder = process_container.empty()
     structure_placeholder = structure_container.empty()
     content_placeholder = content_container.empty()
+    renderer = ReportRenderer(process_container, structure_placeholder, content_placeholder)
     
-    try:
-        # 生成报告
-        for chunk in generator.generate_full_report(
-            topic=report_topic,
-            max_questions=max_questions,
-            max_sections=max_sections
-        ):
-            # 检查是否取消生成
-            if not st.session_state.generating:
-                process_placeholder.markdown(st.session_state.report_content + "\n\n**报告生成已取消**")
-                break
-                
-            
-            
-            # 检查是否包含报告结构信息
-            if "报告结构已生成" in chunk and st.session_state.report_structure is None:
-                    # 提取结构信息
-                structure_text = chunk.split("报告结构已生成：")[1].strip()
-                    # 尝试找到JSON对象的开始和结束位置
-                    
-                st.session_state.report_structure = structure_text
-                structure_placeholder.json(st.session_state.report_structure)
-            # 更新生成过程
-            else:
-                st.session_state.report_content += chunk
-                process_placeholder.markdown(st.session_state.report_content)
-            # 检查是否是新章节开始
-            if "开始生成章节:" in chunk:
-                section_title = chunk.split("开始生成章节:")[1].strip()
-                st.session_state.current_section = section_title
-                st.session_state.refined_doc = ""  # 重置当前章节内容
-            
-            # 检查是否包含章节内容更新
-            if "当前章节内容更新：" in chunk:
-                st.session_state.refined_doc = chunk.split("当前章节内容更新：\n")[1].strip()
-                content_placeholder.markdown(st.session_state.refined_doc)
-            
-            # 添加一点延迟，让UI有时间更新
-            time.sleep(0.01)
-        
-        # 生成完成
-        st.session_state.generating = False
-        
-    except Exception as e:
-        st.error(f"报告生成出错: {str(e)}")
-        st.session_state.generating = False
+    offset = 0
+    while True:
+        chunks, finished = job.read(offset, timeout=0.5)
+        offset += len(chunks)
+        if job.status == QUEUED:
+            status_placeholder.info(f"任务排队中，前面还有 {job_queue.position(job.job_id)} 个任务")
+        elif offset == len(chunks) and chunks:
+            status_placeholder.empty()
+
+        for event in chunks:
+            renderer.handle(event)
+        # 没有新事件时也把缓冲中的内容刷新出来
+        renderer.flush()
+
+        if finished:
+            break
+    
+    # 生成结束
+    renderer.close()
+    st.session_state.report_content = renderer.text()
+    st.session_state.report_structure = renderer.structure
+    st.session_state.current_section = renderer.current_section
+    st.session_state.refined_doc = renderer.section_content
+    st.session_state.report_usage = renderer.usage
+    st.session_state.generating = False
+    st.session_state.rendered_job_id = job.job_id
+    if job.status == FAILED:
+        st.error(f"报告生成出错: {job.error}")
+    elif job.status == CANCELLED:
+        cancelled_text = f"**报告生成已取消**：{job.error}" if job.error else "**报告生成已取消**"
+        st.session_state.report_content += f"\n\n{cancelled_text}"
+        process_container.markdown(cancelled_text)
+
+# 模型用量：合计和按章节（大纲生成单独计）的明细
+if st.session_state.report_usage:
+    with st.expander(f"模型用量：{format_usage(st.session_state.report_usage)}"):
+        st.table([
+            {"范围": name, "调用次数": stats["calls"], "输入tokens": stats["input_tokens"],
+             "输出tokens": stats["output_tokens"], "费用": round(stats["cost"], 4)}
+            for name, stats in st.session_state.report_usage["by_scope"].items()
+        ])
+        if st.session_state.report_usage["exceeded"]:
+            st.warning(st.session_state.report_usage["exceeded"])
 
 # 添加页脚
 st.markdown("---")
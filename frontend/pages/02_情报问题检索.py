@@ -1,4 +1,5 @@
 import streamlit as st
+import asyncio
 import random
 import time
 import sys
@@ -9,7 +10,8 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")
 
 # 导入 ChatSearchAgent
 from backend.agents.Chat_Search_Agent import ChatSearchAgent
-from langchain.chat_models import init_chat_model
+from backend.agents.model_registry import get_routed_model
+from backend.agents.usage import format_usage
 
 # 页面配置
 st.set_page_config(
@@ -28,7 +30,7 @@ st.caption("支持知识库检索和网络搜索功能。")
 # 初始化 ChatSearchAgent
 @st.cache_resource
 def get_agent():
-    llm = init_chat_model("deepseek-chat", model_provider="deepseek", temperature=0)
+    llm = get_routed_model("default")
     return ChatSearchAgent(llm=llm)
 
 agent = get_agent()
@@ -36,6 +38,9 @@ agent = get_agent()
 # 初始化聊天历史
 if "messages" not in st.session_state:
     st.session_state.messages = [{"role": "assistant", "content": "你好！我是 AI 情报检索助手，让我们开始聊天吧！ 👋", "citation": ""}]
+# 本次会话的模型用量合计
+if "chat_usage" not in st.session_state:
+    st.session_state.chat_usage = {"turns": 0, "calls": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0}
 
 # 显示聊天历史
 for message in st.session_state.messages:
@@ -43,6 +48,8 @@ for message in st.session_state.messages:
         st.markdown(message["content"])
         if message.get("citation") and message["role"] == "assistant":
             st.markdown(f"<div style='font-size: 0.8em; color: gray;'>{message['citation']}</div>", unsafe_allow_html=True)
+        if message.get("usage"):
+            st.caption(format_usage(message["usage"]))
 
 # 接收用户输入
 if prompt := st.chat_input("请输入你的问题..."):
@@ -64,7 +71,7 @@ if prompt := st.chat_input("请输入你的问题..."):
         message_placeholder.markdown("正在思考中...")
         
         # 调用 ChatSearchAgent 处理查询
-        result = agent.process_query(query=prompt, search_mode=search_mode)
+        result = asyncio.run(agent.aprocess_query(query=prompt, search_mode=search_mode))
         
         full_response = result["answer"]
         citation = result["citation"]
@@ -76,8 +83,16 @@ if prompt := st.chat_input("请输入你的问题..."):
         if citation:
             citation_placeholder.markdown(f"<div style='font-size: 0.8em; color: gray;'>{citation}</div>", unsafe_allow_html=True)
         
+        # 显示本轮的模型用量
+        usage = result.get("usage")
+        if usage:
+            st.caption(format_usage(usage))
+            st.session_state.chat_usage["turns"] += 1
+            for key in ("calls", "input_tokens", "output_tokens", "cost"):
+                st.session_state.chat_usage[key] += usage["total"][key]
+        
     # 将助手回复添加到聊天历史
-    st.session_state.messages.append({"role": "assistant", "content": full_response, "citation": citation})
+    st.session_state.messages.append({"role": "assistant", "content": full_response, "citation": citation, "usage": usage})
 
 # 添加侧边栏配置选项
 with st.sidebar:
@@ -107,6 +122,14 @@ with st.sidebar:
         key="chat_style"
     )
     
+    # 本次会话的模型用量
+    with st.expander("模型用量"):
+        chat_usage = st.session_state.chat_usage
+        st.metric("问答轮数", chat_usage["turns"])
+        st.metric("模型调用次数", chat_usage["calls"])
+        st.metric("输入 / 输出 tokens", f"{chat_usage['input_tokens']} / {chat_usage['output_tokens']}")
+        st.metric("费用", f"{chat_usage['cost']:.4f}")
+    
     # 添加清除聊天按钮
     if st.button("清除聊天历史"):
         st.session_state.messages = [{"role": "assistant", "content": "聊天历史已清除。让我们重新开始！ 👋", "citation": ""}]
@@ -0,0 +1,145 @@
+import time
+from typing import Any, Dict, List, Optional
+from backend.agents.events import ReportEvent, OUTLINE, SECTION_START, SECTION_DONE, DELTA, METRICS
+from backend.agents.section_document import apply_change
+'''
+报告生成过程的增量渲染：事件先写入缓冲，按固定帧率或累计字节数刷新界面，
+已完成的章节渲染为静态块，之后不再重绘，只重绘正在生成的章节的末尾部分
+'''
+
+
+class ReportRenderer:
+    """
+    把ReportGenerator的事件渲染到Streamlit页面
+
+    生成过程按章节分块：每个章节开始时在process_container中追加一个新块，
+    章节完成后该块最后渲染一次完整内容，之后不再更新；正在生成的块只渲染最后tail_chars个字符。
+    两次刷新之间至少间隔frame_interval秒，除非未渲染的内容超过flush_bytes字节。
+    """
+    def __init__(self, process_container: Any, structure_placeholder: Any, content_placeholder: Any,
+                 frame_interval: float = 0.2, flush_bytes: int = 4096, tail_chars: int = 3000):
+        """
+        Args:
+            process_container: 生成过程容器，每个章节在其中追加一个块
+            structure_placeholder: 报告结构占位元素
+            content_placeholder: 当前章节内容占位元素
+            frame_interval: 两次刷新的最小间隔（秒）
+            flush_bytes: 未渲染内容超过该字节数时立即刷新
+            tail_chars: 正在生成的块最多渲染的字符数
+        """
+        self.process_container = process_container
+        self.structure_placeholder = structure_placeholder
+        self.content_placeholder = content_placeholder
+        self.frame_interval = frame_interval
+        self.flush_bytes = flush_bytes
+        self.tail_chars = tail_chars
+
+        self.structure = None
+        # METRICS事件中的模型用量汇总
+        self.usage: Optional[Dict[str, Any]] = None
+        self.current_section: Optional[str] = None
+        self.blocks: List[str] = []
+        self._active_parts: List[str] = []
+        self._active_placeholder = process_container.empty()
+        self._section_parts: List[str] = []
+        self._pending_bytes = 0
+        self._process_dirty = False
+        self._content_dirty = False
+        self._structure_dirty = False
+        self._last_flush = 0.0
+
+    @property
+    def active_text(self) -> str:
+        return "".join(self._active_parts)
+
+    @property
+    def section_content(self) -> str:
+        """当前章节的最新内容"""
+        return "".join(self._section_parts)
+
+    def text(self) -> str:
+        """已渲染的完整生成过程"""
+        return "".join(self.blocks) + self.active_text
+
+    def handle(self, event: ReportEvent):
+        """处理一个事件，必要时刷新界面"""
+        if event.type == OUTLINE:
+            self.structure = event.data["structure"]
+            self._structure_dirty = True
+        elif event.type == SECTION_START:
+            self._finish_block()
+            self.current_section = event.section
+            self._section_parts = []
+            self._content_dirty = True
+            self._append(event.text)
+        elif event.type == DELTA:
+            # reset表示开始了新一版章节内容
+            if event.data["reset"]:
+                self._section_parts = []
+            if event.data.get("change"):
+                self._section_parts = [apply_change("".join(self._section_parts), event.data["change"])]
+            else:
+                self._section_parts.append(event.data["content"])
+            self._content_dirty = True
+            self._append(event.text)
+        elif event.type == SECTION_DONE:
+            # 任务结束后重放时逐token的内容已被丢弃，章节内容以完成事件为准
+            if event.data.get("content"):
+                self._section_parts = [event.data["content"]]
+                self._content_dirty = True
+            self._append(event.text)
+            self._finish_block()
+        elif event.type == METRICS:
+            self.usage = event.data.get("usage")
+            self._append(event.text)
+        else:
+            self._append(event.text)
+        self.flush()
+
+    def _append(self, text: str):
+        if text:
+            self._active_parts.append(text)
+            self._pending_bytes += len(text.encode("utf-8"))
+            self._process_dirty = True
+
+    def _finish_block(self):
+        """把正在生成的块最后完整渲染一次，之后的输出写入新块"""
+        if not self._active_parts:
+            return
+        block = self.active_text
+        self._active_placeholder.markdown(block)
+        self.blocks.append(block)
+        self._active_parts = []
+        self._active_placeholder = self.process_container.empty()
+        self._process_dirty = False
+        self._pending_bytes = 0
+
+    def flush(self, force: bool = False):
+        """
+        刷新界面
+
+        Args:
+            force: 忽略帧率限制立即刷新
+        """
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.frame_interval and self._pending_bytes < self.flush_bytes:
+            return
+        if self._structure_dirty:
+            self.structure_placeholder.json(self.structure)
+            self._structure_dirty = False
+        if self._process_dirty:
+            text = self.active_text
+            if len(text) > self.tail_chars:
+                text = "……\n\n" + text[-self.tail_chars:]
+            self._active_placeholder.markdown(text)
+            self._process_dirty = False
+        if self._content_dirty:
+            self.content_placeholder.markdown(self.section_content)
+            self._content_dirty = False
+        self._pending_bytes = 0
+        self._last_flush = now
+
+    def close(self):
+        """生成结束时调用，完整渲染最后一个块"""
+        self.flush(force=True)
+        self._finish_block()
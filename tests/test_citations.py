@@ -0,0 +1,40 @@
+from backend.agents.citations import apply_citations, render_source_list
+
+SOURCES = [
+    {"title": "来源一", "url": "https://a.example"},
+    {"title": "来源二", "url": "https://b.example"},
+    {"title": "来源三", "url": "https://c.example"},
+]
+
+
+def test_citations_are_renumbered_in_order_of_first_use():
+    answer, source_list = apply_citations("结论A[3]，结论B[[1]]，结论C[3, 1]。", SOURCES)
+    assert answer == "结论A[1]，结论B[2]，结论C[1][2]。"
+    assert source_list == render_source_list([SOURCES[2], SOURCES[0]])
+
+
+def test_out_of_range_brackets_are_left_unchanged():
+    answer, _ = apply_citations("另见[2024]年报告[2]，第[9]条。", SOURCES)
+    assert answer == "另见[2024]年报告[1]，第[9]条。"
+
+
+def test_out_of_range_numbers_are_dropped_from_mixed_markers():
+    answer, _ = apply_citations("结论[2，7]", SOURCES)
+    assert answer == "结论[1]"
+
+
+def test_without_valid_citations_all_sources_are_listed():
+    answer, source_list = apply_citations("没有引用的回答[2024]", SOURCES)
+    assert answer == "没有引用的回答[2024]"
+    assert source_list == render_source_list(SOURCES)
+
+
+def test_trailing_model_source_list_is_removed():
+    answer, _ = apply_citations("结论[1]。\n\n**参考来源：**\n[1] 来源一, https://a.example\n- [2] 来源二, https://b.example\n", SOURCES)
+    assert answer == "结论[1]。"
+
+
+def test_source_heading_followed_by_answer_text_is_kept():
+    text = "结论[1]。\n\n参考资料\n以上数据来自公开报道，仍需进一步核实。"
+    answer, _ = apply_citations(text, SOURCES)
+    assert answer == text
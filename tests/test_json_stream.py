@@ -0,0 +1,56 @@
+from backend.agents.json_stream import IncrementalJsonArrayParser
+
+
+def feed_in_chunks(parser, text, size=3):
+    items = []
+    for i in range(0, len(text), size):
+        items += parser.feed(text[i:i + size])
+    return items
+
+
+def test_top_level_array_items_are_parsed_as_they_complete():
+    parser = IncrementalJsonArrayParser()
+    assert parser.feed('[{"op": "append", "text": "a"}, {"op"') == [{"op": "append", "text": "a"}]
+    assert parser.feed(': "delete", "id": "p1"}]') == [{"op": "delete", "id": "p1"}]
+    assert parser.done
+    assert parser.result() == [{"op": "append", "text": "a"}, {"op": "delete", "id": "p1"}]
+
+
+def test_leading_prose_and_code_fence_are_ignored():
+    parser = IncrementalJsonArrayParser()
+    items = feed_in_chunks(parser, '好的，修改如下：\n```json\n[{"op": "replace", "id": "p2", "text": "新内容"}]\n```')
+    assert items == [{"op": "replace", "id": "p2", "text": "新内容"}]
+
+
+def test_brackets_and_escapes_inside_strings():
+    parser = IncrementalJsonArrayParser()
+    items = feed_in_chunks(parser, '[{"text": "含有]和}以及\\"引号\\"[p1]"}]', size=1)
+    assert items == [{"text": '含有]和}以及"引号"[p1]'}]
+
+
+def test_array_key_parses_nested_array_items():
+    parser = IncrementalJsonArrayParser(array_key="structure")
+    text = '{"title": "报告", "structure": [{"subtitle": "一", "content": ["x"]}, {"subtitle": "二", "content": []}]}'
+    items = feed_in_chunks(parser, text)
+    assert [item["subtitle"] for item in items] == ["一", "二"]
+    assert parser.result()["title"] == "报告"
+
+
+def test_array_key_skips_braces_in_prose():
+    parser = IncrementalJsonArrayParser(array_key="structure")
+    items = feed_in_chunks(parser, '说明{示例}如下 {"structure": [{"subtitle": "一"}]}')
+    assert items == [{"subtitle": "一"}]
+
+
+def test_prose_with_bracketed_numbers_is_not_an_edit_list():
+    parser = IncrementalJsonArrayParser()
+    assert parser.feed("全文重写内容 [1] 引用") == []
+    # 正文中的方括号数字会被当作完整的JSON数组，调用方需要检查元素类型
+    assert parser.result() == [1]
+
+
+def test_unfinished_array_has_no_result():
+    parser = IncrementalJsonArrayParser()
+    parser.feed('[{"op": "append"')
+    assert not parser.done
+    assert parser.result() is None
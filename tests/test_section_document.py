@@ -0,0 +1,70 @@
+from backend.agents.section_document import SectionDocument, apply_change, format_change
+
+BASE = "第一段。\n\n第二段。\n\n第三段。"
+
+
+def test_from_text_splits_on_blank_lines():
+    document = SectionDocument.from_text("  第一段。\n第一段续。\n\n\n第二段。  ")
+    assert document.paragraph_ids == ["p1", "p2"]
+    assert document.paragraphs == ["第一段。\n第一段续。", "第二段。"]
+    assert document.render_with_ids() == "[p1] 第一段。\n第一段续。\n\n[p2] 第二段。"
+
+
+def test_apply_edit_returns_positional_changes():
+    document = SectionDocument.from_text(BASE)
+    assert document.apply_edit({"op": "replace", "id": "p2", "text": "[p2] 新的第二段"}) == \
+        {"op": "replace", "index": 1, "id": "p2", "text": "新的第二段"}
+    assert document.apply_edit({"op": "insert_after", "id": "start", "text": "开头"}) == \
+        {"op": "insert", "index": 0, "id": "p4", "text": "开头"}
+    assert document.apply_edit({"op": "append", "text": "结尾"}) == \
+        {"op": "insert", "index": 4, "id": "p5", "text": "结尾"}
+    assert document.apply_edit({"op": "delete", "id": "p1"}) == {"op": "delete", "index": 1, "id": "p1"}
+    assert document.render() == "开头\n\n新的第二段\n\n第三段。\n\n结尾"
+
+
+def test_invalid_edits_are_ignored():
+    document = SectionDocument.from_text(BASE)
+    assert document.apply_edit({"op": "replace", "id": "p9", "text": "x"}) is None
+    assert document.apply_edit({"op": "replace", "id": "p1", "text": "  "}) is None
+    assert document.apply_edit({"op": "delete", "id": "p9"}) is None
+    assert document.apply_edit({"op": "rewrite", "text": "x"}) is None
+    assert document.apply_edit("not an edit") is None
+    assert document.render() == BASE
+
+
+def test_insert_after_unknown_id_appends():
+    document = SectionDocument.from_text(BASE)
+    change = document.apply_edit({"op": "insert_after", "id": "p9", "text": "末尾"})
+    assert change["index"] == 3
+    assert document.paragraphs[-1] == "末尾"
+
+
+def test_apply_change_matches_document_render():
+    document = SectionDocument.from_text(BASE)
+    text = BASE
+    edits = [
+        {"op": "replace", "id": "p2", "text": "新的第二段\n\n含空行"},
+        {"op": "insert_after", "id": "start", "text": "开头"},
+        {"op": "append", "text": "结尾"},
+        {"op": "delete", "id": "p1"},
+        {"op": "insert_after", "id": "p3", "text": "第三段之后"},
+        {"op": "delete", "id": "p5"},
+    ]
+    for edit in edits:
+        change = document.apply_edit(edit)
+        assert change is not None
+        text = apply_change(text, change)
+        assert text == document.render()
+    # 段落内的空行被合并，按空行重新切分时段落位置不变
+    assert SectionDocument.from_text(text).paragraphs == document.paragraphs
+
+
+def test_apply_change_on_empty_text():
+    assert apply_change(None, {"op": "insert", "index": 0, "id": "p1", "text": "第一段"}) == "第一段"
+    assert apply_change("", {"op": "delete", "index": 0, "id": "p1"}) == ""
+
+
+def test_format_change():
+    assert format_change({"op": "replace", "index": 1, "id": "p2", "text": "新"}) == "修改第2段：新"
+    assert format_change({"op": "insert", "index": 0, "id": "p4", "text": "开头"}) == "新增第1段：开头"
+    assert format_change({"op": "delete", "index": 2, "id": "p3"}) == "删除第3段"